@@ -0,0 +1,97 @@
+"""
+Runs the benchmark scenarios against a local fake Kubernetes API server.
+
+Usage: python -m benchmarks [--scale 0.1] [--latency 0.002] [--errors 409=0.05,429=0.01] [--json results.json]
+                            [scenario ...]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+from .fakeapi import FakeApiProcess
+
+# The intervals that delay the writes in production and the client-side rate limit only add waiting to the measured
+# times. They can be set explicitly to measure them too.
+BENCHMARK_ENVIRONMENT = {
+    'OBJECT_CLONER_API_QPS': '0',
+    'OBJECT_CLONER_LOG_LEVEL': 'ERROR',
+    'OBJECT_CLONER_METRICS_PORT': '0',
+    'OBJECT_CLONER_NAMESPACE_BATCH_INTERVAL': '0.01',
+    'OBJECT_CLONER_STATUS_WRITE_INTERVAL': '0',
+    'OBJECT_CLONER_SYNC_DEBOUNCE_INTERVAL': '0',
+    'OBJECT_CLONER_OBJECT_CACHE_MAX_OBJECTS': '100000',
+}
+
+
+def main():
+    """
+    Parse the arguments, run the scenarios and print the results.
+
+    :return:
+    """
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run, all if omitted')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of the object counts')
+    parser.add_argument('--latency', type=float, default=0.0, help='API request latency in seconds')
+    parser.add_argument('--errors', default='', help='comma-delimited HTTP status=probability pairs to inject')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace the memory, it slows down the run')
+    parser.add_argument('--json', help='file to write the results to')
+    args = parser.parse_args()
+    error_rates = {
+        int(status): float(rate) for status, rate in (pair.split('=') for pair in args.errors.split(',') if pair)
+    }
+    with FakeApiProcess(args.latency, error_rates) as fake, tempfile.TemporaryDirectory() as directory:
+        fake.write_kubeconfig(os.path.join(directory, 'kubeconfig'))
+        os.environ['KUBECONFIG'] = os.path.join(directory, 'kubeconfig')
+        for name, value in BENCHMARK_ENVIRONMENT.items():
+            os.environ.setdefault(name, value)
+        # pylint: disable=import-outside-toplevel
+        from .scenarios import SCENARIOS, Benchmark
+        unknown_scenarios = set(args.scenarios) - set(SCENARIOS)
+        if unknown_scenarios:
+            parser.error(f"unknown scenarios: {', '.join(sorted(unknown_scenarios))}; "
+                         f"available: {', '.join(SCENARIOS)}")
+        benchmark = Benchmark(fake, args.scale, not args.no_memory)
+        if benchmark.trace_memory:
+            tracemalloc.start()
+        asyncio.run(_run(benchmark, {name: SCENARIOS[name] for name in args.scenarios or SCENARIOS}))
+    _print_results(benchmark.results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as results_file:
+            json.dump(benchmark.results, results_file, indent=2)
+
+
+async def _run(benchmark, scenarios):
+    # pylint: disable=import-outside-toplevel
+    from objectcloner.operator.kubeapi import close_api
+    try:
+        for name, scenario in scenarios.items():
+            await benchmark.reset(name)
+            await scenario(benchmark)
+        await benchmark.reset(None)
+    finally:
+        await close_api()
+
+
+def _print_results(results):
+    rows = [('scenario', 'phase', 'wall, s', 'peak, MiB', 'API calls')] + [
+        (
+            result['scenario'],
+            result['phase'],
+            f"{result['wall_time']:.3f}",
+            '-' if result['peak_memory'] is None else f"{result['peak_memory'] / 1024 / 1024:.1f}",
+            ', '.join(f'{call}={count}' for call, count in result['api_calls'].items()) or '-'
+        )
+        for result in results
+    ]
+    widths = [max(len(row[column]) for row in rows) for column in range(4)]
+    for row in rows:
+        sys.stdout.write('  '.join(value.ljust(width) for value, width in zip(row, widths)) + '  ' + row[4] + '\n')
+
+
+if __name__ == '__main__':
+    main()
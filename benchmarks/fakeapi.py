@@ -0,0 +1,463 @@
+"""In-memory stand-in for the Kubernetes API server used by the benchmarks."""
+import asyncio
+import bisect
+import collections
+import copy
+import json
+import multiprocessing
+import random
+
+import aiohttp
+from aiohttp import web
+
+RESOURCES = {
+    ('', 'v1'): [
+        ('Namespace', 'namespaces', False),
+        ('Secret', 'secrets', True),
+        ('ConfigMap', 'configmaps', True),
+    ],
+    ('object-cloner.ideamix.es', 'v1'): [
+        ('ClusterObject', 'clusterobjects', True),
+    ],
+    ('coordination.k8s.io', 'v1'): [
+        ('Lease', 'leases', True),
+    ],
+}
+# The verbs an injected error can be returned for. The other errors are returned for any verb except watch.
+ERROR_VERBS = {
+    409: {'update', 'patch'},
+    422: {'patch'},
+}
+WATCH_HISTORY_SIZE = 10000
+
+
+class FakeApiServer:  # pylint: disable=too-many-instance-attributes
+    """
+    Keeps objects in memory and serves the subset of the Kubernetes API that the operator uses: discovery, get, list,
+    watch, create, update, patch (merge, JSON and apply patches), delete and deletecollection.
+
+    Every request can be delayed by a fixed latency, and errors can be injected with a given probability per status
+    code, e.g. {409: 0.05} makes 5% of updates and patches fail with a conflict. The requests are counted by verb and
+    resource. The /fake/ endpoints let a benchmark seed objects, reset the server and read the counters.
+    """
+
+    def __init__(self, latency=0.0, error_rates=None, seed=0):
+        """
+        :param latency: delay of every request in seconds
+        :param error_rates: dict of HTTP status code to the probability of returning it
+        :param seed: seed of the error injection
+        """
+        self.latency = latency
+        self.error_rates = error_rates or {}
+        self.random = random.Random(seed)
+        self.kinds = {
+            (group, version, plural): (kind, namespaced)
+            for (group, version), resources in RESOURCES.items() for kind, plural, namespaced in resources
+        }
+        self.objects = {}
+        self.collections = collections.defaultdict(dict)
+        self.calls = collections.Counter()
+        self.resource_version = 0
+        self.events = []
+        self._watchers = collections.defaultdict(list)
+
+    def make_app(self):
+        """
+        Build the web application.
+
+        :return: aiohttp.web.Application
+        """
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/fake/{action}', self.control)
+        app.router.add_route('*', '/{path:.*}', self.handle)
+        return app
+
+    async def control(self, request):
+        """
+        Serve the benchmark control endpoints.
+
+        :param request:
+        :return:
+        """
+        action = request.match_info['action']
+        if action == 'calls':
+            return web.json_response([[verb, plural, count] for (verb, plural), count in self.calls.items()])
+        if action == 'reset-calls':
+            self.calls.clear()
+        elif action == 'reset':
+            self.objects.clear()
+            self.collections.clear()
+            self.calls.clear()
+            self.events.clear()
+        elif action == 'objects':
+            for item in await request.json():
+                self.store(item['group'], item['version'], item['plural'], item['namespace'], item['object'])
+        else:
+            return web.Response(status=404, text='404 page not found')
+        return web.json_response({})
+
+    def store(self, group, version, plural, namespace, obj):  # pylint: disable=too-many-arguments
+        """
+        Create or replace an object without counting a call.
+
+        :param group:
+        :param version:
+        :param plural:
+        :param namespace: None for cluster-scoped objects
+        :param obj:
+        :return: the stored object
+        """
+        key = (group, version, plural, namespace, obj['metadata']['name'])
+        event_type = 'MODIFIED' if key in self.objects else 'ADDED'
+        obj = self._with_metadata(obj, namespace, uid=(self.objects.get(key) or obj)['metadata'].get('uid'))
+        self.objects[key] = self.collections[key[:4]][key[4]] = obj
+        self._emit(event_type, key, obj)
+        return obj
+
+    async def handle(self, request):
+        """
+        Serve a Kubernetes API request.
+
+        :param request:
+        :return:
+        """
+        route = self._parse_path(request.path)
+        if route is None:
+            return web.Response(status=404, text='404 page not found')
+        group, version, namespace, plural, name, subresource = route
+        if plural is None:
+            self.calls['discovery', ''] += 1
+            return web.json_response({'kind': 'APIResourceList', 'resources': [
+                {'name': plural, 'kind': kind, 'namespaced': namespaced}
+                for kind, plural, namespaced in RESOURCES[(group, version)]
+            ]})
+        verb = self._get_verb(request, name)
+        self.calls[verb, plural] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        error = self._get_injected_error(verb)
+        if error is not None:
+            return error
+        key = (group, version, plural, namespace, name)
+        if verb in ('get', 'update', 'patch', 'delete') and key not in self.objects \
+                and request.content_type != 'application/apply-patch+yaml':
+            return _status(404, 'NotFound', f'{name} not found')
+        return await getattr(self, f'_{verb}')(request, key, subresource)
+
+    async def _get(self, request, key, subresource):  # pylint: disable=unused-argument
+        return web.json_response(self.objects[key])
+
+    async def _list(self, request, key, subresource):  # pylint: disable=unused-argument
+        return web.json_response({
+            'kind': 'List',
+            'metadata': {'resourceVersion': str(self.resource_version)},
+            'items': self._select(key, request.query)
+        })
+
+    async def _create(self, request, key, subresource):  # pylint: disable=unused-argument
+        body = await request.json()
+        key = (*key[:4], body['metadata']['name'])
+        if key in self.objects:
+            return _status(409, 'AlreadyExists', f"{body['metadata']['name']} already exists")
+        return web.json_response(self.store(*key[:4], body), status=201)
+
+    async def _delete(self, request, key, subresource):  # pylint: disable=unused-argument
+        return web.json_response(self._remove(key))
+
+    async def _deletecollection(self, request, key, subresource):  # pylint: disable=unused-argument
+        for obj in self._select(key, request.query):
+            self._remove((*key[:4], obj['metadata']['name']))
+        return web.json_response({'kind': 'Status', 'status': 'Success'})
+
+    async def _update(self, request, key, subresource):
+        body = await request.json()
+        return self._replace(key, subresource, body, body)
+
+    async def _patch(self, request, key, subresource):
+        body = await request.json()
+        if key not in self.objects:
+            # An apply patch creates a missing object.
+            return web.json_response(self.store(*key[:4], body), status=201)
+        if request.content_type != 'application/json-patch+json':
+            return self._replace(key, subresource, body, _merge(copy.deepcopy(self.objects[key]), body))
+        new_object = copy.deepcopy(self.objects[key])
+        try:
+            for operation in body:
+                _apply_json_patch_operation(new_object, operation)
+        except (KeyError, IndexError, ValueError) as err:
+            return _status(422, 'Invalid', f'the patch cannot be applied: {err}')
+        return self._replace(key, subresource, {}, new_object)
+
+    def _replace(self, key, subresource, body, new_object):
+        current_object = self.objects[key]
+        resource_version = (body.get('metadata') or {}).get('resourceVersion')
+        if resource_version is not None and resource_version != current_object['metadata']['resourceVersion']:
+            return _status(409, 'Conflict', 'the object has been modified')
+        if subresource == 'status':
+            new_object = {**current_object, 'status': new_object.get('status')}
+        return web.json_response(self.store(*key[:4], new_object))
+
+    async def _watch(self, request, key, subresource):  # pylint: disable=unused-argument
+        response = web.StreamResponse()
+        response.content_type = 'application/json'
+        await response.prepare(request)
+        resource_version = int(request.query.get('resourceVersion') or 0)
+        if self.events and self.events[0][0] > resource_version + 1:
+            await response.write(_dump_event('ERROR', {'kind': 'Status', 'code': 410, 'message': 'too old'}))
+            return response
+        matches = _get_matcher(key, request.query)
+        # The watchers are indexed by the watched name, so an event wakes up only the watchers it may match.
+        watcher_key = (*key[:3], dict(_parse_selector(request.query.get('fieldSelector'))).get('metadata.name'))
+        watcher = (matches, asyncio.Queue())
+        self._watchers[watcher_key].append(watcher)
+        try:
+            position = bisect.bisect_right(self.events, resource_version, key=lambda event: event[0])
+            for event in self.events[position:]:
+                if matches(event[2], event[3]):
+                    await response.write(_dump_event(event[1], event[3]))
+                    resource_version = event[0]
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + float(request.query.get('timeoutSeconds', '300'))
+            while True:
+                try:
+                    event = await asyncio.wait_for(watcher[1].get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                if event[0] > resource_version:
+                    await response.write(_dump_event(event[1], event[3]))
+        finally:
+            self._watchers[watcher_key].remove(watcher)
+            if not self._watchers[watcher_key]:
+                del self._watchers[watcher_key]
+        return response
+
+    def _remove(self, key):
+        obj = self.objects.pop(key)
+        del self.collections[key[:4]][key[4]]
+        self.resource_version += 1
+        obj = {**obj, 'metadata': {**obj['metadata'], 'resourceVersion': str(self.resource_version)}}
+        self._emit('DELETED', key, obj, self.resource_version)
+        return obj
+
+    def _emit(self, event_type, key, obj, resource_version=None):
+        self.events.append((resource_version or int(obj['metadata']['resourceVersion']), event_type, key, obj))
+        if len(self.events) > 2 * WATCH_HISTORY_SIZE:
+            del self.events[:-WATCH_HISTORY_SIZE]
+        event = self.events[-1]
+        for watcher_key in ((*key[:3], key[4]), (*key[:3], None)):
+            for matches, queue in self._watchers.get(watcher_key, ()):
+                if matches(key, obj):
+                    queue.put_nowait(event)
+
+    def _with_metadata(self, obj, namespace, uid=None):
+        self.resource_version += 1
+        metadata = {**obj['metadata'], 'resourceVersion': str(self.resource_version)}
+        metadata['uid'] = uid or f'uid-{self.resource_version}'
+        if namespace is not None:
+            metadata['namespace'] = namespace
+        return {**obj, 'metadata': metadata}
+
+    def _select(self, key, query):
+        matches = _get_matcher(key, query)
+        if key[3] is not None:
+            collection_keys = [key[:4]]
+        else:
+            collection_keys = [collection_key for collection_key in self.collections if collection_key[:3] == key[:3]]
+        return [
+            obj for collection_key in collection_keys for name, obj in list(self.collections[collection_key].items())
+            if matches((*collection_key, name), obj)
+        ]
+
+    def _parse_path(self, path):
+        parts = [part for part in path.split('/') if part]
+        if parts[:1] == ['api'] and len(parts) >= 2:
+            group, version, rest = '', parts[1], parts[2:]
+        elif parts[:1] == ['apis'] and len(parts) >= 3:
+            group, version, rest = parts[1], parts[2], parts[3:]
+        else:
+            return None
+        if (group, version) not in RESOURCES:
+            return None
+        namespace = None
+        if len(rest) >= 3 and rest[0] == 'namespaces' and (group, version, rest[2]) in self.kinds:
+            namespace, rest = rest[1], rest[2:]
+        if rest and (group, version, rest[0]) not in self.kinds:
+            return None
+        rest += [None] * (3 - len(rest))
+        return group, version, namespace, *rest[:3]
+
+    def _get_verb(self, request, name):
+        if request.method == 'GET':
+            if name is not None:
+                return 'get'
+            return 'watch' if request.query.get('watch') == 'true' else 'list'
+        if request.method == 'DELETE':
+            return 'delete' if name is not None else 'deletecollection'
+        return {'POST': 'create', 'PUT': 'update', 'PATCH': 'patch'}[request.method]
+
+    def _get_injected_error(self, verb):
+        if verb == 'watch':
+            return None
+        for status, rate in self.error_rates.items():
+            if verb in ERROR_VERBS.get(status, (verb,)) and self.random.random() < rate:
+                return _status(status, 'Injected', f'injected {status} error')
+        return None
+
+
+class FakeApiProcess:
+    """
+    Runs a FakeApiServer in a child process, so its objects and its work are not accounted to the benchmark.
+    """
+
+    def __init__(self, latency=0.0, error_rates=None, seed=0):
+        self.arguments = (latency, error_rates or {}, seed)
+        self.url = None
+        self._process = None
+
+    def __enter__(self):
+        context = multiprocessing.get_context('spawn')
+        receiver, sender = context.Pipe(duplex=False)
+        self._process = context.Process(target=_serve, args=(sender, *self.arguments), daemon=True)
+        self._process.start()
+        self.url = f'http://127.0.0.1:{receiver.recv()}'
+        return self
+
+    def __exit__(self, *_):
+        self._process.terminate()
+        self._process.join()
+
+    def write_kubeconfig(self, path):
+        """
+        Write a kubeconfig file that points to the server.
+
+        :param path:
+        :return:
+        """
+        with open(path, 'w', encoding='utf-8') as kubeconfig:
+            json.dump({
+                'apiVersion': 'v1',
+                'kind': 'Config',
+                'clusters': [{'name': 'fake', 'cluster': {'server': self.url}}],
+                'users': [{'name': 'fake', 'user': {'token': 'fake'}}],
+                'contexts': [{'name': 'fake', 'context': {'cluster': 'fake', 'user': 'fake'}}],
+                'current-context': 'fake'
+            }, kubeconfig)
+
+    async def seed(self, objects):
+        """
+        Create or replace objects.
+
+        :param objects: list of (group, version, plural, namespace, object)
+        :return:
+        """
+        await self._call('objects', [
+            {'group': group, 'version': version, 'plural': plural, 'namespace': namespace, 'object': obj}
+            for group, version, plural, namespace, obj in objects
+        ])
+
+    async def get_calls(self):
+        """
+        Read the request counters.
+
+        :return: collections.Counter of (verb, plural) to the number of requests
+        """
+        return collections.Counter({(verb, plural): count for verb, plural, count in await self._call('calls')})
+
+    async def reset_calls(self):
+        """
+        Reset the request counters.
+
+        :return:
+        """
+        await self._call('reset-calls')
+
+    async def reset(self):
+        """
+        Delete all objects and reset the request counters.
+
+        :return:
+        """
+        await self._call('reset')
+
+    async def _call(self, action, body=None):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f'{self.url}/fake/{action}', json=body) as response:
+                response.raise_for_status()
+                return await response.json()
+
+
+def _serve(sender, latency, error_rates, seed):
+    async def serve():
+        runner = web.AppRunner(FakeApiServer(latency, error_rates, seed).make_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        sender.send(runner.addresses[0][1])
+        await asyncio.Event().wait()
+    asyncio.run(serve())
+
+
+def _get_matcher(key, query):
+    """
+    Build a function that checks whether an object belongs to the requested collection and matches its field and
+    label selectors.
+    """
+    fields = dict(_parse_selector(query.get('fieldSelector')))
+    labels = _parse_selector(query.get('labelSelector'))
+    name = fields.pop('metadata.name', None)
+    namespace = fields.pop('metadata.namespace', key[3])
+
+    def matches(object_key, obj):
+        if object_key[:3] != key[:3] or namespace not in (None, object_key[3]) or name not in (None, object_key[4]):
+            return False
+        object_labels = obj['metadata'].get('labels') or {}
+        return not fields and all(object_labels.get(label) == value for label, value in labels)
+    return matches
+
+
+def _parse_selector(selector):
+    if not selector:
+        return []
+    return [requirement.replace('==', '=').split('=', 1) for requirement in selector.split(',')]
+
+
+def _merge(target, patch):
+    for name, value in patch.items():
+        if value is None:
+            target.pop(name, None)
+        elif isinstance(value, dict) and isinstance(target.get(name), dict):
+            _merge(target[name], value)
+        else:
+            target[name] = value
+    return target
+
+
+def _apply_json_patch_operation(obj, operation):
+    path = [part.replace('~1', '/').replace('~0', '~') for part in operation['path'].split('/')[1:]]
+    parent = obj
+    for part in path[:-1]:
+        parent = parent[int(part)] if isinstance(parent, list) else parent[part]
+    name = path[-1]
+    if operation['op'] == 'test':
+        value = parent[int(name)] if isinstance(parent, list) else parent[name]
+        if value != operation['value']:
+            raise ValueError(f"{operation['path']} is not {operation['value']!r}")
+    elif operation['op'] == 'remove':
+        del parent[int(name) if isinstance(parent, list) else name]
+    elif isinstance(parent, list) and name == '-':
+        parent.append(operation['value'])
+    elif isinstance(parent, list) and operation['op'] == 'add':
+        parent.insert(int(name), operation['value'])
+    else:
+        parent[int(name) if isinstance(parent, list) else name] = operation['value']
+
+
+def _status(code, reason, message):
+    return web.json_response(
+        {'kind': 'Status', 'apiVersion': 'v1', 'status': 'Failure', 'code': code, 'reason': reason, 'message': message},
+        status=code
+    )
+
+
+def _dump_event(event_type, obj):
+    return (json.dumps({'type': event_type, 'object': obj}) + '\n').encode()
@@ -0,0 +1,268 @@
+"""
+Benchmark scenarios.
+
+The operator modules read their settings on import, so this module must be imported after the environment is set up.
+"""
+import asyncio
+import logging
+import time
+import tracemalloc
+
+from objectcloner.operator.clusterobject import ClusterObject, ClusterObjectSpec
+from objectcloner.operator.handlers import cluster_object_factory, new_namespace_batcher
+from objectcloner.operator.objectcache import object_cache
+from objectcloner.operator.resources import update_namespaced_object
+from objectcloner.operator.selectors import cluster_object_index
+from objectcloner.operator.statuswriter import status_writer
+from objectcloner.operator.syncqueue import sync_queue
+
+SOURCE_NAMESPACE = 'source'
+CLUSTER_OBJECT_GROUP = 'object-cloner.ideamix.es'
+
+logger = logging.getLogger('benchmarks')
+
+
+class Benchmark:
+    """
+    Runs the phases of a scenario and records their wall time, API calls and peak memory.
+    """
+
+    def __init__(self, fake, scale, trace_memory):
+        """
+        :param fake: FakeApiProcess
+        :param scale: multiplier of the object counts of the scenarios
+        :param trace_memory: whether to measure the peak memory with tracemalloc
+        """
+        self.fake = fake
+        self.scale = scale
+        self.trace_memory = trace_memory
+        self.scenario = None
+        self.cluster_objects = []
+        self.results = []
+
+    def scaled(self, count):
+        """
+        Scale an object count.
+
+        :param count:
+        :return: int, at least 1
+        """
+        return max(int(count * self.scale), 1)
+
+    async def run_phase(self, name, coroutine_function, *args):
+        """
+        Run and measure a phase.
+
+        :param name:
+        :param coroutine_function:
+        :param args:
+        :return: the result of the coroutine
+        """
+        await self.fake.reset_calls()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        started_at = time.perf_counter()
+        result = await coroutine_function(*args)
+        await status_writer.flush_all()
+        wall_time = time.perf_counter() - started_at
+        self.results.append({
+            'scenario': self.scenario,
+            'phase': name,
+            'wall_time': wall_time,
+            'peak_memory': tracemalloc.get_traced_memory()[1] if self.trace_memory else None,
+            'api_calls': {f'{verb} {plural}'.strip(): count for (verb, plural), count in
+                          sorted((await self.fake.get_calls()).items())}
+        })
+        return result
+
+    async def add_cluster_object(self, name, source_kind, namespaces_to_include, all_namespace_names):
+        """
+        Create a cluster object and index it, like the operator does on start. The cluster objects built from the index
+        see the namespaces of the last added cluster object.
+
+        :param name: name of the cluster object and its source object
+        :param source_kind: Secret or ConfigMap
+        :param namespaces_to_include: list of patterns
+        :param all_namespace_names: the list of the existing namespaces, it is shared with the cluster object
+        :return: ClusterObject
+        """
+        body = {
+            'apiVersion': f'{CLUSTER_OBJECT_GROUP}/v1',
+            'kind': 'ClusterObject',
+            'metadata': {'name': name, 'namespace': SOURCE_NAMESPACE, 'uid': f'uid-{name}'},
+            'spec': {
+                'sourceObject': {'group': '', 'version': 'v1', 'kind': source_kind},
+                'namespacesToInclude': namespaces_to_include,
+                'namespacesToExclude': [],
+                'fieldsToExclude': [],
+                'cleanupEvents': '',
+                'updateStrategy': 'Default'
+            },
+            'status': {}
+        }
+        await self.fake.seed([(CLUSTER_OBJECT_GROUP, 'v1', 'clusterobjects', SOURCE_NAMESPACE, body)])
+        cluster_object = ClusterObject(ClusterObjectSpec(body), all_namespace_names, logger)
+        cluster_object_index.add((SOURCE_NAMESPACE, name), cluster_object.spec)
+        cluster_object_factory.namespace_names = all_namespace_names
+        self.cluster_objects.append(cluster_object)
+        return cluster_object
+
+    async def start_informers(self):
+        """
+        Start caching the source objects and the clones of all cluster objects and wait until they are cached.
+
+        :return:
+        """
+        for cluster_object in self.cluster_objects:
+            object_cache.track(
+                (cluster_object.namespace, cluster_object.name),
+                *cluster_object.handled_object_attrs.values(),
+                cluster_object.namespace
+            )
+        await _wait_until(lambda: all(
+            object_cache.get_informer(*cluster_object.handled_object_attrs.values()) is not None
+            for cluster_object in self.cluster_objects
+        ))
+
+    async def reset(self, scenario):
+        """
+        Forget the state of the previous scenario.
+
+        :param scenario: name of the next scenario
+        :return:
+        """
+        self.scenario = scenario
+        object_cache.stop()
+        for cluster_object in self.cluster_objects:
+            cluster_object_index.remove((cluster_object.namespace, cluster_object.name))
+            status_writer.forget(cluster_object.spec)
+        self.cluster_objects = []
+        await self.fake.reset()
+
+
+async def one_secret_to_many_namespaces(benchmark):
+    """
+    1 Secret x 5000 namespaces: the initial sync, a sync without changes, a sync of a changed source object and the
+    cleanup.
+    """
+    namespace_names = [f'team-{index}' for index in range(benchmark.scaled(5000))]
+    await benchmark.fake.seed(
+        [_namespace(SOURCE_NAMESPACE)] + [_namespace(name) for name in namespace_names]
+        + [_source_object('secrets', 'Secret', 'shared', {'token': 'dG9rZW4='})]
+    )
+    all_namespace_names = [SOURCE_NAMESPACE] + namespace_names
+    cluster_object = await benchmark.add_cluster_object('shared', 'Secret', ['team-.*'], all_namespace_names)
+    await benchmark.start_informers()
+    source_object = await cluster_object.get_source_object()
+
+    async def select_and_normalize():
+        for _ in range(100):
+            cluster_object.get_target_namespace_names()
+            cluster_object.normalize_object(source_object)
+
+    await benchmark.run_phase('select namespaces x100', select_and_normalize)
+    await benchmark.run_phase('initial sync', sync_queue.sync, cluster_object)
+    await benchmark.run_phase('sync without changes', sync_queue.sync, cluster_object)
+    await benchmark.run_phase('source update', _update_and_sync, cluster_object, {'token': 'bmV3'})
+    await benchmark.run_phase('cleanup', cluster_object.delete_all_target_objects)
+
+
+async def namespace_burst(benchmark):
+    """
+    500 ClusterObjects x a burst of 100 new namespaces, each selected by all cluster objects.
+    """
+    cluster_object_count = benchmark.scaled(500)
+    await benchmark.fake.seed([_namespace(SOURCE_NAMESPACE)] + [
+        _source_object('secrets', 'Secret', f'shared-{index}', {'token': 'dG9rZW4='})
+        for index in range(cluster_object_count)
+    ])
+    all_namespace_names = [SOURCE_NAMESPACE]
+    for index in range(cluster_object_count):
+        await benchmark.add_cluster_object(f'shared-{index}', 'Secret', ['burst-.*'], all_namespace_names)
+    await benchmark.run_phase('start informers', benchmark.start_informers)
+    namespace_names = [f'burst-{index}' for index in range(benchmark.scaled(100))]
+    await benchmark.fake.seed([_namespace(name) for name in namespace_names])
+    all_namespace_names.extend(namespace_names)
+    await benchmark.run_phase(
+        'namespace burst',
+        asyncio.gather,
+        *(new_namespace_batcher.add(name) for name in namespace_names)
+    )
+
+
+async def large_config_map_updates(benchmark):
+    """
+    1 MB ConfigMap x 50 namespaces: the initial sync, 10 updates of a single key and the cleanup.
+    """
+    namespace_names = [f'app-{index}' for index in range(benchmark.scaled(50))]
+    data = {f'key-{index}': 'x' * 1024 for index in range(1024)}
+    await benchmark.fake.seed(
+        [_namespace(SOURCE_NAMESPACE)] + [_namespace(name) for name in namespace_names]
+        + [_source_object('configmaps', 'ConfigMap', 'large', data)]
+    )
+    cluster_object = await benchmark.add_cluster_object(
+        'large', 'ConfigMap', ['app-.*'], [SOURCE_NAMESPACE] + namespace_names
+    )
+    await benchmark.start_informers()
+    await benchmark.run_phase('initial sync', sync_queue.sync, cluster_object)
+
+    async def update_ten_times():
+        for update in range(10):
+            await _update_and_sync(cluster_object, {**data, 'key-0': str(update)})
+
+    await benchmark.run_phase('10 updates', update_ten_times)
+    await benchmark.run_phase('cleanup', cluster_object.delete_all_target_objects)
+
+
+SCENARIOS = {
+    'secret-5000-namespaces': one_secret_to_many_namespaces,
+    'cluster-objects-namespace-burst': namespace_burst,
+    'configmap-1mb-updates': large_config_map_updates,
+}
+
+
+async def _update_and_sync(cluster_object, data):
+    """
+    Change the source object and wait for the sync it triggers.
+
+    The sync is requested once the change is seen by the source object informer, so it is merged with the sync
+    requested by the informer event.
+    """
+    attrs = cluster_object.handled_object_attrs
+    source_object = await update_namespaced_object(
+        attrs['group'],
+        attrs['version'],
+        attrs['kind'],
+        SOURCE_NAMESPACE,
+        {'metadata': {'name': attrs['name']}, 'data': data}
+    )
+    resource_version = source_object['metadata']['resourceVersion']
+    await _wait_until(lambda: _get_cached_resource_version(cluster_object) == resource_version)
+    await sync_queue.sync(cluster_object)
+
+
+async def _wait_until(predicate, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError('the object cache is not updated in time')
+        await asyncio.sleep(0.01)
+
+
+def _get_cached_resource_version(cluster_object):
+    informer = object_cache.get_informer(*cluster_object.handled_object_attrs.values())
+    source_object = informer.get(SOURCE_NAMESPACE) if informer is not None else None
+    return source_object['metadata']['resourceVersion'] if source_object is not None else None
+
+
+def _namespace(name):
+    return '', 'v1', 'namespaces', None, {'apiVersion': 'v1', 'kind': 'Namespace', 'metadata': {'name': name}}
+
+
+def _source_object(plural, kind, name, data):
+    return '', 'v1', plural, SOURCE_NAMESPACE, {
+        'apiVersion': 'v1',
+        'kind': kind,
+        'metadata': {'name': name},
+        'data': data
+    }
@@ -2,17 +2,112 @@
 import kopf
 
 from .handlers import *
+from .helpers import get_allowed_object_kinds
+from .kubeapi import close_api
+from .metrics import start_metrics_server
+from .objectcache import object_cache
+from .resources import warm_object_kinds
+from .resync import resync_scheduler
+from .sharding import shard_coordinator
+from .statuswriter import status_writer
 
 
 @kopf.on.startup()
-def configure(settings: kopf.OperatorSettings, **_):
+async def configure(settings: kopf.OperatorSettings, **_):
     """
     Configure operator.
 
+    If the cluster objects are sharded, the operator waits until it holds a shard, and the replicas run standalone
+    and keep their kopf state apart.
+
     :param settings:
     :param _:
     :return:
     """
-    settings.persistence.finalizer = 'object-cloner.ideamix.es/kopf-finalizer'
-    settings.persistence.diffbase_storage = kopf.StatusDiffBaseStorage(name='kopf-object-cloner')
-    settings.persistence.progress_storage = kopf.StatusProgressStorage(field='status.kopf-object-cloner')
+    if shard_coordinator.is_enabled:
+        await shard_coordinator.acquire()
+        shard_coordinator.start()
+        settings.peering.standalone = True
+    cluster_object_factory.settings = settings
+    settings.persistence.finalizer = shard_coordinator.get_name(KOPF_FINALIZER)
+    settings.persistence.diffbase_storage = kopf.StatusDiffBaseStorage(
+        name=shard_coordinator.get_name('kopf-object-cloner')
+    )
+    settings.persistence.progress_storage = kopf.StatusProgressStorage(
+        field=f"status.{shard_coordinator.get_name('kopf-object-cloner')}"
+    )
+
+
+@kopf.on.startup()
+async def warm_discovery_cache(logger, **_):
+    """
+    Resolve the allowed object kinds in advance, so the first sync does not wait for API discovery.
+
+    :param logger:
+    :param _:
+    :return:
+    """
+    group_versions = {tuple(kind_selector[0:2]) for kind_selector in get_allowed_object_kinds()}
+    try:
+        await warm_object_kinds(group_versions)
+    except Exception as err:  # pylint: disable=broad-exception-caught
+        logger.warning(f'Cannot warm up the API discovery cache: {err}')
+
+
+@kopf.on.startup()
+def serve_metrics(logger, **_):
+    """
+    Expose the Prometheus metrics.
+
+    :param logger:
+    :param _:
+    :return:
+    """
+    port = start_metrics_server()
+    if port is not None:
+        logger.info(f'Serving metrics on port {port}')
+
+
+@kopf.on.startup()
+async def start_resync_scheduler(logger, **_):
+    """
+    Start the periodic resync of the cluster objects.
+
+    :param logger:
+    :param _:
+    :return:
+    """
+    if resync_scheduler.is_enabled:
+        resync_scheduler.start()
+        logger.info(f'Resyncing the cluster objects every {resync_scheduler.period} seconds')
+
+
+@kopf.on.probe(id='cachedObjects')
+def report_object_cache_readiness(**_):
+    """
+    Report how many informers of the object cache answer reads from memory. The probe fails until the object cache
+    is warm, so the operator is not ready while it loads the source objects and clones on start.
+
+    :param _:
+    :return:
+    """
+    ready_count, count = object_cache.count_ready_informers()
+    if not object_cache.is_warm():
+        raise kopf.PermanentError(f'The object cache is loading: {ready_count} of {count} informers are ready')
+    return {'readyInformers': ready_count, 'informers': count}
+
+
+@kopf.on.cleanup()
+async def close_kubernetes_api(**_):
+    """
+    Write the pending status changes, stop watching the cached objects and close the shared Kubernetes API client
+    on operator shutdown.
+
+    :param _:
+    :return:
+    """
+    await status_writer.flush_all()
+    resync_scheduler.stop()
+    object_cache.stop()
+    shard_coordinator.stop()
+    await close_api()
@@ -0,0 +1,37 @@
+"""Batching of the events that arrive in bursts."""
+import asyncio
+
+
+class Batcher:  # pylint: disable=too-few-public-methods
+    """
+    Collects the items added within a time window and processes them with a single function call.
+    """
+
+    def __init__(self, function, interval):
+        """
+        :param function: a coroutine function that accepts a list of items
+        :param interval: the time window in seconds
+        """
+        self.function = function
+        self.interval = interval
+        self._items = []
+        self._batch = None
+
+    async def add(self, item):
+        """
+        Add an item to the current batch and wait until the batch is processed.
+
+        :param item:
+        :return: the result of the function call
+        """
+        if item not in self._items:
+            self._items.append(item)
+        if self._batch is None:
+            self._batch = asyncio.ensure_future(self._process_later())
+        return await asyncio.shield(self._batch)
+
+    async def _process_later(self):
+        await asyncio.sleep(self.interval)
+        # The items added from now on are processed with the next batch.
+        items, self._items, self._batch = self._items, [], None
+        return await self.function(items)
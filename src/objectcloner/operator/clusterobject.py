@@ -1,99 +1,228 @@
 """Module that implements all cluster object logic."""
+import asyncio
+import copy
 import os
-import re
-import time
 
-from datetime import datetime
 import dictdiffer
 from mergedeep import merge
 from pykube.exceptions import HTTPError, ObjectDoesNotExist
 
-from .helpers import delete_fields
+from .fanout import run_for_namespaces
+from .helpers import get_field_exclusions, get_object_hash, null_missing_fields
+from .kubeapi import retry_policy
+from .metrics import API_RETRIES, RECREATIONS, SYNC_DURATION, SYNC_FANOUT
+from .objectcache import object_cache, source_object_cache
+from .selectors import get_label_requirements, get_namespace_selector
+from .statuswriter import get_status_format, status_writer
 from .resources import get_namespaced_object, \
+    apply_namespaced_object, \
     create_namespaced_object, \
     update_namespaced_object, \
-    delete_namespaced_object
+    delete_namespaced_object, \
+    delete_namespaced_objects, \
+    list_namespaced_objects
 
+SOURCE_HASH_ANNOTATION = 'object-cloner.ideamix.es/source-hash'
+OWNER_ANNOTATION = 'object-cloner.ideamix.es/owner'
+OWNER_UID_LABEL = 'object-cloner.ideamix.es/owner-uid'
+FIELDS_TO_EXCLUDE = (
+    '.status',
+    '.metadata.annotations',
+    '.metadata.creationTimestamp',
+    '.metadata.managedFields',
+    '.metadata.namespace',
+    '.metadata.ownerReferences',
+    '.metadata.resourceVersion',
+    '.metadata.uid',
+)
 
-class ClusterObject:
+
+class ClusterObjectSpec:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """
+    The part of a cluster object that its syncs need. It is kept in the cluster object indexes instead of the body,
+    so neither the status nor the other metadata of the cluster objects are kept in memory by the indexes. The
+    selector and the field exclusions are cached and shared by the cluster objects that have the same ones.
+
+    The spec is not changed after it is created, a changed cluster object gets a new spec.
+    """
+    __slots__ = (
+        'namespace',
+        'name',
+        'uid',
+        'generation',
+        'is_deleted',
+        'source_object_attrs',
+        'update_strategy',
+        'status_format',
+        'cleanup_events',
+        'namespace_selector',
+        'field_exclusions',
+    )
+
+    def __init__(self, body):
+        spec = body['spec']
+        self.namespace = body['metadata']['namespace']
+        self.name = body['metadata']['name']
+        self.uid = body['metadata'].get('uid', '')
+        self.generation = body['metadata'].get('generation')
+        self.is_deleted = bool(body['metadata'].get('deletionTimestamp'))
+        self.source_object_attrs = (
+            spec['sourceObject']['group'],
+            spec['sourceObject']['version'],
+            spec['sourceObject']['kind'],
+            spec['sourceObject'].get('name', self.name),
+        )
+        update_strategy = spec.get('updateStrategy', 'Default')
+        if update_strategy == 'Default':
+            update_strategy = os.environ.get('OBJECT_CLONER_UPDATE_STRATEGY', 'Auto')
+        self.update_strategy = update_strategy
+        self.status_format = get_status_format(body)
+        self.cleanup_events = frozenset(spec.get('cleanupEvents', '').split(','))
+        self.namespace_selector = get_namespace_selector(
+            tuple(spec.get('namespacesToInclude', ['.*'])),
+            tuple(spec.get('namespacesToExclude', []) + [self.namespace]),
+            get_label_requirements(spec.get('namespaceSelector'))
+        )
+        self.field_exclusions = get_field_exclusions(tuple(spec.get('fieldsToExclude', [])) + FIELDS_TO_EXCLUDE)
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError(f'{name} of a cluster object spec cannot be changed')
+        super().__setattr__(name, value)
+
+    @property
+    def reference(self):
+        """
+        Build a reference to the cluster object, e.g. for its kopf logger.
+
+        :return: dict with the apiVersion, kind and metadata
+        """
+        return {
+            'apiVersion': 'object-cloner.ideamix.es/v1',
+            'kind': 'ClusterObject',
+            'metadata': {'namespace': self.namespace, 'name': self.name, 'uid': self.uid}
+        }
+
+    def is_same(self, body):
+        """
+        Check whether the spec is still up to date with a changed cluster object, e.g. when only its status or
+        annotations were changed.
+
+        :param body: the cluster object
+        :return: bool
+        """
+        return self.generation is not None \
+            and self.generation == body['metadata'].get('generation') \
+            and self.uid == body['metadata'].get('uid', '') \
+            and self.is_deleted == bool(body['metadata'].get('deletionTimestamp'))
+
+
+class ClusterObject:  # pylint: disable=too-many-instance-attributes
     """
     Implements all cluster object logic.
+
+    The cluster objects are built on demand from their specs, see ClusterObjectSpec.
     """
 
-    def __init__(self, body, all_namespace_names, logger):
-        self.body = body
+    def __init__(self, spec, all_namespace_names, logger):
+        self.spec = spec
         self.all_namespace_names = all_namespace_names
         self.logger = logger
 
-        self.namespace = self.body['metadata']['namespace']
-        self.handled_object_attrs = {
-            'group': self.body['spec']['sourceObject']['group'],
-            'version': self.body['spec']['sourceObject']['version'],
-            'kind': self.body['spec']['sourceObject']['kind'],
-            'name': self.body['spec']['sourceObject'].get('name', self.body['metadata']['name']),
-        }
-
-        self.update_strategy = self.body['spec'].get('updateStrategy', 'Default')
-        if self.update_strategy == 'Default':
-            self.update_strategy = os.environ.get('OBJECT_CLONER_UPDATE_STRATEGY', 'Auto')
+        self.namespace = spec.namespace
+        self.name = spec.name
+        self.uid = spec.uid
+        self.handled_object_attrs = dict(zip(('group', 'version', 'kind', 'name'), spec.source_object_attrs))
+        self.update_strategy = spec.update_strategy
+        self.namespace_selector = spec.namespace_selector
+        self.field_exclusions = spec.field_exclusions
+        self.is_drift_verification_enabled = os.environ.get('OBJECT_CLONER_DRIFT_VERIFICATION', 'false') == 'true'
 
-    def get_source_object(self):
+    async def get_source_object(self):
         """
         Obtain definition for the source object.
 
         :return: dict
         """
-
-        source_object = get_namespaced_object(
-            self.handled_object_attrs['group'],
-            self.handled_object_attrs['version'],
-            self.handled_object_attrs['kind'],
-            self.namespace,
-            self.handled_object_attrs['name']
-        ).__dict__['obj']
+        informer = self._get_informer()
+        if informer is not None:
+            source_object = informer.get(self.namespace)
+            if source_object is None:
+                raise ObjectDoesNotExist(f"{self.handled_object_attrs['name']} does not exist.")
+        else:
+            source_object = await source_object_cache.get(
+                self.handled_object_attrs['group'],
+                self.handled_object_attrs['version'],
+                self.handled_object_attrs['kind'],
+                self.namespace,
+                self.handled_object_attrs['name']
+            )
         self.logger.debug(f'Source object: {source_object}')
-        self.normalize_object(source_object)
-        return source_object
+        return self.normalize_object(source_object)
 
     def normalize_object(self, obj):
         """
         Removes the object fields that should not be copied to a clone object.
 
+        The object is not modified: the returned object shares all values but the dicts the fields are removed from
+        with it, so neither of them should be modified in place.
+
         :param obj: source or target object to cleanup
-        :return: None
+        :return: dict
+        """
+        return self.field_exclusions.project(obj)
+
+    async def list_target_objects(self, namespace_name=None):
         """
+        Obtain all existing objects with the source object's kind and name from the object cache or, if they are not
+        cached, with a single list call.
 
-        fields_to_exclude = self.body['spec'].get('fieldsToExclude', []).copy()
-        fields_to_exclude.append('.status')
-        fields_to_exclude.append('.metadata.annotations')
-        fields_to_exclude.append('.metadata.creationTimestamp')
-        fields_to_exclude.append('.metadata.managedFields')
-        fields_to_exclude.append('.metadata.namespace')
-        fields_to_exclude.append('.metadata.ownerReferences')
-        fields_to_exclude.append('.metadata.resourceVersion')
-        fields_to_exclude.append('.metadata.uid')
-        fields_to_exclude_with_path_items = [field.strip(' .').split('.') for field in fields_to_exclude]
-        delete_fields(obj, fields_to_exclude_with_path_items)
+        The returned objects may be shared with the cache and must not be modified.
 
-    # pylint: disable=too-many-branches
-    def sync_to_namespaces(self, namespace_name=None):
+        :param namespace_name: limit the list to one namespace
+        :return: dict of namespace name to object
+        """
+        informer = self._get_informer()
+        if informer is not None:
+            return {
+                namespace: target_object for namespace, target_object in informer.objects.items()
+                if namespace_name in (None, namespace)
+            }
+        target_objects = await list_namespaced_objects(
+            self.handled_object_attrs['group'],
+            self.handled_object_attrs['version'],
+            self.handled_object_attrs['kind'],
+            namespace=namespace_name,
+            field_selector={'metadata.name': self.handled_object_attrs['name']}
+        )
+        return {target_object['metadata']['namespace']: target_object for target_object in target_objects}
+
+    async def sync_to_namespaces(self, namespace_name=None):
         """
         Sync a source object to one or more target namespaces.
 
-        :param namespace_name: one or more target namespaces
+        :param namespace_name: one or more target namespaces, all selected namespaces if omitted
         :type namespace_name: str, list
         :return:
         """
+        with SYNC_DURATION.labels(self.namespace, self.name).time():
+            return await self._sync_to_namespaces(namespace_name)
+
+    # pylint: disable=too-many-branches
+    async def _sync_to_namespaces(self, namespace_name):
         namespaces_to_add_object_to = []
         namespaces_to_update_object = []
-        namespace_names = self.get_target_namespace_names()
-        if namespace_name is not None:
-            if namespace_name in namespace_names:
-                namespace_names = [namespace_name]
-            else:
+        if namespace_name is None:
+            namespace_names = self.get_target_namespace_names()
+        else:
+            namespace_names = [
+                namespace for namespace in ([namespace_name] if isinstance(namespace_name, str) else namespace_name)
+                if self.is_target_namespace(namespace)
+            ]
+            if not namespace_names:
                 return False
         try:
-            source_object = self.get_source_object()
+            source_object = await self.get_source_object()
         except ObjectDoesNotExist:
             self.logger.info(
                 f'''
@@ -102,104 +231,216 @@ class ClusterObject:
                 '''
             )
             return False
+        target_objects = await self.list_target_objects(namespace_names[0] if len(namespace_names) == 1 else None)
+        source_object = self._label_source_object(source_object)
+        source_hash = get_object_hash(source_object)
         for namespace in namespace_names:
-            self.logger.info(f'Target namespace: {namespace}')
-            try:
-                target_object = get_namespaced_object(
-                    self.handled_object_attrs['group'],
-                    self.handled_object_attrs['version'],
-                    self.handled_object_attrs['kind'],
-                    namespace,
-                    self.handled_object_attrs['name']
-                ).__dict__['obj']
-                self.normalize_object(target_object)
-                if source_object != target_object:
-                    self.logger.info(
-                        f"""
-                        {source_object['metadata']['name']} objects in {self.namespace} and {namespace} are different:
-                        """
-                    )
-                    for diff in dictdiffer.diff(source_object, target_object):
-                        self.logger.info(diff)
-                    namespaces_to_update_object.append(namespace)
-            except ObjectDoesNotExist:
+            self.logger.debug(f'Target namespace: {namespace}')
+            if namespace not in target_objects:
                 namespaces_to_add_object_to.append(namespace)
+                continue
+            if self._is_target_object_changed(namespace, source_object, source_hash, target_objects[namespace]):
+                namespaces_to_update_object.append(namespace)
         self.logger.debug(f'Source object: {source_object}')
-        updated_namespaces = []
-        for namespace in namespaces_to_add_object_to:
-            self._create_target_object(namespace, source_object)
-            updated_namespaces.append(namespace)
-        for namespace in namespaces_to_update_object:
-            if self.update_strategy == 'AlwaysRecreate':
-                self._recreate_target_object(namespace, source_object)
-                updated_namespaces.append(namespace)
-            else:
-                patch_result = self._patch_target_object(namespace, source_object)
-                if patch_result:
-                    updated_namespaces.append(namespace)
-        self.update_namespace_sync_status(updated_namespaces)
+        # The hash is added after the comparison because the annotations are excluded from the compared objects.
+        source_object = self._annotate_source_object(source_object, source_hash)
+
+        async def sync_namespace(namespace):
+            return await self._write_target_object(namespace, source_object, target_objects.get(namespace))
+
+        SYNC_FANOUT.labels(self.namespace, self.name).set(
+            len(namespaces_to_add_object_to) + len(namespaces_to_update_object)
+        )
+        results, errors = await run_for_namespaces(
+            sync_namespace,
+            namespaces_to_add_object_to + namespaces_to_update_object
+        )
+        updated_namespaces = [namespace for namespace, is_updated in results.items() if is_updated]
+        await self.update_namespace_sync_status(
+            updated_namespaces,
+            failures={namespace: str(error) for namespace, error in errors.items()},
+            synced_namespaces=[namespace for namespace in namespace_names if namespace not in errors]
+        )
+        self._raise_first_error(errors)
         return True
 
-    def update_namespace_sync_status(self, namespaces, delete=False):
+    async def repair_target_object(self, namespace):
+        """
+        Restore a clone that was modified or deleted by someone else.
+
+        The clone is compared with the source object by the hash of its content, the source hash annotation is not
+        trusted, and is written only if they differ.
+
+        :param namespace:
+        :return: True if the clone was written
+        """
+        if self.spec.is_deleted or not self.is_target_namespace(namespace):
+            return False
+        try:
+            source_object = self._label_source_object(await self.get_source_object())
+        except ObjectDoesNotExist:
+            return False
+        target_object = (await self.list_target_objects(namespace)).get(namespace)
+        source_hash = get_object_hash(source_object)
+        if target_object is not None and get_object_hash(self.normalize_object(target_object)) == source_hash:
+            return False
+        self.logger.info(
+            f"{self.handled_object_attrs['kind']} {self.handled_object_attrs['name']} in {namespace} namespace "
+            f"is {'changed' if target_object is not None else 'deleted'}, restoring it"
+        )
+        is_written = await self._write_target_object(
+            namespace,
+            self._annotate_source_object(source_object, source_hash),
+            target_object
+        )
+        if is_written:
+            await self.update_namespace_sync_status([namespace])
+        return is_written
+
+    def is_target_namespace(self, namespace_name):
+        """
+        Check whether an existing namespace is selected.
+
+        :param namespace_name:
+        :return: bool
         """
-        Update syncedNamespaces list in the status subresource.
+        return namespace_name in self.all_namespace_names \
+            and self.namespace_selector.matches(namespace_name, self.all_namespace_names)
 
-        :param namespaces:
+    async def update_namespace_sync_status(self, namespaces, delete=False, failures=None, synced_namespaces=None):
+        """
+        Update the synced namespaces in the status subresource.
+
+        :param namespaces: list of namespace names
         :param delete: Whether to remove the namespace from the list
+        :param failures: dict of namespace name to error message for the namespaces that failed to sync
+        :param synced_namespaces: list of all namespaces that are in sync
         :return:
         """
-        now = datetime.strftime(datetime.utcnow(), '%Y-%m-%dT%H:%M:%SZ')
-        if self.body['status'].get('syncedNamespaces') is None:
-            self.body['status']['syncedNamespaces'] = []
-        for namespace in namespaces:
-            for namespace_status in self.body['status']['syncedNamespaces']:
-                if namespace_status['name'] == namespace:
-                    if delete:
-                        self.body['status']['syncedNamespaces'].remove(namespace_status)
-                    else:
-                        namespace_status['timestamp'] = now
-                    break
-            else:
-                if not delete:
-                    self.body['status']['syncedNamespaces'].append({
-                        'name': namespace,
-                        'timestamp': now
-                    })
-        version, group = [e[::-1] for e in (self.body['apiVersion'][::-1] + '/').split('/')[0:2]]
-        update_namespaced_object(
-            group,
-            version,
-            self.body['kind'],
-            self.namespace,
-            self.body,
-            subresource='status'
+        await status_writer.update(self.spec, namespaces, delete, failures, synced_namespaces)
+
+    def _is_target_object_changed(self, namespace, source_object, source_hash, target_object):
+        """
+        Check whether a clone object differs from the source object.
+
+        A clone is considered unchanged if it is annotated with the hash of the current source object. A full comparison
+        is done only if OBJECT_CLONER_DRIFT_VERIFICATION is enabled, for example, to find clones that were modified
+        by someone else.
+
+        :param namespace:
+        :param source_object: normalized source object
+        :param source_hash: hash of the normalized source object
+        :param target_object: clone object, it is not modified
+        :return: bool
+        """
+        annotations = target_object['metadata'].get('annotations') or {}
+        is_hash_changed = annotations.get(SOURCE_HASH_ANNOTATION) != source_hash
+        if not self.is_drift_verification_enabled:
+            return is_hash_changed
+        target_object = self.normalize_object(target_object)
+        if source_object == target_object:
+            return is_hash_changed
+        self.logger.info(
+            f"{source_object['metadata']['name']} objects in {self.namespace} and {namespace} are different"
         )
+        for diff in dictdiffer.diff(source_object, target_object):
+            self.logger.debug(diff)
+        return True
 
-    def _patch_target_object(self, namespace, source_object):
-        for _ in range(10):
-            target_object = get_namespaced_object(
-                self.handled_object_attrs['group'],
-                self.handled_object_attrs['version'],
-                self.handled_object_attrs['kind'],
-                namespace,
-                self.handled_object_attrs['name']
-            ).__dict__['obj']
+    def _label_source_object(self, source_object):
+        return {
+            **source_object,
+            'metadata': {
+                **source_object['metadata'],
+                'labels': {**(source_object['metadata'].get('labels') or {}), OWNER_UID_LABEL: self.uid}
+            }
+        }
+
+    def _annotate_source_object(self, source_object, source_hash):
+        return {
+            **source_object,
+            'metadata': {
+                **source_object['metadata'],
+                'annotations': {
+                    SOURCE_HASH_ANNOTATION: source_hash,
+                    OWNER_ANNOTATION: f"{self.namespace}/{self.name}"
+                }
+            }
+        }
+
+    async def _write_target_object(self, namespace, source_object, target_object):
+        """
+        Create or update a clone according to the update strategy.
+
+        :param namespace:
+        :param source_object: labeled and annotated source object
+        :param target_object: current clone or None if it does not exist
+        :return: True if the clone was written
+        """
+        if self.update_strategy == 'ServerSideApply':
+            return await self._apply_target_object(namespace, source_object, target_object)
+        if target_object is None:
+            await self._create_target_object(namespace, source_object)
+            return True
+        if self.update_strategy == 'AlwaysRecreate':
+            await self._recreate_target_object(namespace, source_object, target_object)
+            return True
+        return await self._patch_target_object(namespace, source_object, target_object)
+
+    def _get_informer(self):
+        return object_cache.get_informer(
+            self.handled_object_attrs['group'],
+            self.handled_object_attrs['version'],
+            self.handled_object_attrs['kind'],
+            self.handled_object_attrs['name']
+        )
+
+    def _store_target_object(self, target_object):
+        object_cache.store(
+            self.handled_object_attrs['group'],
+            self.handled_object_attrs['version'],
+            self.handled_object_attrs['kind'],
+            target_object
+        )
+
+    def _discard_target_object(self, namespace):
+        object_cache.discard(
+            self.handled_object_attrs['group'],
+            self.handled_object_attrs['version'],
+            self.handled_object_attrs['kind'],
+            namespace,
+            self.handled_object_attrs['name']
+        )
+
+    async def _patch_target_object(self, namespace, source_object, target_object):
+        target_object = copy.deepcopy(target_object)
+        for attempt in range(retry_policy.max_retries + 1):
+            if target_object is None:
+                target_object = await get_namespaced_object(
+                    self.handled_object_attrs['group'],
+                    self.handled_object_attrs['version'],
+                    self.handled_object_attrs['kind'],
+                    namespace,
+                    self.handled_object_attrs['name']
+                )
             try:
-                merge(target_object, source_object)
-                update_namespaced_object(
+                self._replace_target_content(target_object, source_object)
+                self._store_target_object(await update_namespaced_object(
                     self.handled_object_attrs['group'],
                     self.handled_object_attrs['version'],
                     self.handled_object_attrs['kind'],
                     namespace,
                     target_object
-                )
+                ))
             except HTTPError as err:
-                if err.code == 409:
+                if err.code == 409 and attempt < retry_policy.max_retries:
                     self.logger.warning(f'Object update conflict: {err}. Retrying...')
-                    time.sleep(2)
+                    API_RETRIES.labels('PATCH', err.code).inc()
+                    await asyncio.sleep(retry_policy.get_delay(attempt))
+                    target_object = None
                     continue
                 if err.code == 422:
-                    if target_object['immutable']:
+                    if target_object.get('immutable'):
                         self.logger.info(
                             f'immutable field for the {target_object["metadata"]["name"]} object is set to True: {err}'
                         )
@@ -213,73 +454,186 @@ class ClusterObject:
                         self.logger.info('Cannot updated the object - recreation is disabled.')
                         return False
                     self.logger.info('Recreating the object...')
-                    self._recreate_target_object(namespace, source_object, target_object)
+                    await self._recreate_target_object(namespace, source_object, target_object)
                     break
                 raise
             break
         return True
 
-    def _create_target_object(self, namespace, source_object):
-        create_namespaced_object(
+    def _replace_target_content(self, target_object, source_object):
+        """
+        Replace the content of a clone with the source object in place. The fields that are not copied, e.g. the status
+        and the resourceVersion the update is checked against, are kept, and the fields that only the clone has, e.g.
+        the ones added by someone else, are set to None, so the merge patch of the update deletes them.
+
+        :param target_object: the clone
+        :param source_object: labeled and annotated source object
+        :return:
+        """
+        null_missing_fields(target_object, self.normalize_object(target_object), source_object)
+        merge(target_object, source_object)
+
+    async def _apply_target_object(self, namespace, source_object, target_object=None):
+        """
+        Create or update a clone object with server-side apply. No prior read is needed and there are no update
+        conflicts; the object is recreated if the API server rejects the update, e.g. for an immutable object.
+
+        :param namespace:
+        :param source_object:
+        :param target_object: existing clone object, if known
+        :return: bool
+        """
+        try:
+            self._store_target_object(await apply_namespaced_object(
+                self.handled_object_attrs['group'],
+                self.handled_object_attrs['version'],
+                self.handled_object_attrs['kind'],
+                namespace,
+                source_object
+            ))
+        except HTTPError as err:
+            if err.code != 422:
+                raise
+            self.logger.info(f'Cannot apply the {source_object["metadata"]["name"]} object: {err}. Recreating...')
+            await self._recreate_target_object(namespace, source_object, target_object)
+        return True
+
+    async def _create_target_object(self, namespace, source_object):
+        self._store_target_object(await create_namespaced_object(
             self.handled_object_attrs['group'],
             self.handled_object_attrs['version'],
             self.handled_object_attrs['kind'],
             namespace,
             source_object
-        )
+        ))
 
-    def _recreate_target_object(self, namespace, source_object, target_object=None):
+    async def _recreate_target_object(self, namespace, source_object, target_object=None):
         if target_object is None:
-            target_object = get_namespaced_object(
+            target_object = await get_namespaced_object(
                 self.handled_object_attrs['group'],
                 self.handled_object_attrs['version'],
                 self.handled_object_attrs['kind'],
                 namespace,
                 self.handled_object_attrs['name']
-            ).__dict__['obj']
-        delete_namespaced_object(
-            self.handled_object_attrs['group'],
-            self.handled_object_attrs['version'],
-            self.handled_object_attrs['kind'],
-            namespace,
-            target_object
-        )
-        create_namespaced_object(
-            self.handled_object_attrs['group'],
-            self.handled_object_attrs['version'],
-            self.handled_object_attrs['kind'],
-            namespace,
-            source_object
-        )
+            )
+        await self._delete_target_object(namespace, target_object)
+        RECREATIONS.labels(self.handled_object_attrs['kind']).inc()
+        await self._create_target_object(namespace, source_object)
 
-    def delete_all_target_objects(self):
+    async def delete_all_target_objects(self):
         """
         Clean up all target objects.
 
+        The clones labeled with the cluster object's UID are deleted with a single call per namespace, so the clones
+        the status lost track of are deleted too. The clones created before the label was introduced are deleted
+        one by one.
+
         :return:
         """
-        synced_namespaces = [ns_status['name'] for ns_status in self.body['status'].get('syncedNamespaces', [])]
+        synced_namespaces = status_writer.get_synced_namespace_names(self.spec)
+        target_objects = await self.list_target_objects()
+        owned_namespaces = [
+            namespace for namespace, target_object in target_objects.items()
+            if (target_object['metadata'].get('labels') or {}).get(OWNER_UID_LABEL) == self.uid
+            and namespace != self.namespace
+        ]
+        if self.spec.status_format == 'Compact':
+            # The compact status does not list the namespaces, so the clones are also found by the owner annotation.
+            owner = f"{self.namespace}/{self.name}"
+            synced_namespaces = list(dict.fromkeys(synced_namespaces + [
+                namespace for namespace, target_object in target_objects.items()
+                if (target_object['metadata'].get('annotations') or {}).get(OWNER_ANNOTATION) == owner
+                and namespace != self.namespace
+                and self.namespace_selector.matches_name(namespace)
+            ]))
+
+        async def delete_target_object(namespace):
+            await self._delete_target_object(namespace, target_objects[namespace], namespace in owned_namespaces)
+
         for namespace in synced_namespaces:
-            try:
-                target_object = get_namespaced_object(
+            if namespace not in target_objects:
+                self.logger.warning(f'Object does not exist in {namespace} namespace')
+        _, errors = await run_for_namespaces(
+            delete_target_object,
+            list(dict.fromkeys(
+                owned_namespaces + [namespace for namespace in synced_namespaces if namespace in target_objects]
+            ))
+        )
+        self._raise_first_error(errors)
+
+    async def delete_target_objects(self, namespace_names):
+        """
+        Delete the clones from the namespaces that are no longer selected, e.g. because their labels changed.
+
+        The objects that are not clones of this cluster object are left untouched.
+
+        :param namespace_names: list of namespace names
+        :return:
+        """
+        target_objects = await self.list_target_objects(namespace_names[0] if len(namespace_names) == 1 else None)
+        owner = f"{self.namespace}/{self.name}"
+
+        async def delete_target_object(namespace):
+            await self._delete_target_object(namespace, target_objects[namespace])
+
+        _, errors = await run_for_namespaces(delete_target_object, [
+            namespace for namespace in namespace_names
+            if namespace in target_objects and namespace != self.namespace
+            and ((target_objects[namespace]['metadata'].get('labels') or {}).get(OWNER_UID_LABEL) == self.uid
+                 or (target_objects[namespace]['metadata'].get('annotations') or {}).get(OWNER_ANNOTATION) == owner)
+        ])
+        await self.update_namespace_sync_status(
+            [namespace for namespace in namespace_names if namespace not in errors],
+            delete=True
+        )
+        self._raise_first_error(errors)
+
+    async def _delete_target_object(self, namespace, target_object, is_owned=False):
+        """
+        Delete a clone.
+
+        The clone is removed from the object cache before the request, so the event of the deletion is not taken for
+        a deletion by someone else, and is put back if the request fails.
+
+        :param namespace:
+        :param target_object: the clone
+        :param is_owned: whether the clone is labeled with the cluster object's UID, the labeled clones are deleted by
+                         the label
+        :return:
+        """
+        self._discard_target_object(namespace)
+        try:
+            if is_owned:
+                await delete_namespaced_objects(
                     self.handled_object_attrs['group'],
                     self.handled_object_attrs['version'],
                     self.handled_object_attrs['kind'],
                     namespace,
-                    self.handled_object_attrs['name']
-                ).__dict__['obj']
-            except ObjectDoesNotExist as err:
-                self.logger.warning(f'Object does not exist: {err}')
-                continue
-            delete_namespaced_object(
-                self.handled_object_attrs['group'],
-                self.handled_object_attrs['version'],
-                self.handled_object_attrs['kind'],
-                namespace,
-                target_object
-            )
+                    label_selector={OWNER_UID_LABEL: self.uid}
+                )
+            else:
+                await delete_namespaced_object(
+                    self.handled_object_attrs['group'],
+                    self.handled_object_attrs['version'],
+                    self.handled_object_attrs['kind'],
+                    namespace,
+                    target_object
+                )
+        except Exception:
+            self._store_target_object(target_object)
+            raise
 
+    def _raise_first_error(self, errors):
+        """
+        Log all errors of a fan-out and re-raise the first one, so the handler is retried.
 
+        :param errors: dict of namespace name to exception
+        :return:
+        """
+        for namespace, error in errors.items():
+            self.logger.error(f'Failed to process the object in {namespace} namespace: {error}')
+        if errors:
+            raise next(iter(errors.values()))
 
     def get_target_namespace_names(self):
         """
@@ -287,17 +641,4 @@ class ClusterObject:
 
         :return: list of namespace names
         """
-        namespaces_to_include = self.body['spec'].get('namespacesToInclude', ['.*'])
-        namespaces_to_exclude = self.body['spec'].get('namespacesToExclude', []) + [self.body['metadata']['namespace']]
-        namespaces_names = []
-        for namespace in self.all_namespace_names:
-            for ns_to_include in namespaces_to_include:
-                if re.match(ns_to_include, namespace):
-                    for ns_to_exclude in namespaces_to_exclude:
-                        if re.match(ns_to_exclude, namespace):
-                            break
-                    else:
-                        namespaces_names.append(namespace)
-                        break
-                    break
-        return namespaces_names
+        return self.namespace_selector.select(self.all_namespace_names)
@@ -0,0 +1,40 @@
+"""Bounded concurrent execution of per-namespace operations."""
+import asyncio
+import os
+
+MAX_CONCURRENT_WRITES = int(os.environ.get('OBJECT_CLONER_MAX_CONCURRENT_WRITES', '20'))
+MAX_CONCURRENT_WRITES_PER_CLUSTER_OBJECT = int(
+    os.environ.get('OBJECT_CLONER_MAX_CONCURRENT_WRITES_PER_CLUSTER_OBJECT', '10')
+)
+
+_global_semaphore = asyncio.Semaphore(MAX_CONCURRENT_WRITES)
+
+
+async def run_for_namespaces(function, namespaces, max_concurrency=MAX_CONCURRENT_WRITES_PER_CLUSTER_OBJECT):
+    """
+    Await function(namespace) for each namespace concurrently.
+
+    The total number of concurrent calls made for all cluster objects is limited by
+    OBJECT_CLONER_MAX_CONCURRENT_WRITES, while max_concurrency limits the calls made for a single cluster object.
+
+    :param function: a coroutine function that accepts a namespace name
+    :param namespaces: list of namespace names
+    :param max_concurrency: maximum number of calls of this invocation that run at the same time
+    :return: tuple of two dicts - namespace name to result for successful calls and namespace name to exception
+             for failed ones
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(namespace):
+        async with semaphore, _global_semaphore:
+            return await function(namespace)
+
+    outcomes = await asyncio.gather(*(run(namespace) for namespace in namespaces), return_exceptions=True)
+    results = {}
+    errors = {}
+    for namespace, outcome in zip(namespaces, outcomes):
+        if isinstance(outcome, Exception):
+            errors[namespace] = outcome
+        else:
+            results[namespace] = outcome
+    return results, errors
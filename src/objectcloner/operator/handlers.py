@@ -1,14 +1,90 @@
 """Kopf handlers."""
+import asyncio
 import os
-import time
 
 import kopf
 
-from .clusterobject import ClusterObject
+from .batching import Batcher
+from .clusterobject import OWNER_ANNOTATION, OWNER_UID_LABEL, ClusterObject, ClusterObjectSpec
+from .metrics import NAMESPACES, forget_cluster_object
+from .objectcache import object_cache, source_object_cache
+from .resources import patch_namespaced_object
+from .selectors import cluster_object_index
+from .sharding import shard_coordinator
+from .statuswriter import status_writer
+from .syncqueue import sync_queue
+
+# The finalizer of the cluster objects, qualified with the shard if the cluster objects are sharded.
+KOPF_FINALIZER = 'object-cloner.ideamix.es/kopf-finalizer'
+# The finalizer that kopf added to the source objects when they were handled by kopf handlers.
+LEGACY_SOURCE_OBJECT_FINALIZER = KOPF_FINALIZER
+
+
+class NamespaceNames:
+    """
+    Live view of the namespace indexes: the names of all namespaces and the lookups of the namespaces by their labels.
+
+    The indexes are empty until the first namespace is indexed, and kopf runs the handlers only after all indexes are
+    populated, so the cluster objects can be indexed before the namespaces and read the names when they sync.
+    """
+
+    def __init__(self, names_index, labels_index, labeled_names_index):
+        self.names_index = names_index
+        self.labels_index = labels_index
+        self.labeled_names_index = labeled_names_index
+
+    def __iter__(self):
+        return iter(self.names_index.get(None, ()))
+
+    def __len__(self):
+        return len(self.names_index.get(None, ()))
+
+    def __contains__(self, name):
+        return name in self.labels_index
+
+    def get_labels(self, name):
+        """
+        Return the labels of a namespace.
+
+        :param name:
+        :return: dict of label to value, empty if the namespace does not exist
+        """
+        return next(iter(self.labels_index.get(name, ())), {})
+
+    def get_labeled(self, label, value=None):
+        """
+        Return the namespaces that have a label.
+
+        :param label:
+        :param value: the label value, any value if None
+        :return: set of namespace names
+        """
+        return set(self.labeled_names_index.get((label, value), ()))
+
+
+class ClusterObjectFactory:  # pylint: disable=too-few-public-methods
+    """
+    Builds the cluster objects of the indexed specs on demand, with the live view of the namespace indexes and a kopf
+    logger of the cluster object.
+    """
+
+    def __init__(self):
+        self.namespace_names = NamespaceNames({}, {}, {})
+        self.settings = kopf.OperatorSettings()
+
+    def __call__(self, spec):
+        return ClusterObject(
+            spec,
+            self.namespace_names,
+            kopf.ObjectLogger(body=spec.reference, settings=self.settings)
+        )
+
+
+cluster_object_factory = ClusterObjectFactory()
 
 
 @kopf.index('', 'v1', 'Namespace')
-def idx_namespace_names(name: str, **_):
+async def idx_namespace_names(name: str, **_):
     """
     Index for all namespace names
 
@@ -19,55 +95,90 @@ def idx_namespace_names(name: str, **_):
     return name
 
 
-@kopf.index('object-cloner.ideamix.es', 'v1', 'ClusterObject')
-# pylint: disable=redefined-outer-name
-def idx_handled_dynamic_objects(name, namespace, body, idx_namespace_names, logger, **_):
+@kopf.index('', 'v1', 'Namespace')
+async def idx_namespace_labels(name: str, labels, **_):
     """
-    Index for all source objects handled by the operator.
+    Index for the labels of all namespaces by namespace name
 
     :param name:
-    :param namespace:
-    :param body:
-    :param idx_namespace_names:
-    :param logger:
+    :param labels:
     :param _:
     :return:
     """
-    source_object_group = body['spec']['sourceObject']['group']
-    source_object_version = body['spec']['sourceObject']['version']
-    source_object_kind = body['spec']['sourceObject']['kind']
-    # pylint: disable=redefined-outer-name
-    while len(idx_namespace_names) == 0:
-        logger.info('idx_namespace_names has not been initialized yet. Sleeping...')
-        time.sleep(1)
-    logger.info(idx_namespace_names)
-    cluster_object = ClusterObject(body, idx_namespace_names[None], logger)
-    return {(source_object_group, source_object_version, source_object_kind, namespace, name): cluster_object}
+    return {name: dict(labels)}
 
 
-# pylint: disable=redefined-outer-name
-def is_of_interest(resource, namespace, name, idx_handled_dynamic_objects, **_):
+@kopf.index('', 'v1', 'Namespace')
+async def idx_labeled_namespace_names(name: str, labels, **_):
     """
-    Check if an object is handled by the operator.
+    Inverted index for the namespace names by label and value, and by label and None for any value
 
-    :param resource:
-    :param namespace:
     :param name:
-    :param idx_handled_dynamic_objects:
+    :param labels:
+    :param _:
+    :return:
+    """
+    return {
+        **{(label, value): name for label, value in labels.items()},
+        **{(label, None): name for label in labels}
+    }
+
+
+@kopf.index('object-cloner.ideamix.es', 'v1', 'ClusterObject')
+# pylint: disable=redefined-outer-name,too-many-arguments
+async def idx_handled_dynamic_objects(name, namespace, body, idx_namespace_names, idx_namespace_labels,
+                                      idx_labeled_namespace_names, **_):
+    """
+    Index for all source objects handled by the operator.
+
+    :param name:
+    :param namespace:
+    :param body:
+    :param idx_namespace_names:
+    :param idx_namespace_labels:
+    :param idx_labeled_namespace_names:
     :param _:
     :return:
     """
-    return (resource.group, resource.version, resource.kind, namespace, name) in idx_handled_dynamic_objects
+    # The indexes are the same objects on every call.
+    cluster_object_factory.namespace_names = NamespaceNames(
+        idx_namespace_names,
+        idx_namespace_labels,
+        idx_labeled_namespace_names
+    )
+    spec = cluster_object_index.get_spec((namespace, name))
+    if not shard_coordinator.observe(namespace, name, body['metadata'].get('annotations') or {}):
+        # The cluster object is handled by another replica.
+        if spec is not None:
+            sync_queue.cancel(cluster_object_factory(spec))
+            object_cache.untrack((namespace, name))
+            cluster_object_index.remove((namespace, name))
+            status_writer.forget(spec)
+            forget_cluster_object(namespace, name)
+        return {}
+    # The spec is not rebuilt when only the status or the metadata of the cluster object is changed, e.g. by the
+    # status writes.
+    if spec is None or not spec.is_same(body):
+        spec = ClusterObjectSpec(body)
+        object_cache.track((namespace, name), *spec.source_object_attrs, namespace)
+        cluster_object_index.add((namespace, name), spec)
+    status_writer.observe(spec, body.get('status'))
+    NAMESPACES.set(len(cluster_object_factory.namespace_names))
+    return {(*spec.source_object_attrs[:3], namespace, name): spec}
 
 
-@kopf.on.resume('object-cloner.ideamix.es', 'v1', 'ClusterObject')
-@kopf.on.create('object-cloner.ideamix.es', 'v1', 'ClusterObject')
-@kopf.on.update('object-cloner.ideamix.es', 'v1', 'ClusterObject')
+@kopf.on.resume('object-cloner.ideamix.es', 'v1', 'ClusterObject', when=shard_coordinator.is_owned)
+@kopf.on.create('object-cloner.ideamix.es', 'v1', 'ClusterObject', when=shard_coordinator.is_owned)
+@kopf.on.update('object-cloner.ideamix.es', 'v1', 'ClusterObject', when=shard_coordinator.is_owned)
 # pylint: disable=redefined-outer-name
-def on_create_update_clusterobject(spec, name, namespace, idx_handled_dynamic_objects, **_):
+async def on_create_update_clusterobject(spec, name, namespace, idx_handled_dynamic_objects, **_):
     """
     Sync cluster object on creation on update.
 
+    On the operator start, the sync waits until the source object and its clones are cached: the informers created
+    for all cluster objects are loaded with one list per kind, and only the clones that differ from the source object
+    are written.
+
     :param spec:
     :param name:
     :param namespace:
@@ -82,13 +193,28 @@ def on_create_update_clusterobject(spec, name, namespace, idx_handled_dynamic_ob
         namespace,
         name
     ), [])
-    for cluster_object in cluster_object_store:
-        cluster_object.sync_to_namespaces()
+    for cluster_object_spec in cluster_object_store:
+        await object_cache.wait_for_informer(*cluster_object_spec.source_object_attrs)
+        await sync_queue.sync(cluster_object_factory(cluster_object_spec))
+
+
+@kopf.on.event('object-cloner.ideamix.es', 'v1', 'ClusterObject', when=shard_coordinator.is_owned)
+async def on_clusterobject_event(body, **_):
+    """
+    Remove the kopf finalizers of the previous owners from a cluster object claimed by this replica, or left after
+    sharding was enabled or disabled, so they do not block its deletion.
 
+    :param body:
+    :param _:
+    :return:
+    """
+    await remove_stale_finalizers(body)
 
-@kopf.on.delete('object-cloner.ideamix.es', 'v1', 'ClusterObject')
+
+@kopf.on.delete('object-cloner.ideamix.es', 'v1', 'ClusterObject', when=shard_coordinator.is_owned)
 # pylint: disable=redefined-outer-name
-def on_delete_clusterobject(body, idx_namespace_names, logger, **_):
+async def on_delete_clusterobject(body, idx_namespace_names, idx_namespace_labels, idx_labeled_namespace_names, logger,
+                                  **_):
     """
     Sync cluster object on creation on update.
 
@@ -99,78 +225,263 @@ def on_delete_clusterobject(body, idx_namespace_names, logger, **_):
     :param _:
     :return:
     """
-    cluster_object = ClusterObject(body, idx_namespace_names[None], logger)
-    if 'OnClusterObjectDelete' in body['spec'].get('cleanupEvents', '').split(','):
-        cluster_object.delete_all_target_objects()
+    spec = ClusterObjectSpec(body)
+    cluster_object = ClusterObject(
+        spec,
+        NamespaceNames(idx_namespace_names, idx_namespace_labels, idx_labeled_namespace_names),
+        logger
+    )
+    sync_queue.cancel(cluster_object)
+    if 'OnClusterObjectDelete' in spec.cleanup_events:
+        await cluster_object.delete_all_target_objects()
+    object_cache.untrack((spec.namespace, spec.name))
+    cluster_object_index.remove((spec.namespace, spec.name))
+    shard_coordinator.forget(spec.namespace, spec.name)
+    status_writer.forget(spec)
+    forget_cluster_object(spec.namespace, spec.name)
+
+
+async def sync_to_new_namespaces(namespace_names):
+    """
+    Create target objects in a batch of new namespaces. Each cluster object is synced once for all the namespaces
+    it selects, so its source object is read once per batch.
+
+    :param namespace_names:
+    :return:
+    """
+    cluster_objects = {}
+    for namespace_name in namespace_names:
+        for cluster_object in cluster_object_index.get_selecting(namespace_name):
+            key = (cluster_object.namespace, cluster_object.name)
+            cluster_objects.setdefault(key, (cluster_object, []))[1].append(namespace_name)
+    outcomes = await asyncio.gather(
+        *(sync_queue.sync(cluster_object, names) for cluster_object, names in cluster_objects.values()),
+        return_exceptions=True
+    )
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            raise outcome
+
+
+new_namespace_batcher = Batcher(
+    sync_to_new_namespaces,
+    float(os.environ.get('OBJECT_CLONER_NAMESPACE_BATCH_INTERVAL', '1'))
+)
 
 
 @kopf.on.create('', 'v1', 'Namespace')
 # pylint: disable=redefined-outer-name
-def on_create_namespace(name, idx_handled_dynamic_objects, **_):
+async def on_create_namespace(name, idx_namespace_names, **_):
     """
     Create target objects in the namespace on its creation.
 
+    The namespaces created at the same time are processed together.
+
     :param name:
-    :param idx_handled_dynamic_objects:
+    :param idx_namespace_names:
     :param _:
     :return:
     """
-    for _, cluster_object_store in idx_handled_dynamic_objects.items():
-        for cluster_object in cluster_object_store:
-            cluster_object.sync_to_namespaces(name)
+    NAMESPACES.set(len(idx_namespace_names.get(None, [])))
+    await new_namespace_batcher.add(name)
 
 
-@kopf.on.delete('', 'v1', 'Namespace')
+# The replicas of a sharded operator do not block the deletion of the namespaces with their own finalizers.
+@kopf.on.delete('', 'v1', 'Namespace', optional=shard_coordinator.is_enabled)
 # pylint: disable=redefined-outer-name
-def on_delete_namespace(name, idx_handled_dynamic_objects, **_):
+async def on_delete_namespace(name, idx_namespace_names, **_):
     """
     Remove the namespace from the list of synced ones.
 
     :param name:
-    :param idx_handled_dynamic_objects:
+    :param idx_namespace_names:
+    :param _:
+    :return:
+    """
+    NAMESPACES.set(len(idx_namespace_names.get(None, [])))
+    # The labels of a deleted namespace may be unindexed already.
+    for cluster_object in cluster_object_index.get_name_matching(name):
+        await cluster_object.update_namespace_sync_status([name], delete=True)
+
+
+@kopf.on.event('', 'v1', 'Namespace')
+# pylint: disable=redefined-builtin,redefined-outer-name
+async def on_namespace_event(type, name, memo, idx_namespace_labels, **_):
+    """
+    Sync or clean up the cluster objects whose label selectors select or unselect a namespace after its labels change.
+
+    The event handlers get no previous body, and the index is updated before they run, so the labels indexed for the
+    namespace are kept in its kopf memo until the next event.
+
+    :param type: event type, None for the namespaces found on the operator start
+    :param name:
+    :param memo: kopf memo of the namespace
+    :param idx_namespace_labels:
     :param _:
     :return:
     """
-    for _, cluster_object_store in idx_handled_dynamic_objects.items():
-        for cluster_object in cluster_object_store:
-            cluster_object.update_namespace_sync_status(name, delete=True)
+    if type == 'DELETED':
+        return
+    old_labels = memo.get('labels')
+    new_labels = memo['labels'] = next(iter(idx_namespace_labels.get(name, ())), {})
+    # The namespaces seen for the first time are synced by the create and resume handlers.
+    if old_labels is None or old_labels == new_labels:
+        return
+    await sync_relabeled_namespace(name, old_labels, new_labels)
+
+
+async def sync_relabeled_namespace(name, old_labels, new_labels):
+    """
+    Sync the cluster objects that select a namespace since its labels changed, and remove the clones of the ones that
+    do not select it anymore if their cleanup events include OnNamespaceUnselected.
+
+    :param name:
+    :param old_labels:
+    :param new_labels:
+    :return:
+    """
+    syncs = []
+    for cluster_object in cluster_object_index.get_name_matching(name):
+        label_selector = cluster_object.namespace_selector.label_selector
+        if label_selector is None:
+            continue
+        was_selected, is_selected = label_selector.matches(old_labels), label_selector.matches(new_labels)
+        if is_selected and not was_selected:
+            syncs.append(sync_queue.sync(cluster_object, [name]))
+        elif was_selected and not is_selected \
+                and 'OnNamespaceUnselected' in cluster_object.spec.cleanup_events:
+            syncs.append(cluster_object.delete_target_objects([name]))
+    outcomes = await asyncio.gather(*syncs, return_exceptions=True)
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            raise outcome
+
+
+async def on_source_event(event_type, obj, cluster_object_keys):
+    """
+    Sync the cluster objects on changes of their source object.
+
+    The source objects are watched by the object cache, only the kinds and names referenced by cluster objects are
+    watched.
+
+    :param event_type: LISTED, ADDED, MODIFIED or DELETED
+    :param obj: the source object
+    :param cluster_object_keys: list of (namespace, name) of the cluster objects that use the source object
+    :return:
+    """
+    group, _, version = obj['apiVersion'].rpartition('/')
+    kind = obj['kind']
+    namespace = obj['metadata']['namespace']
+    name = obj['metadata']['name']
+    await remove_legacy_finalizer(group, version, kind, obj)
+    if event_type == 'LISTED':
+        # The cluster objects are synced by their own resume handlers.
+        return
+    if event_type == 'DELETED':
+        source_object_cache.discard(group, version, kind, namespace, name)
+    else:
+        source_object_cache.store(group, version, kind, obj)
+    for key in cluster_object_keys:
+        cluster_object = cluster_object_index.get(key)
+        if cluster_object is None:
+            continue
+        if event_type != 'DELETED':
+            await sync_queue.sync(cluster_object)
+        elif 'OnSourceObjectDelete' in cluster_object.spec.cleanup_events:
+            await cluster_object.delete_all_target_objects()
 
 
-def create_sourceobject_handlers():
+async def on_clone_event(event_type, obj, cluster_object_keys):
     """
-    Dynamically create handlers for handled source objects.
+    Repair a clone that was modified or deleted by someone else.
 
+    The clones are watched by the object cache together with their source objects, the events of the operator's own
+    writes are not reported. The clone is repaired by its owner only, which is found by the owner UID label or, for
+    the clones created before the label was introduced, by the owner annotation.
+
+    :param event_type: LISTED, ADDED, MODIFIED or DELETED
+    :param obj: the clone
+    :param cluster_object_keys: list of (namespace, name) of the cluster objects that use the same source object kind
+                                and name
     :return:
     """
-    allowed_object_kinds = os.environ.get('OBJECT_CLONER_ALLOWED_OBJECT_KINDS')
-    kind_selectors = []
-    if allowed_object_kinds is not None and allowed_object_kinds.strip() != '':
-        for allowed_object_kind in allowed_object_kinds.split(" "):
-            if len(allowed_object_kind) == 0:
-                continue
-            kind_selectors.append(allowed_object_kind.split(","))
+    if event_type == 'LISTED':
+        # The clones are compared with the source objects by the resume handlers.
+        return
+    owner_uid = (obj['metadata'].get('labels') or {}).get(OWNER_UID_LABEL)
+    if owner_uid is not None:
+        cluster_object = cluster_object_index.get_by_uid(owner_uid)
     else:
-        kind_selectors.append([kopf.EVERYTHING])
-
-    for kind_selector in kind_selectors:
-        # pylint: disable=cell-var-from-loop
-        @kopf.on.create(*kind_selector, when=is_of_interest)
-        # pylint: disable=cell-var-from-loop
-        @kopf.on.update(*kind_selector, when=is_of_interest)
-        def on_create_update_sourceobject(resource, name, namespace, idx_handled_dynamic_objects, **_):
-            cluster_object_store = idx_handled_dynamic_objects.get(
-                (resource.group, resource.version, resource.kind, namespace, name), [])
-            for cluster_object in cluster_object_store:
-                cluster_object.sync_to_namespaces()
-
-        # pylint: disable=cell-var-from-loop
-        @kopf.on.delete(*kind_selector, when=is_of_interest)
-        def on_delete_sourceobject(resource, name, namespace, idx_handled_dynamic_objects, **_):
-            cluster_object_store = idx_handled_dynamic_objects.get(
-                (resource.group, resource.version, resource.kind, namespace, name), [])
-            for cluster_object in cluster_object_store:
-                if 'OnSourceObjectDelete' in cluster_object.body['spec'].get('cleanupEvents', '').split(','):
-                    cluster_object.delete_all_target_objects()
-
-
-create_sourceobject_handlers()
+        owner = (obj['metadata'].get('annotations') or {}).get(OWNER_ANNOTATION, '')
+        cluster_object = cluster_object_index.get(tuple(owner.split('/', 1)))
+    if cluster_object is None \
+            or (cluster_object.namespace, cluster_object.name) not in cluster_object_keys:
+        return
+    try:
+        await cluster_object.repair_target_object(obj['metadata']['namespace'])
+    except Exception as err:  # pylint: disable=broad-exception-caught
+        # The clone is repaired by the next sync, e.g. the namespace may be terminating.
+        cluster_object.logger.warning(f"Cannot repair the clone in {obj['metadata']['namespace']} namespace: {err}")
+
+
+async def remove_legacy_finalizer(group, version, kind, obj):
+    """
+    Remove the finalizer that kopf added to a source object, so the deletion of the object is not blocked.
+
+    :param group:
+    :param version:
+    :param kind:
+    :param obj:
+    :return:
+    """
+    await remove_finalizers(group, version, kind, obj, [LEGACY_SOURCE_OBJECT_FINALIZER])
+
+
+async def remove_stale_finalizers(body):
+    """
+    Remove the kopf finalizers of the other shards, or the ones added before sharding was enabled or disabled, from a
+    cluster object, so they do not block its deletion.
+
+    :param body: the cluster object
+    :return:
+    """
+    finalizer = shard_coordinator.get_name(KOPF_FINALIZER)
+    await remove_finalizers('object-cloner.ideamix.es', 'v1', 'ClusterObject', body, [
+        name for name in body['metadata'].get('finalizers') or []
+        if name != finalizer and (name == KOPF_FINALIZER or name.startswith(f'{KOPF_FINALIZER}-shard-'))
+    ])
+
+
+async def remove_finalizers(group, version, kind, obj, finalizers_to_remove):
+    """
+    Remove finalizers from an object unless they are already removed.
+
+    :param group:
+    :param version:
+    :param kind:
+    :param obj:
+    :param finalizers_to_remove: list of finalizer names
+    :return:
+    """
+    finalizers = obj['metadata'].get('finalizers') or []
+    operations = []
+    for position in reversed(range(len(finalizers))):
+        if finalizers[position] in finalizers_to_remove:
+            path = f'/metadata/finalizers/{position}'
+            operations += [{'op': 'test', 'path': path, 'value': finalizers[position]}, {'op': 'remove', 'path': path}]
+    if not operations:
+        return
+    await patch_namespaced_object(
+        group,
+        version,
+        kind,
+        obj['metadata']['namespace'],
+        obj['metadata']['name'],
+        operations,
+        content_type='application/json-patch+json'
+    )
+
+
+cluster_object_index.cluster_object_factory = cluster_object_factory
+object_cache.source_event_handler = on_source_event
+object_cache.clone_event_handler = on_clone_event
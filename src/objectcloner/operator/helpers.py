@@ -1,6 +1,38 @@
-"""Contains only a function that allows to remove nested keys from a dict"""
+"""Contains the functions that allow to remove nested keys from a dict, object hashing and settings parsing helpers."""
+import functools
+import hashlib
+import json
+import os
 import re
 
+REGEX_SPECIAL_CHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+
+def get_allowed_object_kinds():
+    """
+    Parse OBJECT_CLONER_ALLOWED_OBJECT_KINDS.
+
+    :return: list of [group, version, plural] lists, empty if all object kinds are allowed
+    """
+    allowed_object_kinds = os.environ.get('OBJECT_CLONER_ALLOWED_OBJECT_KINDS')
+    kind_selectors = []
+    if allowed_object_kinds is not None and allowed_object_kinds.strip() != '':
+        for allowed_object_kind in allowed_object_kinds.split(" "):
+            if len(allowed_object_kind) == 0:
+                continue
+            kind_selectors.append(allowed_object_kind.split(","))
+    return kind_selectors
+
+
+def get_object_hash(obj):
+    """
+    Calculate a stable hash of an object, i.e. the hash does not depend on the order of the object's keys.
+
+    :param obj: dict
+    :return: str
+    """
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
 
 def delete_fields(obj, field_paths, **_):
     """
@@ -11,30 +43,140 @@ def delete_fields(obj, field_paths, **_):
     :param _:
     :return:
     """
-    for field_path in field_paths:
-        _delete_field(obj, field_path.copy())
+    FieldExclusions(field_paths).delete(obj)
 
 
-def _delete_field(obj, field_path):
+def null_missing_fields(obj, view, reference):
+    """
+    Set the fields of a dict that a reference dict does not have to None, so a merge patch made of the dict deletes
+    them, e.g. the fields that were added to a clone by someone else. Only the fields of a view of the dict are
+    changed, so the fields missing from the view, e.g. the excluded ones, are kept.
+
+    :param obj: dict to change
+    :param view: dict with the fields of obj to compare, see FieldExclusions.project
+    :param reference: dict
+    :return:
+    """
+    for key, value in list(view.items()):
+        if key not in reference:
+            obj[key] = None
+        elif isinstance(value, dict) and isinstance(reference[key], dict) and isinstance(obj[key], dict):
+            null_missing_fields(obj[key], value, reference[key])
+
+
+class FieldExclusions:
+    """
+    Compiled list of field paths to exclude from objects.
+
+    Each path item is a Python regular expression that is matched at the beginning of a key, like re.match does.
+    The paths are merged into a prefix tree, so the common path items (e.g. metadata) are matched once, and the items
+    without special characters are matched with str.startswith.
+    """
+
+    def __init__(self, field_paths):
+        self._nodes = {}
+        for field_path in field_paths:
+            nodes = self._nodes
+            for index, field_regex in enumerate(field_path):
+                node = nodes.setdefault(field_regex, _FieldNode(field_regex))
+                if index == len(field_path) - 1:
+                    node.is_last_level = True
+                nodes = node.children
+
+    def delete(self, obj):
+        """
+        Delete the excluded fields from a dict in place.
+
+        :param obj:
+        :return: True if one or more fields are deleted
+        """
+        return _delete_nodes(obj, self._nodes)
+
+    def project(self, obj):
+        """
+        Return a view of a dict without the excluded fields. The dict is not modified and only the dicts on the paths
+        to the excluded fields are copied, all other values are shared between the dict and the view.
+
+        :param obj:
+        :return: dict
+        """
+        return _project_nodes(obj, self._nodes)[0]
+
+
+@functools.lru_cache(maxsize=1024)
+def get_field_exclusions(fields_to_exclude):
+    """
+    Return compiled field exclusions. They are cached, so the exclusions of a cluster object are compiled again only
+    when they change.
+
+    :param fields_to_exclude: tuple of paths, e.g. ('.metadata.labels', '.status')
+    :return: FieldExclusions
+    """
+    return FieldExclusions([field.strip(' .').split('.') for field in fields_to_exclude])
+
+
+class _FieldNode:  # pylint: disable=too-few-public-methods
+    __slots__ = ('matches', 'is_last_level', 'children')
+
+    def __init__(self, field_regex):
+        if REGEX_SPECIAL_CHARACTERS.isdisjoint(field_regex):
+            self.matches = lambda key: key.startswith(field_regex)
+        else:
+            self.matches = re.compile(field_regex).match
+        self.is_last_level = False
+        self.children = {}
+
+
+def _delete_nodes(obj, nodes):
     """
     Recursively process each field starting from the first level. Evaluates each field if it should be deleted.
 
     :param obj:
-    :param field_path:
+    :param nodes:
     :return:
     """
-    field_regex = field_path.pop(0)
-    is_last_level = len(field_path) == 0
     are_one_or_more_level_fields_deleted = False
-    for key in list(obj.keys()).copy():
-        if re.match(field_regex, key):
-            if is_last_level:
+    for key in list(obj):
+        for node in nodes.values():
+            if not node.matches(key):
+                continue
+            if node.is_last_level:
                 del obj[key]
                 are_one_or_more_level_fields_deleted = True
-            else:
-                if isinstance(obj[key], dict):
-                    is_child_field_deleted = _delete_field(obj[key], field_path)
-                    if is_child_field_deleted and len(obj[key]) == 0:
-                        del obj[key]
-                        are_one_or_more_level_fields_deleted = True
+                break
+            if isinstance(obj[key], dict) and _delete_nodes(obj[key], node.children) and len(obj[key]) == 0:
+                del obj[key]
+                are_one_or_more_level_fields_deleted = True
+                break
     return are_one_or_more_level_fields_deleted
+
+
+def _project_nodes(obj, nodes):
+    """
+    The same as _delete_nodes, but copies the dicts it changes instead of modifying them.
+
+    :param obj:
+    :param nodes:
+    :return: tuple of the projected dict and whether one or more fields are deleted
+    """
+    projection = obj
+    for key, value in obj.items():
+        for node in nodes.values():
+            if not node.matches(key):
+                continue
+            if not node.is_last_level:
+                if not isinstance(value, dict):
+                    continue
+                value, is_deleted = _project_nodes(value, node.children)
+                if not is_deleted:
+                    continue
+                if len(value) != 0:
+                    if projection is obj:
+                        projection = obj.copy()
+                    projection[key] = value
+                    continue
+            if projection is obj:
+                projection = obj.copy()
+            del projection[key]
+            break
+    return projection, projection is not obj
@@ -1,27 +1,471 @@
-"""Provides decorator that inject Kubernetes API object."""
+"""Provides decorator that inject Kubernetes API object and the cache of API discovery results."""
+import asyncio
+import contextvars
+import json
+import logging
 import os
+import random
+import ssl
+import time
+from collections import namedtuple
+
+import aiohttp
 import pykube
+from pykube.exceptions import HTTPError
+
+from .metrics import API_RETRIES
+
+SERVICE_ACCOUNT_PATH = '/var/run/secrets/kubernetes.io/serviceaccount'
+
+ApiResponse = namedtuple('ApiResponse', ['status', 'headers', 'data'])
+ResourceKind = namedtuple('ResourceKind', ['group', 'version', 'kind', 'plural', 'namespaced'])
+
+logger = logging.getLogger(__name__)
+
+# An additional rate limiter of the requests sent by the current task and the tasks it starts, e.g. by the periodic
+# resyncs, so they do not use up the rate limit of the API server.
+request_budget = contextvars.ContextVar('request_budget', default=None)
 
 
 def kubernetes_api(function):
     """
-    Injects a Kubernetes API into a wrapped function.
+    Injects a Kubernetes API into a wrapped coroutine function.
 
-    :param function: A function that requires access to Kubernetes API
+    :param function: A coroutine function that requires access to Kubernetes API
     :return:
     """
-    def wrap_function(*args, **kwargs):
-        api = _get_kube_api()
-        res = function(api, *args, **kwargs)
-        api.session.close()
-        return res
+    async def wrap_function(*args, **kwargs):
+        return await function(await _api_client_pool.get_api(), *args, **kwargs)
     return wrap_function
 
 
-def _get_kube_api():
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter for the API requests that can be retried.
+
+    A delay is a random value between zero and OBJECT_CLONER_API_RETRY_BASE_DELAY * 2 ** attempt seconds, capped by
+    OBJECT_CLONER_API_RETRY_MAX_DELAY, so the retries of concurrent requests are spread in time instead of hitting
+    the API server together. A Retry-After header sent by the API server, e.g. by API Priority and Fairness, sets the
+    lower bound of the delay.
+    """
+
+    RETRIABLE_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+    def __init__(self):
+        self.max_retries = int(os.environ.get('OBJECT_CLONER_API_MAX_RETRIES', '5'))
+        self.base_delay = float(os.environ.get('OBJECT_CLONER_API_RETRY_BASE_DELAY', '0.5'))
+        self.max_delay = float(os.environ.get('OBJECT_CLONER_API_RETRY_MAX_DELAY', '30'))
+
+    def get_delay(self, attempt, retry_after=None):
+        """
+        Return the delay before a retry.
+
+        :param attempt: number of the failed attempt, starting from 0
+        :param retry_after: the value of the Retry-After response header, if any
+        :return: delay in seconds
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        try:
+            return max(delay, min(self.max_delay, float(retry_after)))
+        except (TypeError, ValueError):
+            return delay
+
+    def is_retriable(self, method, status, attempt):
+        """
+        Check whether a request should be sent again.
+
+        A request that was rejected by throttling (429) is retried regardless of the method. The server errors are not
+        retried for POST requests, since an object may have been created.
+
+        :param method: HTTP method
+        :param status: response status or None if the request failed with a connection error
+        :param attempt: number of the failed attempt, starting from 0
+        :return: bool
+        """
+        if attempt >= self.max_retries:
+            return False
+        if status == 429:
+            return True
+        return method != 'POST' and (status is None or status in self.RETRIABLE_STATUSES)
+
+
+class RateLimiter:  # pylint: disable=too-few-public-methods
+    """
+    Client-side token bucket limiter of the API requests sent to one API server.
+
+    The bucket holds up to OBJECT_CLONER_API_BURST tokens and is refilled with OBJECT_CLONER_API_QPS tokens per
+    second. A request that finds the bucket empty reserves a token and waits until it is refilled, so the waiting
+    requests are served in their order. The limiter is disabled if the QPS is zero.
+    """
+
+    def __init__(self, qps=None, burst=None):
+        """
+        :param qps: tokens per second, OBJECT_CLONER_API_QPS if omitted
+        :param burst: bucket size, OBJECT_CLONER_API_BURST if omitted
+        """
+        self.qps = float(os.environ.get('OBJECT_CLONER_API_QPS', '50')) if qps is None else qps
+        self.burst = max(int(os.environ.get('OBJECT_CLONER_API_BURST', '100') if burst is None else burst), 1)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+
+    async def acquire(self):
+        """
+        Take a token, waiting until one is available.
+
+        :return:
+        """
+        if self.qps <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.qps) - 1
+        self._updated_at = now
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.qps)
+
+
+class KubernetesApi:
+    """
+    Asynchronous Kubernetes API client built on top of a shared aiohttp session.
+
+    Requests are throttled by the rate limiter of the API server and by the request budget of the current task if
+    it is set, and retried according to the retry policy.
+    """
+
+    def __init__(self, config, session, watch_session, rate_limiter):
+        self.config = config
+        self.session = session
+        self.watch_session = watch_session
+        self.rate_limiter = rate_limiter
+
+    @property
+    def url(self):
+        """
+        API server URL.
+
+        :return: str
+        """
+        return self.config.cluster['server'].rstrip('/')
+
+    # pylint: disable=too-many-arguments
+    async def request(self, method, path, params=None, body=None, content_type='application/json'):
+        """
+        Send a request to the API server.
+
+        :param method: HTTP method
+        :param path: URL path, e.g. /api/v1/namespaces/default/secrets
+        :param params: query parameters
+        :param body: request body that is sent as JSON
+        :param content_type: request content type, e.g. application/merge-patch+json
+        :return: ApiResponse, data is a parsed JSON for JSON responses and a text otherwise
+        """
+        attempt = 0
+        budget = request_budget.get()
+        while True:
+            if budget is not None:
+                await budget.acquire()
+            await self.rate_limiter.acquire()
+            headers, auth = self._get_auth_headers()
+            if body is not None:
+                headers['Content-Type'] = content_type
+            try:
+                async with self.session.request(
+                    method,
+                    self.url + path,
+                    params=params,
+                    json=body,
+                    headers=headers,
+                    auth=auth
+                ) as response:
+                    api_response = ApiResponse(response.status, response.headers, await _read_data(response))
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                if not retry_policy.is_retriable(method, None, attempt):
+                    raise
+                delay = retry_policy.get_delay(attempt)
+                API_RETRIES.labels(method, type(err).__name__).inc()
+                logger.debug('%s %s failed: %r. Retrying in %.2fs...', method, path, err, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            if not retry_policy.is_retriable(method, api_response.status, attempt):
+                return api_response
+            delay = retry_policy.get_delay(attempt, api_response.headers.get('Retry-After'))
+            API_RETRIES.labels(method, api_response.status).inc()
+            logger.debug('%s %s returned %s. Retrying in %.2fs...', method, path, api_response.status, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def watch(self, path, params, timeout):
+        """
+        Stream watch events of a collection.
+
+        Watch connections are long-lived, so they use a separate session that is not limited by the pool size.
+
+        :param path: URL path of a collection
+        :param params: query parameters, watch=true is added automatically
+        :param timeout: the longest time without any data from the API server, in seconds
+        :return: async generator of event dicts
+        """
+        await self.rate_limiter.acquire()
+        headers, auth = self._get_auth_headers()
+        async with self.watch_session.get(
+            self.url + path,
+            params={**params, 'watch': 'true'},
+            headers=headers,
+            auth=auth,
+            timeout=aiohttp.ClientTimeout(total=None, sock_read=timeout)
+        ) as response:
+            if response.status != 200:
+                self.raise_for_status(ApiResponse(response.status, response.headers, await _read_data(response)))
+            buffer = bytearray()
+            async for chunk in response.content.iter_any():
+                buffer.extend(chunk)
+                while (line_end := buffer.find(b'\n')) >= 0:
+                    line = bytes(buffer[:line_end])
+                    del buffer[:line_end + 1]
+                    if line.strip():
+                        yield json.loads(line)
+
+    def _get_auth_headers(self):
+        headers = {'Accept': 'application/json'}
+        auth = None
+        if self.config.user.get('token'):
+            headers['Authorization'] = f"Bearer {self.config.user['token']}"
+        elif self.config.user.get('username') and self.config.user.get('password'):
+            auth = aiohttp.BasicAuth(self.config.user['username'], self.config.user['password'])
+        return headers, auth
+
+    @staticmethod
+    def raise_for_status(response):
+        """
+        Raise HTTPError for an unsuccessful response.
+
+        :param response: ApiResponse
+        :return:
+        """
+        if response.status < 400:
+            return
+        if isinstance(response.data, dict) and response.data.get('kind') == 'Status':
+            raise HTTPError(response.status, response.data.get('message', ''))
+        raise HTTPError(response.status, str(response.data))
+
+
+class ApiClientPool:
+    """
+    Process-wide Kubernetes API client that keeps its HTTP connections alive between calls.
+
+    The client is built once and shared by all handlers. Its connection pool size is set by
+    OBJECT_CLONER_API_POOL_SIZE. The configuration source (service account token or kubeconfig file) is checked
+    for changes at most once per OBJECT_CLONER_API_CONFIG_RELOAD_INTERVAL seconds, and the configuration is
+    reloaded when it changes, so that rotated tokens are picked up without dropping the open connections.
+    The rate limiter of an API server is kept when the client is rebuilt.
+    """
+
+    def __init__(self):
+        self.pool_size = int(os.environ.get('OBJECT_CLONER_API_POOL_SIZE', '10'))
+        self.reload_interval = float(os.environ.get('OBJECT_CLONER_API_CONFIG_RELOAD_INTERVAL', '60'))
+        self._api = None
+        self._config_path = None
+        self._config_mtime = None
+        self._checked_at = 0.0
+        self._rate_limiters = {}
+
+    async def get_api(self):
+        """
+        Return the shared client, building it or reloading its configuration if required.
+
+        :return: KubernetesApi
+        """
+        if self._api is None:
+            self._api = self._build_api(self._load_config())
+            self._checked_at = time.monotonic()
+        elif time.monotonic() - self._checked_at >= self.reload_interval:
+            self._checked_at = time.monotonic()
+            await self._reload_config_if_changed()
+        return self._api
+
+    async def close(self):
+        """
+        Close the shared client.
+
+        :return:
+        """
+        if self._api is not None:
+            api, self._api = self._api, None
+            await _close_sessions(api)
+
+    def _load_config(self):
+        try:
+            config = pykube.KubeConfig.from_service_account(SERVICE_ACCOUNT_PATH)
+            self._config_path = os.path.join(SERVICE_ACCOUNT_PATH, 'token')
+        except FileNotFoundError:
+            self._config_path = os.path.expanduser(os.getenv("KUBECONFIG", "~/.kube/config"))
+            config = pykube.KubeConfig.from_file(self._config_path)
+        self._config_mtime = _get_mtime(self._config_path)
+        return config
+
+    def _build_api(self, config):
+        ssl_context = _build_ssl_context(config)
+        return KubernetesApi(
+            config,
+            aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size, ssl=ssl_context)),
+            aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0, ssl=ssl_context)),
+            self._rate_limiters.setdefault(config.cluster['server'], RateLimiter())
+        )
+
+    async def _reload_config_if_changed(self):
+        if _get_mtime(self._config_path) == self._config_mtime:
+            return
+        config = self._load_config()
+        if config.cluster['server'] != self._api.config.cluster['server'] \
+                or 'client-certificate' in config.user:
+            api, self._api = self._api, self._build_api(config)
+            await _close_sessions(api)
+            return
+        # Keep the session (and its keep-alive connections) and only swap the credentials.
+        self._api.config = config
+
+
+class ObjectKindCache:
+    """
+    Cache of API discovery results, i.e. of the mapping of an object kind to its API resource.
+
+    Entries are keyed by (group, version, kind). A discovery request fetches the whole resource list of an API
+    group version, so all kinds of that group version are cached at once. Entries expire after
+    OBJECT_CLONER_DISCOVERY_CACHE_TTL seconds and can be invalidated explicitly, for example, when the API server
+    reports that a resource type does not exist anymore.
+    """
+
+    def __init__(self):
+        self.ttl = float(os.environ.get('OBJECT_CLONER_DISCOVERY_CACHE_TTL', '300'))
+        self._kinds = {}
+        self._locks = {}
+
+    async def get(self, api, group, version, kind):
+        """
+        Return a resource kind, running discovery for its group version if required.
+
+        :param api:
+        :param group:
+        :param version:
+        :param kind:
+        :return: ResourceKind
+        """
+        entry = self._kinds.get((group, version, kind))
+        if entry is None or entry[1] < time.monotonic():
+            async with self._locks.setdefault((group, version), asyncio.Lock()):
+                entry = self._kinds.get((group, version, kind))
+                if entry is None or entry[1] < time.monotonic():
+                    await self.discover(api, group, version)
+                    entry = self._kinds.get((group, version, kind))
+            if entry is None:
+                raise ValueError(f'unknown resource kind {kind!r}')
+        return entry[0]
+
+    async def discover(self, api, group, version):
+        """
+        Fetch the resource list of a group version and cache all kinds it contains.
+
+        :param api:
+        :param group:
+        :param version:
+        :return:
+        """
+        response = await api.request('GET', get_api_path(group, version))
+        api.raise_for_status(response)
+        expires_at = time.monotonic() + self.ttl
+        for resource in response.data['resources']:
+            if '/' in resource['name']:
+                continue
+            self._kinds[(group, version, resource['kind'])] = (
+                ResourceKind(group, version, resource['kind'], resource['name'], resource['namespaced']),
+                expires_at
+            )
+
+    def invalidate(self, group, version, kind=None):
+        """
+        Drop cached kinds of a group version.
+
+        :param group:
+        :param version:
+        :param kind: a single kind to drop, all kinds of the group version are dropped if omitted
+        :return:
+        """
+        for key in list(self._kinds):
+            if key[0:2] == (group, version) and kind in (None, key[2]):
+                del self._kinds[key]
+
+
+def get_api_version(group, version):
+    """
+    Build apiVersion string from API group and version.
+
+    :param group:
+    :param version:
+    :return: str
+    """
+    return f"{group}{'/' if group != '' else ''}{version}"
+
+
+def get_api_path(group, version):
+    """
+    Build URL path of an API group version.
+
+    :param group:
+    :param version:
+    :return: str
+    """
+    return f'/apis/{group}/{version}' if group != '' else f'/api/{version}'
+
+
+async def get_kubernetes_api():
+    """
+    Return the shared Kubernetes API client, for the callers that cannot be wrapped with kubernetes_api,
+    e.g. async generators.
+
+    :return: KubernetesApi
+    """
+    return await _api_client_pool.get_api()
+
+
+async def close_api():
+    """
+    Close the shared Kubernetes API client.
+
+    :return:
+    """
+    await _api_client_pool.close()
+
+
+def _build_ssl_context(config):
+    if 'certificate-authority' in config.cluster:
+        context = ssl.create_default_context(cafile=config.cluster['certificate-authority'].filename())
+    else:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if 'client-certificate' in config.user:
+        context.load_cert_chain(config.user['client-certificate'].filename(), config.user['client-key'].filename())
+    return context
+
+
+async def _read_data(response):
+    if response.content_type == 'application/json':
+        return await response.json()
+    return await response.text()
+
+
+async def _close_sessions(api):
+    await api.session.close()
+    await api.watch_session.close()
+
+
+def _get_mtime(path):
     try:
-        config = pykube.KubeConfig.from_service_account()
+        return os.stat(path).st_mtime
     except FileNotFoundError:
-        config = pykube.KubeConfig.from_file(os.getenv("KUBECONFIG", "~/.kube/config"))
-    api = pykube.HTTPClient(config, verify=False)
-    return api
+        return None
+
+
+retry_policy = RetryPolicy()
+_api_client_pool = ApiClientPool()
+object_kind_cache = ObjectKindCache()
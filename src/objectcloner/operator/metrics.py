@@ -0,0 +1,70 @@
+"""Prometheus metrics of the operator."""
+import os
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+SYNC_DURATION = Histogram(
+    'object_cloner_sync_duration_seconds',
+    'Duration of the syncs of a cluster object to its target namespaces',
+    ['namespace', 'name']
+)
+SYNC_FANOUT = Gauge(
+    'object_cloner_sync_fanout_namespaces',
+    'Number of namespaces written to by the last sync of a cluster object',
+    ['namespace', 'name']
+)
+API_REQUESTS = Counter(
+    'object_cloner_api_requests_total',
+    'Kubernetes API requests by verb, object kind and response status code',
+    ['verb', 'kind', 'code']
+)
+API_RETRIES = Counter(
+    'object_cloner_api_retries_total',
+    'Kubernetes API requests retried after throttling, server errors, connection errors or conflicts',
+    ['verb', 'reason']
+)
+RECREATIONS = Counter(
+    'object_cloner_recreations_total',
+    'Clone objects deleted and created again because they could not be updated',
+    ['kind']
+)
+RESYNCS = Counter(
+    'object_cloner_resyncs_total',
+    'Periodic resyncs of cluster objects by result',
+    ['result']
+)
+NAMESPACES = Gauge('object_cloner_namespaces', 'Number of namespaces known to the operator')
+CLUSTER_OBJECTS = Gauge('object_cloner_cluster_objects', 'Number of indexed cluster objects')
+SYNC_QUEUE_DEPTH = Gauge('object_cloner_sync_queue_depth', 'Number of cluster objects waiting for a sync')
+CACHED_OBJECTS = Gauge('object_cloner_cached_objects', 'Number of source and clone objects kept in memory')
+# The metrics that have a series per cluster object.
+CLUSTER_OBJECT_METRICS = (SYNC_DURATION, SYNC_FANOUT)
+
+
+def forget_cluster_object(namespace, name):
+    """
+    Remove the series of a cluster object that is deleted or handled by another replica.
+
+    :param namespace:
+    :param name:
+    :return:
+    """
+    for metric in CLUSTER_OBJECT_METRICS:
+        try:
+            metric.remove(namespace, name)
+        except KeyError:
+            # The cluster object has not been synced.
+            pass
+
+
+def start_metrics_server():
+    """
+    Serve the metrics on OBJECT_CLONER_METRICS_PORT in a background thread. The port 0 disables the metrics.
+
+    :return: the port or None if the metrics are disabled
+    """
+    port = int(os.environ.get('OBJECT_CLONER_METRICS_PORT', '9090'))
+    if port == 0:
+        return None
+    start_http_server(port)
+    return port
@@ -0,0 +1,631 @@
+"""Watch-fed in-memory cache of source and clone objects."""
+import asyncio
+import logging
+import os
+import time
+
+from pykube.exceptions import HTTPError
+
+from .batching import Batcher
+from .helpers import get_allowed_object_kinds
+from .metrics import CACHED_OBJECTS
+from .resources import get_resource_kind, get_namespaced_object, get_namespaced_object_list, watch_namespaced_objects
+
+logger = logging.getLogger(__name__)
+
+
+class ObjectInformer:  # pylint: disable=too-many-instance-attributes
+    """
+    Keeps all objects of one kind and one name, i.e. a source object and its clones, in memory.
+
+    The objects are listed once with a metadata.name field selector, or loaded from a list of the whole kind shared
+    with other informers, and then kept up to date by a watch that starts from the list's resourceVersion. Reads are
+    answered from memory only while the informer is ready, i.e. after the initial list and as long as the watch is
+    healthy. An informer can be limited to a single namespace to watch a source object only.
+
+    The changes of the objects are reported to the cache, so it can notify the subscribers about the changes of
+    their source objects.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, cache, group, version, kind, name, namespace=None):
+        self.cache = cache
+        self.group = group
+        self.version = version
+        self.kind = kind
+        self.name = name
+        self.namespace = namespace
+        self.objects = {}
+        self.resource_version = None
+        self.is_ready = False
+        self.created_at = time.monotonic()
+        self._settled = asyncio.Event()
+        self._task = None
+
+    @property
+    def key(self):
+        """
+        Kind and name of the objects.
+
+        :return: tuple
+        """
+        return self.group, self.version, self.kind, self.name
+
+    def start(self):
+        """
+        Start listing and watching the objects in background.
+
+        :return:
+        """
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """
+        Stop watching the objects and forget them.
+
+        :return:
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.is_ready = False
+        self._replace_objects({})
+        # The objects are never loaded, the waiting readers go to the API server.
+        self._settled.set()
+
+    @property
+    def is_settled(self):
+        """
+        Whether the objects are loaded or it is known that they are not watched.
+
+        :return: bool
+        """
+        return self._settled.is_set()
+
+    async def wait_until_settled(self):
+        """
+        Wait until the objects are loaded for the first time or it is known that they are not watched.
+
+        :return:
+        """
+        await self._settled.wait()
+
+    def load(self, objects, resource_version):
+        """
+        Replace the cached objects with the result of a list and report the differences to the cache.
+
+        :param objects: list of the objects
+        :param resource_version: resourceVersion of the list
+        :return:
+        """
+        previous_objects = self.objects if self.resource_version is not None else None
+        self._replace_objects({obj['metadata']['namespace']: obj for obj in objects})
+        self.resource_version = resource_version
+        self.is_ready = True
+        self._settled.set()
+        if previous_objects is None:
+            for obj in self.objects.values():
+                self.cache.notify(self, 'LISTED', obj)
+        else:
+            # The events missed while the watch was broken.
+            for namespace, obj in self.objects.items():
+                previous_object = previous_objects.get(namespace)
+                if previous_object is None:
+                    self.cache.notify(self, 'ADDED', obj)
+                elif previous_object['metadata']['resourceVersion'] != obj['metadata']['resourceVersion']:
+                    self.cache.notify(self, 'MODIFIED', obj)
+            for namespace, obj in previous_objects.items():
+                if namespace not in self.objects:
+                    self.cache.notify(self, 'DELETED', obj)
+        self.cache.check_size(self)
+
+    async def is_allowed(self):
+        """
+        Check whether the kind of the objects can be watched.
+
+        :return: bool
+        """
+        allowed_object_kinds = get_allowed_object_kinds()
+        if not allowed_object_kinds:
+            return True
+        resource_kind = await get_resource_kind(self.group, self.version, self.kind)
+        return [self.group, self.version, resource_kind.plural] in allowed_object_kinds
+
+    def get(self, namespace):
+        """
+        Return the cached object from the given namespace.
+
+        :param namespace:
+        :return: dict or None if the object does not exist
+        """
+        return self.objects.get(namespace)
+
+    def store(self, obj):
+        """
+        Put an object into the cache unless a newer version of it is already there.
+
+        :param obj:
+        :return:
+        """
+        namespace = obj['metadata']['namespace']
+        current_object = self.objects.get(namespace)
+        if current_object is None:
+            self.cache.object_count += 1
+        if current_object is None or not _is_older(obj, current_object):
+            self.objects[namespace] = obj
+
+    def discard(self, namespace, resource_version=None):
+        """
+        Remove an object from the cache unless a newer version of it is already there.
+
+        :param namespace:
+        :param resource_version: resourceVersion of the deleted object, if known
+        :return:
+        """
+        current_object = self.objects.get(namespace)
+        if current_object is None:
+            return
+        if resource_version is None or not _is_older({'metadata': {'resourceVersion': resource_version}},
+                                                     current_object):
+            del self.objects[namespace]
+            self.cache.object_count -= 1
+
+    def _replace_objects(self, objects):
+        self.cache.object_count += len(objects) - len(self.objects)
+        self.objects = objects
+
+    async def _run(self):
+        retry_delay = 1
+        while True:
+            try:
+                if not await self.is_allowed():
+                    logger.debug('%s objects are not watched: the kind is not allowed', self.kind)
+                    self._settled.set()
+                    return
+                if not self.is_ready:
+                    await self._list()
+                while await self._watch():
+                    retry_delay = 1
+                # The watch cannot be resumed from the last seen resourceVersion, the objects are listed again.
+                self.is_ready = False
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                logger.warning(
+                    'Cannot watch %s %s objects: %s. Retrying in %ss...', self.kind, self.name, err, retry_delay
+                )
+                self.is_ready = False
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 60)
+
+    async def _list(self):
+        object_list = await get_namespaced_object_list(
+            self.group,
+            self.version,
+            self.kind,
+            namespace=self.namespace,
+            field_selector={'metadata.name': self.name}
+        )
+        self.load(object_list['items'], object_list['metadata']['resourceVersion'])
+
+    async def _watch(self):
+        """
+        Apply watch events until the API server closes the watch.
+
+        :return: True if the watch can be resumed from the last seen resourceVersion, False if a new list is required
+        """
+        async for event in watch_namespaced_objects(
+            self.group,
+            self.version,
+            self.kind,
+            self.resource_version,
+            namespace=self.namespace,
+            field_selector={'metadata.name': self.name}
+        ):
+            obj = event['object']
+            if event['type'] == 'ERROR':
+                if obj.get('code') == 410:
+                    return False
+                raise HTTPError(obj.get('code', 500), obj.get('message', ''))
+            # The objects written by the operator are stored with the response of the write, so their events are
+            # echoes of the known changes and are not reported.
+            current_object = self.objects.get(obj['metadata']['namespace'])
+            if event['type'] in ('ADDED', 'MODIFIED'):
+                self.store(obj)
+                if current_object is None \
+                        or current_object['metadata']['resourceVersion'] != obj['metadata']['resourceVersion']:
+                    self.cache.notify(self, event['type'], obj)
+                self.cache.check_size(self)
+            elif event['type'] == 'DELETED':
+                self.discard(obj['metadata']['namespace'], obj['metadata']['resourceVersion'])
+                if current_object is not None:
+                    self.cache.notify(self, event['type'], obj)
+            self.resource_version = obj['metadata']['resourceVersion']
+            if self._task is None:
+                # The informer was stopped by the event processing, e.g. because of the cache size limit.
+                return True
+        return True
+
+
+class ObjectCache:  # pylint: disable=too-many-instance-attributes
+    """
+    In-memory cache of the objects that are either sources or clones of the tracked cluster objects.
+
+    There is one informer per distinct source object kind and name. The total number of cached objects is limited by
+    OBJECT_CLONER_OBJECT_CACHE_MAX_OBJECTS: an informer that would exceed the limit is replaced with the informers
+    that watch the source objects only, and the reads of the clones go to the API server.
+
+    The informers are also the source of the source object events: the subscribers are notified about the changes
+    of the objects with the name they track in their own namespace by source_event_handler. It is a coroutine
+    function that accepts the event type (LISTED for the objects found by the initial list, ADDED, MODIFIED or
+    DELETED), the object and the list of the subscribers. A failed notification is retried until it succeeds or the
+    subscribers stop tracking the object. The changes of the other objects, i.e. the clones, are reported the same way
+    by clone_event_handler to all subscribers of the kind and name, so the owner of a clone can repair it.
+
+    The informers that are created together, e.g. for all cluster objects on the operator start, are loaded with a
+    single list of their kind across all namespaces instead of a list per name. The readers that need the objects
+    before they are cached can wait for them up to OBJECT_CLONER_OBJECT_CACHE_WAIT_TIMEOUT seconds.
+    """
+
+    def __init__(self):
+        self.max_objects = int(os.environ.get('OBJECT_CLONER_OBJECT_CACHE_MAX_OBJECTS', '10000'))
+        self.wait_timeout = float(os.environ.get('OBJECT_CLONER_OBJECT_CACHE_WAIT_TIMEOUT', '30'))
+        self.source_event_handler = None
+        self.clone_event_handler = None
+        self._informers = {}
+        self._subscriptions = {}
+        self._subscribers = {}
+        self._tasks = set()
+        # The number of the objects of all informers, they keep it up to date.
+        self.object_count = 0
+        self._informer_starter = Batcher(self._start_informers, 0.1)
+
+    def __len__(self):
+        return self.object_count
+
+    # pylint: disable=too-many-arguments
+    def track(self, subscriber, group, version, kind, name, namespace):
+        """
+        Make sure the objects of the given kind and name are cached for a subscriber, e.g. a cluster object.
+
+        :param subscriber: a hashable subscriber key
+        :param group:
+        :param version:
+        :param kind:
+        :param name:
+        :param namespace: namespace of the subscriber's source object
+        :return:
+        """
+        key = (group, version, kind, name)
+        if self._subscriptions.get(subscriber) == (key, namespace):
+            return
+        self.untrack(subscriber)
+        self._subscriptions[subscriber] = (key, namespace)
+        self._subscribers.setdefault(key, {})[subscriber] = namespace
+        informers = self._informers.setdefault(key, {})
+        if not informers:
+            self._start_informer(key, None)
+        elif None not in informers and namespace not in informers:
+            self._start_informer(key, namespace)
+
+    def untrack(self, subscriber):
+        """
+        Stop caching the objects of a subscriber unless other subscribers need them.
+
+        :param subscriber:
+        :return:
+        """
+        key, namespace = self._subscriptions.pop(subscriber, (None, None))
+        if key is None:
+            return
+        subscribers = self._subscribers[key]
+        del subscribers[subscriber]
+        if not subscribers:
+            del self._subscribers[key]
+            for informer in self._informers.pop(key).values():
+                informer.stop()
+        elif namespace in self._informers[key] and namespace not in subscribers.values():
+            self._informers[key].pop(namespace).stop()
+
+    def get_informer(self, group, version, kind, name):
+        """
+        Return a ready informer for the given object kind and name.
+
+        :param group:
+        :param version:
+        :param kind:
+        :param name:
+        :return: ObjectInformer or None if the objects are not cached
+        """
+        informer = self._informers.get((group, version, kind, name), {}).get(None)
+        if informer is not None and informer.is_ready:
+            return informer
+        return None
+
+    async def wait_for_informer(self, group, version, kind, name):
+        """
+        Wait until the objects of the given kind and name are cached, if they are going to be.
+
+        :param group:
+        :param version:
+        :param kind:
+        :param name:
+        :return:
+        """
+        informer = self._informers.get((group, version, kind, name), {}).get(None)
+        if informer is None:
+            return
+        try:
+            await asyncio.wait_for(informer.wait_until_settled(), self.wait_timeout)
+        except asyncio.TimeoutError:
+            logger.warning('%s %s objects are not cached in time, they are read from the API server', kind, name)
+
+    def count_ready_informers(self):
+        """
+        Count the informers that answer reads from memory.
+
+        :return: tuple of the numbers of the ready and all informers
+        """
+        informers = [informer for informers in self._informers.values() for informer in informers.values()]
+        return sum(1 for informer in informers if informer.is_ready), len(informers)
+
+    def is_warm(self):
+        """
+        Check whether the informers have loaded their objects. An informer that is not settled after the wait timeout
+        does not count, since the readers that wait for it go to the API server anyway.
+
+        :return: bool
+        """
+        created_before = time.monotonic() - self.wait_timeout
+        return all(
+            informer.is_settled or informer.created_at < created_before
+            for informers in self._informers.values() for informer in informers.values()
+        )
+
+    def store(self, group, version, kind, obj):
+        """
+        Put an object returned by a write API call into the cache, so the next read sees the write.
+
+        :param group:
+        :param version:
+        :param kind:
+        :param obj:
+        :return:
+        """
+        for namespace, informer in self._informers.get((group, version, kind, obj['metadata']['name']), {}).items():
+            if informer.is_ready and namespace in (None, obj['metadata']['namespace']):
+                informer.store(obj)
+
+    # pylint: disable=too-many-arguments
+    def discard(self, group, version, kind, namespace, name):
+        """
+        Remove a deleted object from the cache.
+
+        :param group:
+        :param version:
+        :param kind:
+        :param namespace:
+        :param name:
+        :return:
+        """
+        for informer in self._informers.get((group, version, kind, name), {}).values():
+            informer.discard(namespace)
+
+    def notify(self, informer, event_type, obj):
+        """
+        Notify the subscribers about a change of their source object or of a clone in background.
+
+        :param informer: the informer that observed the change
+        :param event_type: LISTED, ADDED, MODIFIED or DELETED
+        :param obj:
+        :return:
+        """
+        if obj['metadata']['namespace'] in self._subscribers.get(informer.key, {}).values():
+            if self.source_event_handler is not None:
+                self._run_in_background(self._notify(self.source_event_handler, informer.key, event_type, obj))
+        elif self.clone_event_handler is not None:
+            self._run_in_background(self._notify(self.clone_event_handler, informer.key, event_type, obj))
+
+    def check_size(self, informer):
+        """
+        Replace an informer with the source object informers if the cache has grown over the limit.
+
+        :param informer:
+        :return:
+        """
+        if informer.namespace is not None:
+            return
+        if len(self) <= self.max_objects:
+            return
+        logger.warning(
+            'Object cache size limit %s is reached, %s %s objects will be read from the API server',
+            self.max_objects, informer.kind, informer.name
+        )
+        objects, resource_version = informer.objects, informer.resource_version
+        self._informers[informer.key].pop(None).stop()
+        for namespace in set(self._subscribers[informer.key].values()):
+            # The source object informers start from the known objects, so they report the changes missed meanwhile.
+            known_objects = {namespace: objects[namespace]} if namespace in objects else {}
+            self._start_informer(informer.key, namespace, known_objects, resource_version)
+
+    def stop(self):
+        """
+        Stop all informers.
+
+        :return:
+        """
+        for informers in self._informers.values():
+            for informer in informers.values():
+                informer.stop()
+        for task in self._tasks:
+            task.cancel()
+        self._informers = {}
+        self._subscriptions = {}
+        self._subscribers = {}
+
+    def _start_informer(self, key, namespace, objects=None, resource_version=None):
+        informer = self._informers[key][namespace] = ObjectInformer(self, *key, namespace)
+        if namespace is None:
+            self._run_in_background(self._informer_starter.add(informer))
+            return
+        informer.objects = objects or {}
+        self.object_count += len(informer.objects)
+        informer.resource_version = resource_version
+        informer.start()
+
+    async def _start_informers(self, informers):
+        """
+        Load the informers of each kind with a single list of the kind and start watching.
+
+        :param informers: list of ObjectInformer
+        :return:
+        """
+        informers_by_kind = {}
+        for informer in informers:
+            if self._is_registered(informer):
+                informers_by_kind.setdefault((informer.group, informer.version, informer.kind), []).append(informer)
+        for (group, version, kind), kind_informers in informers_by_kind.items():
+            if len(kind_informers) > 1:
+                try:
+                    await self._load_informers(group, version, kind, kind_informers)
+                except Exception as err:  # pylint: disable=broad-exception-caught
+                    logger.warning('Cannot list %s objects: %s. They are listed by name', kind, err)
+            for informer in kind_informers:
+                # An informer can be dropped meanwhile, e.g. by the cache size limit.
+                if self._is_registered(informer):
+                    informer.start()
+
+    async def _load_informers(self, group, version, kind, informers):
+        if not await informers[0].is_allowed():
+            return
+        object_list = await get_namespaced_object_list(group, version, kind)
+        objects_by_name = {}
+        for obj in object_list['items']:
+            objects_by_name.setdefault(obj['metadata']['name'], []).append(obj)
+        for informer in informers:
+            if self._is_registered(informer):
+                informer.load(objects_by_name.get(informer.name, []), object_list['metadata']['resourceVersion'])
+
+    def _is_registered(self, informer):
+        return self._informers.get(informer.key, {}).get(informer.namespace) is informer
+
+    def _run_in_background(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _notify(self, handler, key, event_type, obj):
+        retry_delay = 1
+        while True:
+            subscribers = self._subscribers.get(key, {})
+            if obj['metadata']['namespace'] in subscribers.values():
+                subscribers = [
+                    subscriber for subscriber, namespace in subscribers.items()
+                    if namespace == obj['metadata']['namespace']
+                ]
+            else:
+                subscribers = list(subscribers)
+            if not subscribers:
+                return
+            try:
+                await handler(event_type, obj, subscribers)
+                return
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                logger.warning(
+                    'Cannot process %s event of %s %s: %s. Retrying in %ss...',
+                    event_type, key[2], key[3], err, retry_delay
+                )
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 60)
+
+
+class SourceObjectCache:
+    """
+    Short-lived cache of the source objects that are read from the API server, i.e. that are not watched by an
+    informer.
+
+    The cluster objects that share a source object and the events that arrive at the same time read it once:
+    concurrent reads of the same object wait for a single request, and its result is reused for
+    OBJECT_CLONER_SOURCE_CACHE_TTL seconds. The objects received with the source object events are stored as well,
+    unless a newer version of the object is already cached.
+    """
+
+    def __init__(self):
+        self.ttl = float(os.environ.get('OBJECT_CLONER_SOURCE_CACHE_TTL', '2'))
+        self._objects = {}
+        self._requests = {}
+
+    # pylint: disable=too-many-arguments
+    async def get(self, group, version, kind, namespace, name):
+        """
+        Return a source object.
+
+        :param group:
+        :param version:
+        :param kind:
+        :param namespace:
+        :param name:
+        :return: dict, it is shared with other callers and must not be modified
+        """
+        key = (group, version, kind, namespace, name)
+        entry = self._objects.get(key)
+        if entry is not None and entry[1] >= time.monotonic():
+            return entry[0]
+        if key not in self._requests:
+            self._requests[key] = asyncio.ensure_future(self._read(key))
+        return await asyncio.shield(self._requests[key])
+
+    def store(self, group, version, kind, obj):
+        """
+        Put a source object into the cache unless a newer version of it is already there.
+
+        :param group:
+        :param version:
+        :param kind:
+        :param obj:
+        :return:
+        """
+        key = (group, version, kind, obj['metadata']['namespace'], obj['metadata']['name'])
+        entry = self._objects.get(key)
+        if entry is None or not _is_older(obj, entry[0]):
+            self._objects[key] = (obj, time.monotonic() + self.ttl)
+
+    # pylint: disable=too-many-arguments
+    def discard(self, group, version, kind, namespace, name):
+        """
+        Remove a deleted source object from the cache.
+
+        :param group:
+        :param version:
+        :param kind:
+        :param namespace:
+        :param name:
+        :return:
+        """
+        self._objects.pop((group, version, kind, namespace, name), None)
+
+    async def _read(self, key):
+        try:
+            obj = await get_namespaced_object(*key)
+        finally:
+            del self._requests[key]
+        now = time.monotonic()
+        for expired_key in [key for key, entry in self._objects.items() if entry[1] < now]:
+            del self._objects[expired_key]
+        self.store(*key[0:3], obj)
+        return self._objects[key][0]
+
+
+def _is_older(obj, other_obj):
+    """
+    resourceVersion is opaque, but in practice it is an integer that grows with every write; if it is not,
+    the objects are treated as equally fresh.
+    """
+    resource_version = obj['metadata'].get('resourceVersion', '')
+    other_resource_version = other_obj['metadata'].get('resourceVersion', '')
+    if resource_version.isdigit() and other_resource_version.isdigit():
+        return int(resource_version) < int(other_resource_version)
+    return False
+
+
+object_cache = ObjectCache()
+source_object_cache = SourceObjectCache()
+CACHED_OBJECTS.set_function(lambda: len(object_cache))
@@ -1,12 +1,13 @@
 """Kubernetes API operations."""
-import pykube
+from pykube.exceptions import HTTPError, ObjectDoesNotExist
 
-from .kubeapi import kubernetes_api
+from .kubeapi import kubernetes_api, object_kind_cache, get_api_path, get_kubernetes_api
+from .metrics import API_REQUESTS
 
 
 @kubernetes_api
 # pylint: disable=too-many-arguments
-def get_namespaced_object(api, group, version, kind, namespace, name):
+async def get_namespaced_object(api, group, version, kind, namespace, name):
     """
     Obtains API object in the given namespace.
 
@@ -16,15 +17,20 @@ def get_namespaced_object(api, group, version, kind, namespace, name):
     :param kind:
     :param namespace:
     :param name:
-    :return:
+    :return: dict
     """
-    kind = pykube.object_factory(api, f"{group}{'/' if group != '' else ''}{version}", kind)
-    return kind.objects(api).filter(namespace).get(name=name)
+    resource_kind = await object_kind_cache.get(api, group, version, kind)
+    response = await _request(api, resource_kind, 'GET', _get_object_path(resource_kind, namespace, name))
+    if response.status == 404:
+        _invalidate_if_resource_type_is_missing(response, resource_kind)
+        raise ObjectDoesNotExist(f"{name} does not exist.")
+    api.raise_for_status(response)
+    return response.data
 
 
 @kubernetes_api
 # pylint: disable=too-many-arguments
-def create_namespaced_object(api, group, version, kind, namespace, obj):
+async def create_namespaced_object(api, group, version, kind, namespace, obj):
     """
     Create API object in the given namespace.
 
@@ -34,16 +40,17 @@ def create_namespaced_object(api, group, version, kind, namespace, obj):
     :param kind:
     :param namespace:
     :param obj:
-    :return:
+    :return: dict
     """
-    obj['metadata']['namespace'] = namespace
-    kind = pykube.object_factory(api, f"{group}{'/' if group != '' else ''}{version}", kind)
-    return kind(api, obj).create()
+    obj = _with_namespace(obj, namespace)
+    resource_kind = await object_kind_cache.get(api, group, version, kind)
+    response = await _request(api, resource_kind, 'POST', _get_object_path(resource_kind, namespace), body=obj)
+    return _check_response(api, response, resource_kind)
 
 
 @kubernetes_api
 # pylint: disable=too-many-arguments
-def update_namespaced_object(api, group, version, kind, namespace, obj, subresource=None):
+async def update_namespaced_object(api, group, version, kind, namespace, obj, subresource=None):
     """
     Updates API object in the given namespace.
 
@@ -54,17 +61,85 @@ def update_namespaced_object(api, group, version, kind, namespace, obj, subresou
     :param kind:
     :param namespace:
     :param obj:
-    :return:
+    :return: dict
     """
-    obj['metadata']['namespace'] = namespace
-    print(f'XXXXXXXXXXXXXX: {obj}')
-    kind = pykube.object_factory(api, f"{group}{'/' if group != '' else ''}{version}", kind)
-    return kind(api, obj).update(subresource=subresource)
+    obj = _with_namespace(obj, namespace)
+    resource_kind = await object_kind_cache.get(api, group, version, kind)
+    response = await _request(
+        api,
+        resource_kind,
+        'PATCH',
+        _get_object_path(resource_kind, namespace, obj['metadata']['name'], subresource),
+        body=obj,
+        content_type='application/merge-patch+json'
+    )
+    return _check_response(api, response, resource_kind)
 
 
 @kubernetes_api
 # pylint: disable=too-many-arguments
-def delete_namespaced_object(api, group, version, kind, namespace, obj):
+async def patch_namespaced_object(api, group, version, kind, namespace, name, patch, subresource=None,
+                                  content_type='application/merge-patch+json'):
+    """
+    Patches API object in the given namespace.
+
+    :param api:
+    :param group:
+    :param version:
+    :param kind:
+    :param namespace:
+    :param name:
+    :param patch: a merge patch dict or a JSON patch list
+    :param subresource:
+    :param content_type: patch type, e.g. application/json-patch+json
+    :return: dict
+    """
+    resource_kind = await object_kind_cache.get(api, group, version, kind)
+    response = await _request(
+        api,
+        resource_kind,
+        'PATCH',
+        _get_object_path(resource_kind, namespace, name, subresource),
+        body=patch,
+        content_type=content_type
+    )
+    return _check_response(api, response, resource_kind)
+
+
+@kubernetes_api
+# pylint: disable=too-many-arguments
+async def apply_namespaced_object(api, group, version, kind, namespace, obj, field_manager='object-cloner'):
+    """
+    Creates or updates API object in the given namespace with server-side apply.
+
+    The fields that are set by another field manager are taken over.
+
+    :param api:
+    :param group:
+    :param version:
+    :param kind:
+    :param namespace:
+    :param obj: the object with the fields owned by the field manager
+    :param field_manager:
+    :return: dict
+    """
+    obj = _with_namespace(obj, namespace)
+    resource_kind = await object_kind_cache.get(api, group, version, kind)
+    response = await _request(
+        api,
+        resource_kind,
+        'PATCH',
+        _get_object_path(resource_kind, namespace, obj['metadata']['name']),
+        params={'fieldManager': field_manager, 'force': 'true'},
+        body=obj,
+        content_type='application/apply-patch+yaml'
+    )
+    return _check_response(api, response, resource_kind)
+
+
+@kubernetes_api
+# pylint: disable=too-many-arguments
+async def delete_namespaced_object(api, group, version, kind, namespace, obj):
     """
     Deletes API object from the given namespace.
 
@@ -76,6 +151,204 @@ def delete_namespaced_object(api, group, version, kind, namespace, obj):
     :param obj:
     :return:
     """
-    obj['metadata']['namespace'] = namespace
-    kind = pykube.object_factory(api, f"{group}{'/' if group != '' else ''}{version}", kind)
-    return kind(api, obj).delete()
+    resource_kind = await object_kind_cache.get(api, group, version, kind)
+    response = await _request(
+        api,
+        resource_kind,
+        'DELETE',
+        _get_object_path(resource_kind, namespace, obj['metadata']['name'])
+    )
+    if response.status != 404:
+        _check_response(api, response, resource_kind)
+
+
+@kubernetes_api
+# pylint: disable=too-many-arguments
+async def delete_namespaced_objects(api, group, version, kind, namespace, field_selector=None, label_selector=None):
+    """
+    Deletes all API objects that match the selectors from the given namespace with a single call.
+
+    :param api:
+    :param group:
+    :param version:
+    :param kind:
+    :param namespace:
+    :param field_selector: a dict or a string, e.g. {'metadata.name': 'my-secret'}
+    :param label_selector: a dict or a string
+    :return:
+    """
+    resource_kind = await object_kind_cache.get(api, group, version, kind)
+    response = await _request(
+        api,
+        resource_kind,
+        'DELETE',
+        _get_object_path(resource_kind, namespace),
+        params=_get_selector_params(field_selector, label_selector)
+    )
+    _check_response(api, response, resource_kind)
+
+
+# pylint: disable=too-many-arguments
+async def list_namespaced_objects(group, version, kind, namespace=None, field_selector=None, label_selector=None):
+    """
+    Lists API objects in the given namespace or, if namespace is not set, in all namespaces.
+
+    :param group:
+    :param version:
+    :param kind:
+    :param namespace:
+    :param field_selector: a dict or a string, e.g. {'metadata.name': 'my-secret'}
+    :param label_selector: a dict or a string
+    :return: list of dicts
+    """
+    object_list = await get_namespaced_object_list(group, version, kind, namespace, field_selector, label_selector)
+    return object_list['items']
+
+
+@kubernetes_api
+# pylint: disable=too-many-arguments
+async def get_namespaced_object_list(api, group, version, kind, namespace=None, field_selector=None,
+                                     label_selector=None):
+    """
+    Obtains a list of API objects in the given namespace or, if namespace is not set, in all namespaces.
+
+    Unlike list_namespaced_objects, returns the whole List object, including its resourceVersion.
+
+    :param api:
+    :param group:
+    :param version:
+    :param kind:
+    :param namespace:
+    :param field_selector: a dict or a string, e.g. {'metadata.name': 'my-secret'}
+    :param label_selector: a dict or a string
+    :return: dict
+    """
+    resource_kind = await object_kind_cache.get(api, group, version, kind)
+    response = await _request(
+        api,
+        resource_kind,
+        'GET',
+        _get_object_path(resource_kind, namespace),
+        params=_get_selector_params(field_selector, label_selector)
+    )
+    return _check_response(api, response, resource_kind)
+
+
+# pylint: disable=too-many-arguments
+async def watch_namespaced_objects(group, version, kind, resource_version, namespace=None, field_selector=None,
+                                   label_selector=None, timeout=300):
+    """
+    Watches API objects in the given namespace or, if namespace is not set, in all namespaces.
+
+    :param group:
+    :param version:
+    :param kind:
+    :param resource_version: resourceVersion to start watching from
+    :param namespace:
+    :param field_selector: a dict or a string, e.g. {'metadata.name': 'my-secret'}
+    :param label_selector: a dict or a string
+    :param timeout: the API server closes the watch after this number of seconds
+    :return: async generator of watch event dicts
+    """
+    api = await get_kubernetes_api()
+    resource_kind = await object_kind_cache.get(api, group, version, kind)
+    params = _get_selector_params(field_selector, label_selector)
+    params.update({
+        'resourceVersion': resource_version,
+        'allowWatchBookmarks': 'true',
+        'timeoutSeconds': str(timeout)
+    })
+    try:
+        async for event in api.watch(_get_object_path(resource_kind, namespace), params, timeout + 30):
+            yield event
+    except HTTPError as err:
+        API_REQUESTS.labels('WATCH', resource_kind.kind, err.code).inc()
+        raise
+    API_REQUESTS.labels('WATCH', resource_kind.kind, 200).inc()
+
+
+@kubernetes_api
+async def get_resource_kind(api, group, version, kind):
+    """
+    Resolves an object kind to its API resource.
+
+    :param api:
+    :param group:
+    :param version:
+    :param kind:
+    :return: ResourceKind
+    """
+    return await object_kind_cache.get(api, group, version, kind)
+
+
+@kubernetes_api
+async def warm_object_kinds(api, group_versions):
+    """
+    Run API discovery for the given group versions in advance.
+
+    :param api:
+    :param group_versions: list of (group, version) tuples
+    :return:
+    """
+    for group, version in group_versions:
+        await object_kind_cache.discover(api, group, version)
+
+
+async def _request(api, resource_kind, method, path, **kwargs):
+    response = await api.request(method, path, **kwargs)
+    API_REQUESTS.labels(method, resource_kind.kind, response.status).inc()
+    return response
+
+
+def _get_object_path(resource_kind, namespace, name=None, subresource=None):
+    path = get_api_path(resource_kind.group, resource_kind.version)
+    if resource_kind.namespaced and namespace is not None:
+        path += f'/namespaces/{namespace}'
+    path += f'/{resource_kind.plural}'
+    if name is not None:
+        path += f'/{name}'
+    if subresource is not None:
+        path += f'/{subresource}'
+    return path
+
+
+def _get_selector_params(field_selector, label_selector):
+    params = {}
+    if field_selector is not None:
+        params['fieldSelector'] = _as_selector(field_selector)
+    if label_selector is not None:
+        params['labelSelector'] = _as_selector(label_selector)
+    return params
+
+
+def _as_selector(selector):
+    if isinstance(selector, dict):
+        return ','.join(f'{key}={value}' for key, value in selector.items())
+    return selector
+
+
+def _with_namespace(obj, namespace):
+    """
+    Return a shallow copy of the object with its namespace set, so the same object can be sent to
+    several namespaces at once.
+    """
+    return {**obj, 'metadata': {**obj['metadata'], 'namespace': namespace}}
+
+
+def _check_response(api, response, resource_kind):
+    """
+    Raise an error for an unsuccessful response and drop the cached kind if its resource type is gone.
+    """
+    if response.status == 404:
+        _invalidate_if_resource_type_is_missing(response, resource_kind)
+    api.raise_for_status(response)
+    return response.data
+
+
+def _invalidate_if_resource_type_is_missing(response, resource_kind):
+    """
+    A missing object is reported with a Status object while an unknown resource type (e.g. a removed CRD) is
+    reported with a plain "404 page not found" body.
+    """
+    if not isinstance(response.data, dict):
+        object_kind_cache.invalidate(resource_kind.group, resource_kind.version, resource_kind.kind)
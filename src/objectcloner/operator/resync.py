@@ -0,0 +1,153 @@
+"""Periodic resync of cluster objects."""
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import time
+from datetime import datetime
+
+from pykube.exceptions import HTTPError
+
+from .kubeapi import RateLimiter, request_budget
+from .metrics import RESYNCS
+from .resources import patch_namespaced_object
+from .selectors import cluster_object_index
+from .syncqueue import sync_queue
+
+CLUSTER_OBJECT_KIND = ('object-cloner.ideamix.es', 'v1', 'ClusterObject')
+# How often (in seconds) the scheduler looks for the cluster objects due for a resync.
+RESYNC_TICK = 1
+
+logger = logging.getLogger(__name__)
+
+
+class ResyncScheduler:
+    """
+    Syncs every cluster object handled by the operator once per OBJECT_CLONER_RESYNC_PERIOD seconds, so the clones
+    that drifted without an event the operator noticed are repaired.
+
+    The resyncs are spread across the period: a cluster object is resynced for the first time after a share of the
+    period given by the hash of its namespace and name, and then once per period shifted randomly by up to
+    OBJECT_CLONER_RESYNC_JITTER of the period. A resync is a regular sync with drift verification, so the clones are
+    compared with the source object by the source hash annotation and field by field in memory, and only the ones that
+    differ are written; the source objects and clones kept in memory by the object cache are compared without API
+    requests at all.
+
+    The API requests of the resyncs are limited to OBJECT_CLONER_RESYNC_API_QPS per second across all cluster
+    objects, in addition to the rate limit of all requests. A resync that is merged with a sync requested by an event
+    is not limited. The result of the last resync is written to the lastResync field of the cluster object status.
+    """
+
+    def __init__(self):
+        self.period = float(os.environ.get('OBJECT_CLONER_RESYNC_PERIOD', '3600'))
+        self.jitter = float(os.environ.get('OBJECT_CLONER_RESYNC_JITTER', '0.1'))
+        qps = float(os.environ.get('OBJECT_CLONER_RESYNC_API_QPS', '5'))
+        self.budget = RateLimiter(qps, int(qps))
+        self._due_times = {}
+        self._resyncs = {}
+        self._task = None
+
+    @property
+    def is_enabled(self):
+        """
+        Whether the cluster objects are resynced periodically.
+
+        :return: bool
+        """
+        return self.period > 0
+
+    def start(self):
+        """
+        Resync the cluster objects in background.
+
+        :return:
+        """
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        """
+        Stop resyncing the cluster objects.
+
+        :return:
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._resyncs.values()):
+            task.cancel()
+
+    def schedule(self, now):
+        """
+        Start the resyncs that are due and schedule the resyncs of the new cluster objects.
+
+        :param now: monotonic time
+        :return: list of the keys of the started resyncs
+        """
+        keys = cluster_object_index.keys()
+        for key in self._due_times.keys() - set(keys):
+            del self._due_times[key]
+        started_keys = []
+        for key in keys:
+            due_time = self._due_times.get(key)
+            if due_time is None:
+                self._due_times[key] = now + self._get_offset(key)
+            elif due_time <= now and key not in self._resyncs:
+                jitter = random.uniform(-self.jitter, self.jitter)
+                self._due_times[key] = max(due_time, now) + self.period * (1 + jitter)
+                task = asyncio.ensure_future(self._resync(key))
+                self._resyncs[key] = task
+                task.add_done_callback(lambda _, key=key: self._resyncs.pop(key, None))
+                started_keys.append(key)
+        return started_keys
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(RESYNC_TICK)
+            self.schedule(time.monotonic())
+
+    def _get_offset(self, key):
+        digest = hashlib.sha256('/'.join(key).encode()).digest()
+        return int.from_bytes(digest[:8], 'big') / 2 ** 64 * self.period
+
+    async def _resync(self, key):
+        """
+        Sync a cluster object within the request budget and record the result in its status.
+
+        :param key: (namespace, name)
+        :return:
+        """
+        cluster_object = cluster_object_index.get(key)
+        if cluster_object is None or cluster_object.spec.is_deleted:
+            return
+        # The clones modified by someone else without an event noticed by the operator still have the current source
+        # hash annotation.
+        cluster_object.is_drift_verification_enabled = True
+        last_resync = {'timestamp': datetime.strftime(datetime.utcnow(), '%Y-%m-%dT%H:%M:%SZ'), 'message': None}
+        try:
+            is_synced = await sync_queue.sync(cluster_object, budget=self.budget)
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            cluster_object.logger.warning(f'Cannot resync: {err}')
+            last_resync.update(result='Failed', message=str(err))
+        else:
+            if is_synced is None:
+                # The cluster object is deleted.
+                return
+            last_resync['result'] = 'Succeeded' if is_synced else 'SourceObjectNotFound'
+        RESYNCS.labels(last_resync['result']).inc()
+        budget_token = request_budget.set(self.budget)
+        try:
+            await patch_namespaced_object(
+                *CLUSTER_OBJECT_KIND,
+                *key,
+                {'status': {'lastResync': last_resync}},
+                subresource='status'
+            )
+        except HTTPError as err:
+            if err.code != 404:
+                logger.warning('Cannot write the resync status of cluster object %s/%s: %s', *key, err)
+        finally:
+            request_budget.reset(budget_token)
+
+
+resync_scheduler = ResyncScheduler()
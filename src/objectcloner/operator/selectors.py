@@ -0,0 +1,285 @@
+"""Namespace selectors of cluster objects and the index of cluster objects by the namespaces they select."""
+import functools
+import re
+
+from .helpers import REGEX_SPECIAL_CHARACTERS
+from .metrics import CLUSTER_OBJECTS
+
+LABEL_SELECTOR_OPERATORS = frozenset(('In', 'NotIn', 'Exists', 'DoesNotExist'))
+_OPTIONAL_CHARACTER_QUANTIFIERS = set('*?{')
+
+
+class LabelSelector:
+    """
+    Kubernetes label selector, i.e. matchLabels and matchExpressions with the In, NotIn, Exists and DoesNotExist
+    operators.
+
+    The namespaces are selected with the inverted label index of the namespaces: the candidates are the namespaces
+    that have the labels required by matchLabels and the In and Exists expressions, and only they are checked against
+    all requirements. All namespaces are checked only if the selector has no such requirement.
+    """
+
+    def __init__(self, requirements):
+        """
+        :param requirements: tuple of (label, operator, tuple of values)
+        """
+        self.requirements = requirements
+
+    def matches(self, labels):
+        """
+        Check whether a set of labels is selected.
+
+        :param labels: dict of label to value
+        :return: bool
+        """
+        for label, operator, values in self.requirements:
+            if operator == 'In' and (label not in labels or labels[label] not in values):
+                return False
+            if operator == 'NotIn' and label in labels and labels[label] in values:
+                return False
+            if operator == 'Exists' and label not in labels:
+                return False
+            if operator == 'DoesNotExist' and label in labels:
+                return False
+        return True
+
+    def select(self, namespaces):
+        """
+        Select the namespaces by their labels.
+
+        :param namespaces: namespace names with get_labels(name) and get_labeled(label, value=None) lookups
+        :return: set of namespace names
+        """
+        candidates = None
+        for label, operator, values in self.requirements:
+            if operator == 'In':
+                labeled = set().union(*(namespaces.get_labeled(label, value) for value in values))
+            elif operator == 'Exists':
+                labeled = namespaces.get_labeled(label)
+            else:
+                continue
+            candidates = labeled if candidates is None else candidates & labeled
+        if candidates is None:
+            candidates = set(namespaces)
+        return {name for name in candidates if self.matches(namespaces.get_labels(name))}
+
+
+class NamespaceSelector:
+    """
+    Selects the namespaces that match any of the include patterns and none of the exclude patterns and, if the
+    cluster object has a namespaceSelector, its label selector. The patterns are Python regular expressions that are
+    matched at the beginning of a namespace name, like re.match does.
+
+    The namespaces are passed as a collection of names that can also look up the labels of the namespaces, see
+    LabelSelector.select; the lookups are used only by the selectors with a label selector.
+    """
+
+    def __init__(self, namespaces_to_include, namespaces_to_exclude, label_requirements=None):
+        self.namespaces_to_include = [re.compile(pattern) for pattern in namespaces_to_include]
+        self.namespaces_to_exclude = [re.compile(pattern) for pattern in namespaces_to_exclude]
+        self.literal_prefixes = {_get_literal_prefix(pattern) for pattern in namespaces_to_include}
+        self.label_selector = LabelSelector(label_requirements) if label_requirements is not None else None
+
+    def matches_name(self, namespace_name):
+        """
+        Check whether a namespace name matches the patterns.
+
+        :param namespace_name:
+        :return: bool
+        """
+        return any(pattern.match(namespace_name) for pattern in self.namespaces_to_include) \
+            and not any(pattern.match(namespace_name) for pattern in self.namespaces_to_exclude)
+
+    def matches(self, namespace_name, namespaces):
+        """
+        Check whether a namespace is selected.
+
+        :param namespace_name:
+        :param namespaces: all namespaces
+        :return: bool
+        """
+        return self.matches_name(namespace_name) \
+            and (self.label_selector is None or self.label_selector.matches(namespaces.get_labels(namespace_name)))
+
+    def select(self, namespaces):
+        """
+        Filter the selected namespaces.
+
+        :param namespaces: all namespaces
+        :return: list of namespace names
+        """
+        if self.label_selector is not None:
+            namespaces = sorted(self.label_selector.select(namespaces))
+        return [namespace_name for namespace_name in namespaces if self.matches_name(namespace_name)]
+
+
+@functools.lru_cache(maxsize=1024)
+def get_namespace_selector(namespaces_to_include, namespaces_to_exclude, label_requirements=None):
+    """
+    Return a compiled namespace selector. Selectors are cached, so the patterns of a cluster object are compiled
+    again only when they change.
+
+    :param namespaces_to_include: tuple of patterns
+    :param namespaces_to_exclude: tuple of patterns
+    :param label_requirements: tuple of label requirements, see get_label_requirements, or None
+    :return: NamespaceSelector
+    """
+    return NamespaceSelector(namespaces_to_include, namespaces_to_exclude, label_requirements)
+
+
+def get_label_requirements(label_selector):
+    """
+    Convert the namespaceSelector of a cluster object to a hashable tuple of label requirements.
+
+    :param label_selector: dict with matchLabels and matchExpressions, or None
+    :return: tuple of (label, operator, tuple of values), or None if there is no label selector
+    :raises ValueError: if an expression has an unknown operator, so the selector does not select more namespaces
+                        than it should
+    """
+    if label_selector is None:
+        return None
+    for expression in label_selector.get('matchExpressions') or []:
+        if expression.get('operator') not in LABEL_SELECTOR_OPERATORS:
+            raise ValueError(f"unknown label selector operator {expression.get('operator')!r}")
+    return tuple(
+        [(label, 'In', (value,)) for label, value in sorted((label_selector.get('matchLabels') or {}).items())]
+        + [
+            (expression['key'], expression['operator'], tuple(expression.get('values') or ()))
+            for expression in label_selector.get('matchExpressions') or []
+        ]
+    )
+
+
+class ClusterObjectIndex:
+    """
+    Index of cluster objects by the literal prefixes of their namespace include patterns, so the cluster objects that
+    select a namespace can be found without matching the namespace against the patterns of all cluster objects.
+    The cluster objects are also indexed by UID, so the owner of a clone can be found by its owner UID label.
+
+    Only the specs of the cluster objects are kept, see ClusterObjectSpec. The cluster objects are built from them on
+    demand by cluster_object_factory, which is set by the handlers.
+    """
+
+    def __init__(self):
+        self._specs = {}
+        self._keys_by_prefix = {}
+        self._keys_by_uid = {}
+        self.cluster_object_factory = None
+
+    def __len__(self):
+        return len(self._specs)
+
+    def add(self, key, spec):
+        """
+        Add a cluster object to the index or replace it.
+
+        :param key: a unique cluster object key, e.g. (namespace, name)
+        :param spec: ClusterObjectSpec
+        :return:
+        """
+        self.remove(key)
+        self._specs[key] = spec
+        self._keys_by_uid[spec.uid] = key
+        for prefix in spec.namespace_selector.literal_prefixes:
+            self._keys_by_prefix.setdefault(prefix, set()).add(key)
+
+    def remove(self, key):
+        """
+        Remove a cluster object from the index.
+
+        :param key:
+        :return:
+        """
+        spec = self._specs.pop(key, None)
+        if spec is None:
+            return
+        if self._keys_by_uid.get(spec.uid) == key:
+            del self._keys_by_uid[spec.uid]
+        for prefix in spec.namespace_selector.literal_prefixes:
+            keys = self._keys_by_prefix[prefix]
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_prefix[prefix]
+
+    def keys(self):
+        """
+        Return the keys of the indexed cluster objects.
+
+        :return: list of keys
+        """
+        return list(self._specs)
+
+    def get_spec(self, key):
+        """
+        Return the spec of an indexed cluster object.
+
+        :param key:
+        :return: ClusterObjectSpec or None if the cluster object is not indexed
+        """
+        return self._specs.get(key)
+
+    def get(self, key):
+        """
+        Return an indexed cluster object.
+
+        :param key:
+        :return: ClusterObject or None if the cluster object is not indexed
+        """
+        spec = self._specs.get(key)
+        return self.cluster_object_factory(spec) if spec is not None else None
+
+    def get_by_uid(self, uid):
+        """
+        Return an indexed cluster object by its UID.
+
+        :param uid:
+        :return: ClusterObject or None if the cluster object is not indexed
+        """
+        key = self._keys_by_uid.get(uid)
+        return self.get(key) if key is not None else None
+
+    def get_selecting(self, namespace_name):
+        """
+        Return the cluster objects that select a namespace.
+
+        :param namespace_name:
+        :return: list of ClusterObject
+        """
+        return [
+            cluster_object for cluster_object in self.get_name_matching(namespace_name)
+            if cluster_object.namespace_selector.matches(namespace_name, cluster_object.all_namespace_names)
+        ]
+
+    def get_name_matching(self, namespace_name):
+        """
+        Return the cluster objects whose patterns match a namespace name, regardless of their label selectors.
+
+        :param namespace_name:
+        :return: list of ClusterObject
+        """
+        keys = set()
+        for length in range(len(namespace_name) + 1):
+            keys.update(self._keys_by_prefix.get(namespace_name[:length], ()))
+        return [
+            self.cluster_object_factory(self._specs[key]) for key in keys
+            if self._specs[key].namespace_selector.matches_name(namespace_name)
+        ]
+
+
+def _get_literal_prefix(pattern):
+    """
+    Return the longest literal string every name matched by the pattern starts with. The prefix is empty for the
+    patterns that cannot be analyzed simply, e.g. the ones with alternatives or inline flags.
+    """
+    if '|' in pattern:
+        return ''
+    prefix_length = 0
+    while prefix_length < len(pattern) and pattern[prefix_length] not in REGEX_SPECIAL_CHARACTERS:
+        prefix_length += 1
+    if prefix_length < len(pattern) and pattern[prefix_length] in _OPTIONAL_CHARACTER_QUANTIFIERS:
+        prefix_length = max(prefix_length - 1, 0)
+    return pattern[:prefix_length]
+
+
+cluster_object_index = ClusterObjectIndex()
+CLUSTER_OBJECTS.set_function(lambda: len(cluster_object_index))
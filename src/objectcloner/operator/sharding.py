@@ -0,0 +1,325 @@
+"""Partitioning of cluster objects across operator replicas."""
+import asyncio
+import hashlib
+import logging
+import os
+import signal
+import socket
+from datetime import datetime, timedelta, timezone
+
+from pykube.exceptions import HTTPError, ObjectDoesNotExist
+
+from .batching import Batcher
+from .resources import create_namespaced_object, get_namespaced_object, list_namespaced_objects, \
+    patch_namespaced_object, update_namespaced_object
+
+SHARD_ANNOTATION = 'object-cloner.ideamix.es/shard'
+SHARD_LEASE_LABEL = 'object-cloner.ideamix.es/shard-lease'
+SERVICE_ACCOUNT_NAMESPACE_PATH = '/var/run/secrets/kubernetes.io/serviceaccount/namespace'
+LEASE_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+logger = logging.getLogger(__name__)
+
+
+class ShardCoordinator:  # pylint: disable=too-many-instance-attributes
+    """
+    Coordinates the replicas that share the cluster objects when OBJECT_CLONER_SHARD_COUNT is set.
+
+    There are OBJECT_CLONER_SHARD_COUNT shards. A replica holds one shard with a Lease named after the shard, renews
+    it every third of OBJECT_CLONER_SHARD_LEASE_DURATION seconds and learns the other shards from their Leases; the
+    replicas that find no free shard wait for one. Each cluster object is owned by one of the live shards chosen by
+    rendezvous hashing of its namespace and name, so only the cluster objects of a shard that leaves or joins move
+    to another shard.
+
+    The owner claims a cluster object by writing its shard to the object-cloner.ideamix.es/shard annotation, and the
+    kopf handlers of the cluster objects handle only the cluster objects annotated with their own shard, so the
+    previous owner stops handling a cluster object as soon as the new owner starts. A replica that loses its Lease
+    stops, since its shard is taken over by another replica.
+
+    The kopf finalizer and the kopf state in the cluster object status are named after the shard, see get_name.
+    """
+
+    def __init__(self):
+        self.shard_count = int(os.environ.get('OBJECT_CLONER_SHARD_COUNT', '0'))
+        self.lease_duration = float(os.environ.get('OBJECT_CLONER_SHARD_LEASE_DURATION', '15'))
+        self.namespace = os.environ.get('OBJECT_CLONER_SHARD_LEASE_NAMESPACE') or _get_own_namespace()
+        self.identity = os.environ.get('OBJECT_CLONER_SHARD_IDENTITY') or socket.gethostname()
+        self.shard = None
+        self.members = []
+        self._cluster_object_shards = {}
+        self._claimer = Batcher(self._claim, 1)
+        self._lease = None
+        self._task = None
+        self._tasks = set()
+
+    @property
+    def is_enabled(self):
+        """
+        Whether the cluster objects are shared by several replicas.
+
+        :return: bool
+        """
+        return self.shard_count > 0
+
+    def is_owned(self, annotations, **_):
+        """
+        Check whether a cluster object is handled by this replica. It is a kopf handler filter.
+
+        :param annotations: annotations of the cluster object
+        :param _:
+        :return: bool
+        """
+        return not self.is_enabled or (self.shard is not None and annotations.get(SHARD_ANNOTATION) == str(self.shard))
+
+    def get_name(self, name):
+        """
+        Qualify a name of the kopf state with the shard, so the replicas do not share their kopf state.
+
+        :param name: e.g. the finalizer name
+        :return: str
+        """
+        return f'{name}-shard-{self.shard}' if self.is_enabled else name
+
+    def observe(self, namespace, name, annotations):
+        """
+        Remember the shard of a cluster object and claim it in background if it belongs to the shard of this replica.
+
+        :param namespace:
+        :param name:
+        :param annotations: annotations of the cluster object
+        :return: whether the cluster object is handled by this replica
+        """
+        if not self.is_enabled:
+            return True
+        self._cluster_object_shards[(namespace, name)] = annotations.get(SHARD_ANNOTATION)
+        if self._is_claimable(namespace, name):
+            task = asyncio.ensure_future(self._claimer.add((namespace, name)))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return self.is_owned(annotations)
+
+    def forget(self, namespace, name):
+        """
+        Forget a deleted cluster object.
+
+        :param namespace:
+        :param name:
+        :return:
+        """
+        self._cluster_object_shards.pop((namespace, name), None)
+
+    def get_owner(self, namespace, name):
+        """
+        Choose the shard that owns a cluster object among the live shards.
+
+        :param namespace:
+        :param name:
+        :return: shard number or None if there are no live shards
+        """
+        if not self.members:
+            return None
+        return max(self.members, key=lambda shard: hashlib.sha256(f'{shard}/{namespace}/{name}'.encode()).digest())
+
+    async def acquire(self):
+        """
+        Wait until this replica holds a shard.
+
+        :return:
+        """
+        while True:
+            for shard in range(self.shard_count):
+                if await self._try_acquire(shard):
+                    self.shard = shard
+                    logger.info('Holding shard %s of %s', shard, self.shard_count)
+                    await self._refresh_members()
+                    return
+            logger.info('All %s shards are held by other replicas, waiting for a free one', self.shard_count)
+            await asyncio.sleep(self.lease_duration / 3)
+
+    def start(self):
+        """
+        Renew the Lease and follow the membership changes in background.
+
+        :return:
+        """
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        """
+        Stop renewing the Lease.
+
+        :return:
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in self._tasks:
+            task.cancel()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.lease_duration / 3)
+            try:
+                await self._renew()
+                await self._refresh_members()
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                logger.warning('Cannot renew the Lease of shard %s: %s', self.shard, err)
+                if _parse_time(self._lease['spec']['renewTime']) + timedelta(seconds=self.lease_duration) \
+                        < datetime.now(timezone.utc):
+                    logger.error('The Lease of shard %s has expired, stopping', self.shard)
+                    os.kill(os.getpid(), signal.SIGTERM)
+                    return
+
+    async def _try_acquire(self, shard):
+        name = _get_lease_name(shard)
+        now = datetime.now(timezone.utc)
+        try:
+            lease = await get_namespaced_object('coordination.k8s.io', 'v1', 'Lease', self.namespace, name)
+        except ObjectDoesNotExist:
+            lease = None
+        spec = {
+            'holderIdentity': self.identity,
+            'leaseDurationSeconds': int(self.lease_duration),
+            'acquireTime': _format_time(now),
+            'renewTime': _format_time(now),
+        }
+        try:
+            if lease is None:
+                self._lease = await create_namespaced_object('coordination.k8s.io', 'v1', 'Lease', self.namespace, {
+                    'apiVersion': 'coordination.k8s.io/v1',
+                    'kind': 'Lease',
+                    'metadata': {'name': name, 'labels': {SHARD_LEASE_LABEL: 'true'}},
+                    'spec': spec
+                })
+                return True
+            if lease['spec'].get('holderIdentity') != self.identity and not self._is_expired(lease, now):
+                return False
+            # The resourceVersion makes the update fail if another replica has acquired the Lease meanwhile.
+            self._lease = await update_namespaced_object('coordination.k8s.io', 'v1', 'Lease', self.namespace, {
+                'metadata': {'name': name, 'resourceVersion': lease['metadata']['resourceVersion']},
+                'spec': spec
+            })
+            return True
+        except HTTPError as err:
+            if err.code == 409:
+                return False
+            raise
+
+    async def _renew(self):
+        """
+        Renew the Lease. If the update conflicts with a write of the Lease by someone else, e.g. a label change, the
+        Lease is read again and the renewal fails only if it is held by another replica now.
+
+        :return:
+        """
+        for attempt in range(2):
+            try:
+                lease = await update_namespaced_object('coordination.k8s.io', 'v1', 'Lease', self.namespace, {
+                    'metadata': {
+                        'name': self._lease['metadata']['name'],
+                        'resourceVersion': self._lease['metadata']['resourceVersion']
+                    },
+                    'spec': {'renewTime': _format_time(datetime.now(timezone.utc))}
+                })
+            except HTTPError as err:
+                if err.code != 409 or attempt == 1:
+                    raise
+                lease = await get_namespaced_object(
+                    'coordination.k8s.io', 'v1', 'Lease', self.namespace, self._lease['metadata']['name']
+                )
+                if lease['spec'].get('holderIdentity') == self.identity:
+                    self._lease = lease
+                    continue
+            if lease['spec'].get('holderIdentity') != self.identity:
+                raise HTTPError(409, f"the Lease is held by {lease['spec'].get('holderIdentity')}")
+            self._lease = lease
+            return
+
+    async def _refresh_members(self):
+        now = datetime.now(timezone.utc)
+        leases = await list_namespaced_objects(
+            'coordination.k8s.io',
+            'v1',
+            'Lease',
+            self.namespace,
+            label_selector={SHARD_LEASE_LABEL: 'true'}
+        )
+        members = sorted(
+            shard for shard, lease in ((_get_lease_shard(lease), lease) for lease in leases)
+            if shard is not None and shard < self.shard_count and not self._is_expired(lease, now)
+        )
+        if self.shard not in members:
+            members = sorted(members + [self.shard])
+        if members != self.members:
+            logger.info('Live shards: %s', members)
+            self.members = members
+        # The cluster objects of the shards that left, and the ones whose claim failed, are claimed.
+        await self._claim([key for key in self._cluster_object_shards if self._is_claimable(*key)])
+
+    def _is_claimable(self, namespace, name):
+        return self.shard is not None and self._cluster_object_shards.get((namespace, name)) != str(self.shard) \
+            and self.get_owner(namespace, name) == self.shard
+
+    async def _claim(self, keys):
+        """
+        Annotate the cluster objects with the shard of this replica.
+
+        :param keys: list of (namespace, name)
+        :return:
+        """
+        for namespace, name in keys:
+            if not self._is_claimable(namespace, name):
+                continue
+            try:
+                await patch_namespaced_object(
+                    'object-cloner.ideamix.es',
+                    'v1',
+                    'ClusterObject',
+                    namespace,
+                    name,
+                    {'metadata': {'annotations': {SHARD_ANNOTATION: str(self.shard)}}}
+                )
+                self._cluster_object_shards[(namespace, name)] = str(self.shard)
+                logger.info('Claimed cluster object %s/%s', namespace, name)
+            except HTTPError as err:
+                if err.code == 404:
+                    self.forget(namespace, name)
+                else:
+                    logger.warning('Cannot claim cluster object %s/%s: %s', namespace, name, err)
+
+    def _is_expired(self, lease, now):
+        renew_time = lease['spec'].get('renewTime')
+        if renew_time is None:
+            return True
+        duration = lease['spec'].get('leaseDurationSeconds', self.lease_duration)
+        return _parse_time(renew_time) + timedelta(seconds=duration) < now
+
+
+def _get_own_namespace():
+    try:
+        with open(SERVICE_ACCOUNT_NAMESPACE_PATH, encoding='utf-8') as namespace_file:
+            return namespace_file.read().strip()
+    except OSError:
+        return 'default'
+
+
+def _get_lease_name(shard):
+    return f'object-cloner-shard-{shard}'
+
+
+def _get_lease_shard(lease):
+    prefix, _, shard = lease['metadata']['name'].rpartition('-')
+    if prefix != 'object-cloner-shard' or not shard.isdigit():
+        return None
+    return int(shard)
+
+
+def _format_time(time):
+    return time.strftime(LEASE_TIME_FORMAT)
+
+
+def _parse_time(value):
+    return datetime.strptime(value, LEASE_TIME_FORMAT).replace(tzinfo=timezone.utc)
+
+
+shard_coordinator = ShardCoordinator()
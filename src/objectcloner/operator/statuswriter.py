@@ -0,0 +1,332 @@
+"""Coalescing writer of the synced namespaces status of cluster objects."""
+import asyncio
+import os
+from datetime import datetime
+
+from pykube.exceptions import HTTPError
+
+from .helpers import get_object_hash
+from .resources import get_namespaced_object, patch_namespaced_object
+
+STATUS_HISTORY_LIMIT = int(os.environ.get('OBJECT_CLONER_STATUS_HISTORY_LIMIT', '10'))
+
+
+class SyncStatus:  # pylint: disable=too-many-instance-attributes
+    """
+    In-memory copy of the synced namespaces status of one cluster object and the changes that are not written yet.
+
+    The status is kept either as the syncedNamespaces list (List format) or as the syncSummary (Compact format).
+    The compact status does not contain the namespace names, so the synced namespaces known to the operator are
+    kept in memory only and are restored by the full sync of the cluster object on the operator start.
+    """
+
+    def __init__(self, spec, status):
+        self.object_attrs = {
+            'group': 'object-cloner.ideamix.es',
+            'version': 'v1',
+            'kind': 'ClusterObject',
+            'namespace': spec.namespace,
+            'name': spec.name
+        }
+        self.uid = spec.uid
+        self.status_format = spec.status_format
+        self.synced_namespaces = None
+        self.positions = {}
+        self.sync_summary = {}
+        self.pending = {}
+        self.pending_failures = {}
+        self.flush = None
+        self.lock = asyncio.Lock()
+        self.load(status)
+
+    def load(self, status):
+        """
+        Replace the copy of the status.
+
+        :param status: the status of the cluster object
+        :return:
+        """
+        synced_namespaces = status.get('syncedNamespaces')
+        self.synced_namespaces = None if synced_namespaces is None else list(synced_namespaces)
+        if self.synced_namespaces is not None or self.status_format == 'List':
+            self.positions = {
+                namespace_status['name']: position
+                for position, namespace_status in enumerate(self.synced_namespaces or [])
+            }
+        self.sync_summary = status.get('syncSummary') or {}
+
+    def get_namespace_names(self):
+        """
+        List the synced namespaces including the changes that are not written yet.
+
+        :return: list of namespace names
+        """
+        namespace_names = [name for name in self.positions if self.pending.get(name, '') is not None]
+        return namespace_names + [
+            name for name, timestamp in self.pending.items() if timestamp is not None and name not in self.positions
+        ]
+
+    def get_patch(self, changes, failures):
+        """
+        Build a patch of the status.
+
+        :param changes: dict of namespace name to timestamp or None for the namespaces to remove
+        :param failures: dict of namespace name to error message, only the compact status records them
+        :return: tuple of the patch content type, the patch and the resulting status
+        """
+        if self.status_format == 'Compact':
+            return self._get_compact_patch(changes, failures)
+        return self._get_list_patch(changes)
+
+    def _get_compact_patch(self, changes, failures):
+        """
+        Build a merge patch of the syncSummary. It holds the number and the hash of the synced namespace names instead
+        of the names, and bounded lists of the recent changes and failures.
+        """
+        now = datetime.strftime(datetime.utcnow(), '%Y-%m-%dT%H:%M:%SZ')
+        namespace_names = sorted(
+            {name for name in self.positions if changes.get(name, '') is not None}
+            | {name for name, timestamp in changes.items() if timestamp is not None}
+        )
+        recent_changes = [
+            {'name': name, 'action': 'Removed' if timestamp is None else 'Synced', 'timestamp': timestamp or now}
+            for name, timestamp in changes.items()
+        ] + self.sync_summary.get('recentChanges', [])
+        recent_failures = [
+            {'name': name, 'message': message, 'timestamp': now} for name, message in failures.items()
+        ] + [failure for failure in self.sync_summary.get('failures', []) if failure['name'] not in changes]
+        sync_summary = {
+            'count': len(namespace_names),
+            'namespacesHash': get_object_hash(namespace_names),
+            'recentChanges': recent_changes[:STATUS_HISTORY_LIMIT],
+            'failures': recent_failures[:STATUS_HISTORY_LIMIT]
+        }
+        patch = {'status': {'syncSummary': sync_summary}}
+        if self.synced_namespaces is not None:
+            patch['status']['syncedNamespaces'] = None
+        # The names are not written, so they are kept in the resulting status for load only.
+        return 'application/merge-patch+json', patch, {
+            'syncSummary': sync_summary,
+            'syncedNamespaces': [{'name': name} for name in namespace_names]
+        }
+
+    def _get_list_patch(self, changes):
+        """
+        Build a patch of the changed entries of the syncedNamespaces list.
+
+        A JSON patch is used to change the list items in place. Each changed item is tested to have the expected name,
+        so the patch fails instead of changing a wrong item if the list was modified by someone else.
+        """
+        if self.synced_namespaces is None:
+            # The list does not exist yet or the status was compact, the namespaces known from it are kept.
+            now = datetime.strftime(datetime.utcnow(), '%Y-%m-%dT%H:%M:%SZ')
+            synced_namespaces = [
+                {'name': name, 'timestamp': changes.get(name) or now}
+                for name in self.positions if changes.get(name, '') is not None
+            ] + [
+                {'name': name, 'timestamp': timestamp} for name, timestamp in changes.items()
+                if timestamp is not None and name not in self.positions
+            ]
+            return 'application/merge-patch+json', {'status': {'syncedNamespaces': synced_namespaces}}, \
+                {'syncedNamespaces': synced_namespaces}
+        operations = []
+        synced_namespaces = list(self.synced_namespaces)
+        removed_positions = sorted(
+            (
+                self.positions[name] for name, timestamp in changes.items()
+                if timestamp is None and name in self.positions
+            ),
+            reverse=True
+        )
+        for position in removed_positions:
+            operations.append(_test_name(position, synced_namespaces[position]['name']))
+            operations.append({'op': 'remove', 'path': f'/status/syncedNamespaces/{position}'})
+            del synced_namespaces[position]
+        positions = {namespace_status['name']: position for position, namespace_status in enumerate(synced_namespaces)}
+        for name, timestamp in changes.items():
+            if timestamp is None:
+                continue
+            if name in positions:
+                operations.append(_test_name(positions[name], name))
+                operations.append({
+                    'op': 'add',
+                    'path': f'/status/syncedNamespaces/{positions[name]}/timestamp',
+                    'value': timestamp
+                })
+                synced_namespaces[positions[name]] = {**synced_namespaces[positions[name]], 'timestamp': timestamp}
+            else:
+                operations.append({
+                    'op': 'add',
+                    'path': '/status/syncedNamespaces/-',
+                    'value': {'name': name, 'timestamp': timestamp}
+                })
+                synced_namespaces.append({'name': name, 'timestamp': timestamp})
+        return 'application/json-patch+json', operations, {'syncedNamespaces': synced_namespaces}
+
+
+class StatusWriter:
+    """
+    Writes the synced namespaces status of cluster objects.
+
+    The changes made for a cluster object within OBJECT_CLONER_STATUS_WRITE_INTERVAL seconds are written together,
+    and only the changed entries of the syncedNamespaces list are sent. If the list turns out to be changed by someone
+    else, it is read again and the patch is rebuilt.
+
+    The cluster objects are identified by their specs, see ClusterObjectSpec. Their status is loaded by observe, so the
+    cluster object indexes do not keep it.
+    """
+
+    def __init__(self):
+        self.interval = float(os.environ.get('OBJECT_CLONER_STATUS_WRITE_INTERVAL', '1'))
+        self._statuses = {}
+
+    # pylint: disable=too-many-arguments
+    async def update(self, spec, namespaces, delete=False, failures=None, synced_namespaces=None):
+        """
+        Add or refresh namespaces in the synced namespaces status, or remove them from it, and wait until the change
+        is written.
+
+        :param spec: ClusterObjectSpec
+        :param namespaces: list of namespace names
+        :param delete: Whether to remove the namespaces from the status
+        :param failures: dict of namespace name to error message for the namespaces that failed to sync
+        :param synced_namespaces: list of all namespaces that are in sync, the ones that are missing from the status
+                                  are added to it
+        :return:
+        """
+        sync_status = self._get_sync_status(spec)
+        if delete:
+            namespaces = [
+                namespace for namespace in namespaces
+                if namespace in sync_status.positions or sync_status.pending.get(namespace) is not None
+            ]
+        now = datetime.strftime(datetime.utcnow(), '%Y-%m-%dT%H:%M:%SZ')
+        if synced_namespaces is not None:
+            known_namespaces = set(sync_status.get_namespace_names()) | set(namespaces)
+            namespaces = list(namespaces) + [
+                namespace for namespace in synced_namespaces if namespace not in known_namespaces
+            ]
+        if sync_status.status_format != 'Compact':
+            failures = None
+        if not namespaces and not failures:
+            return
+        for namespace in namespaces:
+            sync_status.pending[namespace] = None if delete else now
+        sync_status.pending_failures.update(failures or {})
+        if sync_status.flush is None:
+            sync_status.flush = asyncio.ensure_future(self._flush_later(sync_status))
+        await asyncio.shield(sync_status.flush)
+
+    def observe(self, spec, status):
+        """
+        Load the status of a cluster object unless it is known already, the known status is kept up to date by the
+        writes.
+
+        :param spec: ClusterObjectSpec
+        :param status: the status of the cluster object
+        :return:
+        """
+        self._get_sync_status(spec, status)
+
+    def get_synced_namespace_names(self, spec):
+        """
+        List the synced namespaces of a cluster object including the changes that are not written yet.
+
+        :param spec: ClusterObjectSpec
+        :return: list of namespace names
+        """
+        return self._get_sync_status(spec).get_namespace_names()
+
+    def forget(self, spec):
+        """
+        Drop the copy of the status of a deleted cluster object.
+
+        :param spec: ClusterObjectSpec
+        :return:
+        """
+        self._statuses.pop((spec.namespace, spec.name), None)
+
+    async def flush_all(self):
+        """
+        Wait until all changes are written.
+
+        :return:
+        """
+        flushes = [sync_status.flush for sync_status in self._statuses.values() if sync_status.flush is not None]
+        await asyncio.gather(*flushes, return_exceptions=True)
+
+    def _get_sync_status(self, spec, status=None):
+        key = (spec.namespace, spec.name)
+        sync_status = self._statuses.get(key)
+        if sync_status is None or sync_status.uid != spec.uid:
+            sync_status = self._statuses[key] = SyncStatus(spec, status or {})
+        else:
+            sync_status.status_format = spec.status_format
+        return sync_status
+
+    async def _flush_later(self, sync_status):
+        await asyncio.sleep(self.interval)
+        # The changes made from now on are written by the next flush.
+        sync_status.flush = None
+        changes, sync_status.pending = sync_status.pending, {}
+        failures, sync_status.pending_failures = sync_status.pending_failures, {}
+        try:
+            async with sync_status.lock:
+                await self._write(sync_status, changes, failures)
+        except Exception:
+            for namespace, timestamp in changes.items():
+                sync_status.pending.setdefault(namespace, timestamp)
+            for namespace, message in failures.items():
+                sync_status.pending_failures.setdefault(namespace, message)
+            raise
+
+    async def _write(self, sync_status, changes, failures):
+        for attempt in range(3):
+            content_type, patch, status = sync_status.get_patch(changes, failures)
+            if not patch:
+                return
+            try:
+                await patch_namespaced_object(
+                    sync_status.object_attrs['group'],
+                    sync_status.object_attrs['version'],
+                    sync_status.object_attrs['kind'],
+                    sync_status.object_attrs['namespace'],
+                    sync_status.object_attrs['name'],
+                    patch,
+                    subresource='status',
+                    content_type=content_type
+                )
+            except HTTPError as err:
+                if err.code not in (409, 422) or attempt == 2:
+                    raise
+                body = await get_namespaced_object(*sync_status.object_attrs.values())
+                sync_status.load(body.get('status') or {})
+                changes = {
+                    namespace: timestamp for namespace, timestamp in changes.items()
+                    if timestamp is not None or namespace in sync_status.positions
+                }
+                continue
+            sync_status.load(status)
+            if sync_status.status_format == 'Compact':
+                sync_status.synced_namespaces = None
+            return
+
+
+def get_status_format(body):
+    """
+    Return the synced namespaces status format of a cluster object.
+
+    :param body: the cluster object
+    :return: List or Compact
+    """
+    status_format = body['spec'].get('statusFormat', 'Default')
+    if status_format == 'Default':
+        status_format = os.environ.get('OBJECT_CLONER_STATUS_FORMAT', 'List')
+    return status_format
+
+
+def _test_name(position, name):
+    return {'op': 'test', 'path': f'/status/syncedNamespaces/{position}/name', 'value': name}
+
+
+status_writer = StatusWriter()
@@ -0,0 +1,102 @@
+"""Per cluster object queue of syncs."""
+import asyncio
+import os
+
+from .kubeapi import request_budget
+from .metrics import SYNC_QUEUE_DEPTH
+
+
+class SyncQueue:
+    """
+    Debounces and serializes the syncs of cluster objects.
+
+    A sync requested for a cluster object starts after OBJECT_CLONER_SYNC_DEBOUNCE_INTERVAL seconds, and all syncs
+    requested for it in the meantime are merged into it: the latest cluster object definition wins, and the target
+    namespaces are joined. Only one sync of a cluster object runs at a time; the syncs requested while it runs are
+    merged into a single follow-up sync.
+    """
+
+    def __init__(self):
+        self.interval = float(os.environ.get('OBJECT_CLONER_SYNC_DEBOUNCE_INTERVAL', '1'))
+        self._pending = {}
+        self._workers = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def sync(self, cluster_object, namespace_names=None, budget=None):
+        """
+        Request a sync of a cluster object and wait until a sync that covers the request is finished.
+
+        :param cluster_object: ClusterObject
+        :param namespace_names: list of target namespaces, all selected namespaces if omitted
+        :param budget: RateLimiter of the API requests of the sync, it is dropped if the sync is merged with a request
+                       without a budget
+        :return: the result of ClusterObject.sync_to_namespaces
+        """
+        key = (cluster_object.namespace, cluster_object.name)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _PendingSync(cluster_object, namespace_names, budget)
+        else:
+            pending.merge(cluster_object, namespace_names, budget)
+        if key not in self._workers:
+            self._workers[key] = asyncio.ensure_future(self._work(key))
+        return await asyncio.shield(pending.result)
+
+    def cancel(self, cluster_object):
+        """
+        Drop the pending sync of a deleted cluster object. The callers that wait for it get None.
+
+        :param cluster_object: ClusterObject
+        :return:
+        """
+        pending = self._pending.pop((cluster_object.namespace, cluster_object.name), None)
+        if pending is not None:
+            pending.result.set_result(None)
+
+    async def _work(self, key):
+        try:
+            while key in self._pending:
+                await asyncio.sleep(self.interval)
+                pending = self._pending.pop(key, None)
+                if pending is None:
+                    break
+                budget_token = request_budget.set(pending.budget)
+                try:
+                    pending.result.set_result(await pending.cluster_object.sync_to_namespaces(pending.namespace_names))
+                except Exception as err:  # pylint: disable=broad-exception-caught
+                    pending.result.set_exception(err)
+                finally:
+                    request_budget.reset(budget_token)
+        finally:
+            del self._workers[key]
+
+
+class _PendingSync:  # pylint: disable=too-few-public-methods
+    def __init__(self, cluster_object, namespace_names, budget):
+        self.cluster_object = cluster_object
+        self.namespace_names = None if namespace_names is None else list(namespace_names)
+        self.budget = budget
+        self.result = asyncio.get_running_loop().create_future()
+
+    def merge(self, cluster_object, namespace_names, budget):
+        """
+        Merge another sync request into this one.
+
+        :param cluster_object: the latest definition of the cluster object
+        :param namespace_names: list of target namespaces, all selected namespaces if None
+        :param budget: RateLimiter of the request or None
+        :return:
+        """
+        self.cluster_object = cluster_object
+        if budget is not self.budget:
+            self.budget = None
+        if self.namespace_names is None or namespace_names is None:
+            self.namespace_names = None
+        else:
+            self.namespace_names += [name for name in namespace_names if name not in self.namespace_names]
+
+
+sync_queue = SyncQueue()
+SYNC_QUEUE_DEPTH.set_function(lambda: len(sync_queue))
@@ -0,0 +1,91 @@
+"""
+Shared fixtures of the tests.
+
+The operator modules read their settings on import, so the environment of the benchmarks is set up before they are
+imported by the tests. The coroutine tests are run in a new event loop each, and the shared Kubernetes API client is
+closed after each of them.
+"""
+import asyncio
+import inspect
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.__main__ import BENCHMARK_ENVIRONMENT
+from benchmarks.fakeapi import FakeApiProcess
+
+for variable, value in BENCHMARK_ENVIRONMENT.items():
+    os.environ.setdefault(variable, value)
+# The tests change the source objects between the syncs.
+os.environ.setdefault('OBJECT_CLONER_SOURCE_CACHE_TTL', '0')
+
+# pylint: disable=wrong-import-position
+from objectcloner.operator.kubeapi import close_api
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """
+    Run the coroutine tests.
+
+    :param pyfuncitem:
+    :return: True if the test is run
+    """
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {
+        name: pyfuncitem.funcargs[name] for name in inspect.signature(pyfuncitem.obj).parameters
+    }
+    asyncio.run(_run_test(pyfuncitem.obj(**arguments)))
+    return True
+
+
+async def _run_test(test):
+    try:
+        await test
+    finally:
+        await close_api()
+
+
+@pytest.fixture(scope='session')
+def fake_api_process():
+    """
+    Run the fake Kubernetes API server of the benchmarks and point the operator to it.
+
+    :return: FakeApiProcess
+    """
+    with FakeApiProcess() as fake, tempfile.TemporaryDirectory() as directory:
+        fake.write_kubeconfig(os.path.join(directory, 'kubeconfig'))
+        os.environ['KUBECONFIG'] = os.path.join(directory, 'kubeconfig')
+        yield fake
+
+
+@pytest.fixture
+def fake_api(fake_api_process):  # pylint: disable=redefined-outer-name
+    """
+    Return the fake Kubernetes API server without objects.
+
+    :param fake_api_process:
+    :return: FakeApiProcess
+    """
+    asyncio.run(fake_api_process.reset())
+    return fake_api_process
+
+
+@pytest.fixture
+def make_cluster_object_body():
+    """
+    Return a builder of cluster object bodies.
+
+    :return: function of the namespace, name and spec fields
+    """
+    def make(namespace, name, **spec):
+        spec.setdefault('sourceObject', {'group': '', 'version': 'v1', 'kind': 'Secret'})
+        return {
+            'apiVersion': 'object-cloner.ideamix.es/v1',
+            'kind': 'ClusterObject',
+            'metadata': {'namespace': namespace, 'name': name, 'uid': f'{namespace}-{name}-uid', 'generation': 1},
+            'spec': spec
+        }
+    return make
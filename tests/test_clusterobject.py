@@ -0,0 +1,121 @@
+# pylint: disable=missing-docstring
+import logging
+
+import pytest
+
+from objectcloner.operator.clusterobject import ClusterObject, ClusterObjectSpec
+from objectcloner.operator.resources import get_namespaced_object, list_namespaced_objects
+from objectcloner.operator.statuswriter import status_writer
+
+NAMESPACE_NAMES = ['source', 'target']
+
+logger = logging.getLogger('tests')
+
+
+@pytest.fixture
+def cluster_object(make_cluster_object_body):
+    """
+    Return a cluster object that clones the secret Secret of the source namespace and has a field excluded.
+
+    :param make_cluster_object_body:
+    :return: ClusterObject
+    """
+    body = make_cluster_object_body('source', 'secret', fieldsToExclude=['.data.local'])
+    spec = ClusterObjectSpec(body)
+    yield ClusterObject(spec, NAMESPACE_NAMES, logger)
+    status_writer.forget(spec)
+
+
+async def seed_source_object(fake_api, cluster_object):  # pylint: disable=redefined-outer-name
+    body = {'apiVersion': 'object-cloner.ideamix.es/v1', 'kind': 'ClusterObject', **cluster_object.spec.reference}
+    await fake_api.seed([
+        ('object-cloner.ideamix.es', 'v1', 'clusterobjects', 'source', {**body, 'spec': {}}),
+        ('', 'v1', 'secrets', 'source', {
+            'apiVersion': 'v1',
+            'kind': 'Secret',
+            'metadata': {'name': 'secret', 'labels': {'app': 'web'}},
+            'data': {'password': 'x'}
+        }),
+    ])
+
+
+async def change_clone(fake_api, change):
+    clone = await get_namespaced_object('', 'v1', 'Secret', 'target', 'secret')
+    change(clone)
+    await fake_api.seed([('', 'v1', 'secrets', 'target', clone)])
+
+
+def add_fields(clone):
+    clone['data'].update(password='y', username='z', local='kept')
+    clone['metadata']['labels']['extra'] = 'true'
+
+
+async def get_clone():
+    return await get_namespaced_object('', 'v1', 'Secret', 'target', 'secret')
+
+
+async def test_repair_deletes_added_fields(fake_api, cluster_object):  # pylint: disable=redefined-outer-name
+    await seed_source_object(fake_api, cluster_object)
+    assert await cluster_object.sync_to_namespaces()
+    await change_clone(fake_api, add_fields)
+    assert await cluster_object.repair_target_object('target')
+    clone = await get_clone()
+    # The excluded fields are not copied, so the ones set on the clone are kept.
+    assert clone['data'] == {'password': 'x', 'local': 'kept'}
+    assert 'extra' not in clone['metadata']['labels']
+    # The repaired clone is in sync, so it is not written again.
+    assert not await cluster_object.repair_target_object('target')
+
+
+async def test_resync_deletes_added_fields(fake_api, cluster_object):  # pylint: disable=redefined-outer-name
+    await seed_source_object(fake_api, cluster_object)
+    assert await cluster_object.sync_to_namespaces()
+    # The source hash annotation of the clone stays current.
+    await change_clone(fake_api, add_fields)
+    cluster_object.is_drift_verification_enabled = True
+    assert await cluster_object.sync_to_namespaces()
+    clone = await get_clone()
+    assert clone['data'] == {'password': 'x', 'local': 'kept'}
+    assert 'extra' not in clone['metadata']['labels']
+    await fake_api.reset_calls()
+    assert await cluster_object.sync_to_namespaces()
+    assert not {verb for verb, _ in await fake_api.get_calls()} & {'update', 'patch', 'create'}
+
+
+async def test_sync_deletes_fields_deleted_from_source(fake_api, cluster_object):  # pylint: disable=redefined-outer-name
+    await seed_source_object(fake_api, cluster_object)
+    assert await cluster_object.sync_to_namespaces()
+    await fake_api.seed([('', 'v1', 'secrets', 'source', {
+        'apiVersion': 'v1',
+        'kind': 'Secret',
+        'metadata': {'name': 'secret'},
+        'data': {'username': 'z'}
+    })])
+    assert await cluster_object.sync_to_namespaces()
+    clone = await get_clone()
+    assert clone['data'] == {'username': 'z'}
+    assert 'app' not in clone['metadata']['labels']
+
+
+async def test_delete_all_deletes_only_own_clones_of_compact_status(fake_api, make_cluster_object_body):
+    spec = ClusterObjectSpec(make_cluster_object_body('source', 'secret', statusFormat='Compact'))
+    compact_cluster_object = ClusterObject(spec, [*NAMESPACE_NAMES, 'other'], logger)
+
+    def make_clone(owner):
+        return {
+            'apiVersion': 'v1',
+            'kind': 'Secret',
+            'metadata': {
+                'name': 'secret',
+                'annotations': {'object-cloner.ideamix.es/source-hash': 'hash', 'object-cloner.ideamix.es/owner': owner}
+            }
+        }
+
+    await fake_api.seed([
+        ('', 'v1', 'secrets', 'source', make_clone('source/secret')),
+        ('', 'v1', 'secrets', 'target', make_clone('source/secret')),
+        ('', 'v1', 'secrets', 'other', make_clone('other/secret')),
+    ])
+    await compact_cluster_object.delete_all_target_objects()
+    secrets = await list_namespaced_objects('', 'v1', 'Secret')
+    assert sorted(secret['metadata']['namespace'] for secret in secrets) == ['other', 'source']
@@ -0,0 +1,52 @@
+# pylint: disable=missing-docstring
+import logging
+
+import kopf
+
+from prometheus_client import REGISTRY
+
+from objectcloner.operator.clusterobject import ClusterObject, ClusterObjectSpec
+from objectcloner.operator import handlers
+from objectcloner.operator.handlers import on_delete_clusterobject, on_namespace_event
+from objectcloner.operator.selectors import cluster_object_index
+
+logger = logging.getLogger('tests')
+
+
+async def test_delete_forgets_cluster_object(fake_api, make_cluster_object_body):  # pylint: disable=unused-argument
+    body = make_cluster_object_body('source', 'deleted')
+    spec = ClusterObjectSpec(body)
+    cluster_object_index.add(('source', 'deleted'), spec)
+    # The source object does not exist.
+    assert not await ClusterObject(spec, ['source', 'target'], logger).sync_to_namespaces()
+    labels = {'namespace': 'source', 'name': 'deleted'}
+    assert REGISTRY.get_sample_value('object_cloner_sync_duration_seconds_count', labels) == 1
+    await on_delete_clusterobject(
+        body=body,
+        idx_namespace_names={},
+        idx_namespace_labels={},
+        idx_labeled_namespace_names={},
+        logger=logger
+    )
+    assert cluster_object_index.get_spec(('source', 'deleted')) is None
+    assert REGISTRY.get_sample_value('object_cloner_sync_duration_seconds_count', labels) is None
+
+
+async def test_namespace_event_syncs_relabeled_namespace(monkeypatch):
+    relabels = []
+
+    async def sync_relabeled_namespace(name, old_labels, new_labels):
+        relabels.append((name, old_labels, new_labels))
+
+    monkeypatch.setattr(handlers, 'sync_relabeled_namespace', sync_relabeled_namespace)
+    memo = kopf.Memo()
+
+    async def handle_event(event_type, labels):
+        await on_namespace_event(type=event_type, name='team-a', memo=memo, idx_namespace_labels={'team-a': [labels]})
+
+    # The namespaces found on start and the created ones are synced by the other handlers.
+    await handle_event(None, {'team': 'a'})
+    await handle_event('MODIFIED', {'team': 'a'})
+    assert not relabels
+    await handle_event('MODIFIED', {'team': 'b'})
+    assert relabels == [('team-a', {'team': 'a'}, {'team': 'b'})]
@@ -0,0 +1,62 @@
+# pylint: disable=missing-docstring
+import copy
+
+from objectcloner.operator.helpers import FieldExclusions, get_field_exclusions, null_missing_fields
+
+OBJECT = {
+    'metadata': {
+        'name': 'secret',
+        'labels': {'app': 'web'},
+        'annotations': {'a': '1'},
+        'managedFields': [{'manager': 'kubectl'}],
+    },
+    'data': {'password': 'x', 'username': 'y'},
+    'status': {'phase': 'Active'},
+}
+
+
+def test_project_does_not_modify_object():
+    obj = copy.deepcopy(OBJECT)
+    projection = get_field_exclusions(('.status', '.metadata.annotations', '.data.password')).project(obj)
+    assert projection == {
+        'metadata': {'name': 'secret', 'labels': {'app': 'web'}, 'managedFields': [{'manager': 'kubectl'}]},
+        'data': {'username': 'y'},
+    }
+    assert obj == OBJECT
+    # The values that are not on the paths to the excluded fields are shared.
+    assert projection['metadata']['labels'] is obj['metadata']['labels']
+
+
+def test_project_returns_same_object_if_nothing_is_excluded():
+    obj = copy.deepcopy(OBJECT)
+    assert get_field_exclusions(('.spec', '.metadata.uid', '.data.password.value')).project(obj) is obj
+
+
+def test_project_drops_emptied_dicts():
+    projection = get_field_exclusions(('.metadata.labels.app',)).project(OBJECT)
+    assert 'labels' not in projection['metadata']
+
+
+def test_project_matches_regular_expressions():
+    exclusions = FieldExclusions([['metadata', '(annotations|managedFields)'], ['data', 'pass.*']])
+    projection = exclusions.project(OBJECT)
+    assert projection['metadata'] == {'name': 'secret', 'labels': {'app': 'web'}}
+    assert projection['data'] == {'username': 'y'}
+
+
+def test_project_is_the_same_as_delete():
+    exclusions = get_field_exclusions(('.status', '.metadata.labels.app', '.metadata.m', '.data.username'))
+    obj = copy.deepcopy(OBJECT)
+    exclusions.delete(obj)
+    assert exclusions.project(OBJECT) == obj
+
+
+def test_null_missing_fields_keeps_excluded_fields():
+    obj = copy.deepcopy(OBJECT)
+    reference = {'metadata': {'name': 'secret'}, 'data': {'password': 'x'}}
+    null_missing_fields(obj, get_field_exclusions(('.status', '.metadata.managedFields')).project(obj), reference)
+    assert obj == {
+        'metadata': {'name': 'secret', 'labels': None, 'annotations': None, 'managedFields': [{'manager': 'kubectl'}]},
+        'data': {'password': 'x', 'username': None},
+        'status': {'phase': 'Active'},
+    }
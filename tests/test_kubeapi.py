@@ -0,0 +1,94 @@
+# pylint: disable=missing-docstring
+import pytest
+
+from objectcloner.operator import kubeapi
+from objectcloner.operator.kubeapi import RateLimiter, RetryPolicy
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Freeze the monotonic time of the rate limiter and record its sleeps instead of waiting.
+
+    :param monkeypatch:
+    :return: dict with the current time and the list of the sleeps
+    """
+    state = {'now': 0.0, 'sleeps': []}
+
+    async def sleep(delay):
+        state['sleeps'].append(round(delay, 6))
+
+    monkeypatch.setattr(kubeapi.time, 'monotonic', lambda: state['now'])
+    monkeypatch.setattr(kubeapi.asyncio, 'sleep', sleep)
+    return state
+
+
+async def test_rate_limiter_allows_burst_then_waits(clock):  # pylint: disable=redefined-outer-name
+    limiter = RateLimiter(qps=10, burst=2)
+    for _ in range(4):
+        await limiter.acquire()
+    # The waiting requests reserve the tokens, so each one waits longer.
+    assert clock['sleeps'] == [0.1, 0.2]
+    clock['now'] += 0.5
+    await limiter.acquire()
+    await limiter.acquire()
+    assert clock['sleeps'] == [0.1, 0.2]
+    await limiter.acquire()
+    assert clock['sleeps'] == [0.1, 0.2, 0.1]
+
+
+async def test_rate_limiter_is_disabled_without_qps(clock):  # pylint: disable=redefined-outer-name
+    limiter = RateLimiter(qps=0, burst=1)
+    for _ in range(10):
+        await limiter.acquire()
+    assert not clock['sleeps']
+
+
+@pytest.fixture
+def retry_policy(monkeypatch):
+    """
+    Return a retry policy whose random delays are the longest ones.
+
+    :param monkeypatch:
+    :return: RetryPolicy
+    """
+    monkeypatch.setattr(kubeapi.random, 'uniform', lambda low, high: high)
+    policy = RetryPolicy()
+    policy.max_retries = 5
+    policy.base_delay = 0.5
+    policy.max_delay = 30
+    return policy
+
+
+@pytest.mark.parametrize('attempt, retry_after, delay', [
+    (0, None, 0.5),
+    (3, None, 4.0),
+    (10, None, 30),
+    (0, '10', 10),
+    (0, '100', 30),
+    (3, '1', 4.0),
+    (0, 'Wed, 21 Oct 2015 07:28:00 GMT', 0.5),
+])
+def test_retry_delay(retry_policy, attempt, retry_after, delay):  # pylint: disable=redefined-outer-name
+    assert retry_policy.get_delay(attempt, retry_after) == delay
+
+
+def test_retry_delay_is_random(monkeypatch, retry_policy):  # pylint: disable=redefined-outer-name
+    monkeypatch.setattr(kubeapi.random, 'uniform', lambda low, high: low)
+    assert retry_policy.get_delay(3) == 0
+    assert retry_policy.get_delay(3, '2') == 2
+
+
+@pytest.mark.parametrize('method, status, attempt, is_retriable', [
+    ('GET', 503, 0, True),
+    ('GET', None, 0, True),
+    ('PATCH', 500, 4, True),
+    ('PATCH', 500, 5, False),
+    ('GET', 404, 0, False),
+    ('PUT', 409, 0, False),
+    ('POST', 429, 0, True),
+    ('POST', 503, 0, False),
+    ('POST', None, 0, False),
+])
+def test_is_retriable(retry_policy, method, status, attempt, is_retriable):  # pylint: disable=redefined-outer-name
+    assert retry_policy.is_retriable(method, status, attempt) == is_retriable
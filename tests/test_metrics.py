@@ -0,0 +1,19 @@
+# pylint: disable=missing-docstring
+from prometheus_client import REGISTRY
+
+from objectcloner.operator.metrics import SYNC_DURATION, SYNC_FANOUT, forget_cluster_object
+
+LABELS = {'namespace': 'source', 'name': 'secret'}
+
+
+def test_forget_cluster_object():
+    SYNC_DURATION.labels('source', 'secret').observe(1)
+    SYNC_FANOUT.labels('source', 'secret').set(2)
+    SYNC_FANOUT.labels('source', 'other').set(3)
+    forget_cluster_object('source', 'secret')
+    assert REGISTRY.get_sample_value('object_cloner_sync_duration_seconds_count', LABELS) is None
+    assert REGISTRY.get_sample_value('object_cloner_sync_fanout_namespaces', LABELS) is None
+    assert REGISTRY.get_sample_value('object_cloner_sync_fanout_namespaces', {**LABELS, 'name': 'other'}) == 3
+    # The cluster objects that have not been synced have no series.
+    forget_cluster_object('source', 'secret')
+    forget_cluster_object('source', 'other')
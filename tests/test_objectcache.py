@@ -0,0 +1,83 @@
+# pylint: disable=missing-docstring
+import asyncio
+
+from objectcloner.operator.objectcache import ObjectCache
+
+
+def make_secret(namespace, name='secret'):
+    return ('', 'v1', 'secrets', namespace, {
+        'apiVersion': 'v1',
+        'kind': 'Secret',
+        'metadata': {'name': name},
+        'data': {'password': 'x'}
+    })
+
+
+async def test_is_warm_when_informers_are_loaded(fake_api):
+    await fake_api.seed([make_secret('source'), make_secret('target')])
+    cache = ObjectCache()
+    try:
+        assert cache.is_warm()
+        cache.track(('source', 'secret'), '', 'v1', 'Secret', 'secret', 'source')
+        assert not cache.is_warm()
+        await cache.wait_for_informer('', 'v1', 'Secret', 'secret')
+        assert cache.is_warm()
+    finally:
+        cache.stop()
+
+
+async def test_is_warm_after_wait_timeout(fake_api):  # pylint: disable=unused-argument
+    cache = ObjectCache()
+    cache.wait_timeout = 0.2
+    try:
+        # The kind does not exist, so the informer is never loaded.
+        cache.track(('source', 'unknown'), '', 'v1', 'Unknown', 'unknown', 'source')
+        await asyncio.sleep(0.1)
+        assert not cache.is_warm()
+        await asyncio.sleep(0.2)
+        assert cache.is_warm()
+    finally:
+        cache.stop()
+
+
+def count_objects(cache):
+    # pylint: disable=protected-access
+    return sum(len(informer.objects) for informers in cache._informers.values() for informer in informers.values())
+
+
+async def test_counts_objects(fake_api):
+    await fake_api.seed([make_secret('source'), make_secret('target'), make_secret('source', 'other')])
+    cache = ObjectCache()
+    try:
+        cache.track(('source', 'secret'), '', 'v1', 'Secret', 'secret', 'source')
+        cache.track(('source', 'other'), '', 'v1', 'Secret', 'other', 'source')
+        await cache.wait_for_informer('', 'v1', 'Secret', 'secret')
+        await cache.wait_for_informer('', 'v1', 'Secret', 'other')
+        assert len(cache) == count_objects(cache) == 3
+        clone = {'metadata': {'namespace': 'new', 'name': 'secret', 'resourceVersion': '100'}}
+        cache.store('', 'v1', 'Secret', clone)
+        cache.store('', 'v1', 'Secret', {'metadata': {**clone['metadata'], 'resourceVersion': '101'}})
+        assert len(cache) == count_objects(cache) == 4
+        cache.discard('', 'v1', 'Secret', 'target', 'secret')
+        cache.discard('', 'v1', 'Secret', 'target', 'secret')
+        assert len(cache) == count_objects(cache) == 3
+        cache.untrack(('source', 'other'))
+        assert len(cache) == count_objects(cache) == 2
+    finally:
+        cache.stop()
+    assert len(cache) == 0
+
+
+async def test_counts_objects_of_source_object_informers(fake_api):
+    await fake_api.seed([make_secret('source'), make_secret('target'), make_secret('other')])
+    cache = ObjectCache()
+    cache.max_objects = 2
+    try:
+        cache.track(('source', 'secret'), '', 'v1', 'Secret', 'secret', 'source')
+        await cache.wait_for_informer('', 'v1', 'Secret', 'secret')
+        # The informer of all namespaces is replaced with the one of the source object namespace.
+        assert cache.get_informer('', 'v1', 'Secret', 'secret') is None
+        assert len(cache) == count_objects(cache) == 1
+    finally:
+        cache.stop()
+    assert len(cache) == 0
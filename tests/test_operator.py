@@ -0,0 +1,42 @@
+# pylint: disable=missing-docstring,protected-access
+import asyncio
+
+import kopf
+import pytest
+from kopf._core.engines.activities import ActivityError, run_activity
+from kopf._core.intents.causes import Activity
+
+from objectcloner.operator import object_cache, resync_scheduler
+
+
+async def run_handlers(activity):
+    # kopf retries the failed handlers of an activity until they succeed.
+    return await asyncio.wait_for(run_activity(
+        lifecycle=kopf.lifecycles.all_at_once,
+        registry=kopf.get_default_registry(),
+        settings=kopf.OperatorSettings(),
+        activity=activity,
+        indices={},
+        memo=kopf.Memo(),
+    ), 10)
+
+
+async def test_startup_and_cleanup_handlers(fake_api):  # pylint: disable=unused-argument
+    await run_handlers(Activity.STARTUP)
+    try:
+        assert resync_scheduler._task is not None and not resync_scheduler._task.done()
+    finally:
+        await run_handlers(Activity.CLEANUP)
+    assert resync_scheduler._task is None
+
+
+async def test_probe_fails_until_object_cache_is_warm(fake_api):
+    await fake_api.seed([('', 'v1', 'secrets', 'source', {'metadata': {'name': 'secret'}})])
+    try:
+        object_cache.track(('source', 'secret'), '', 'v1', 'Secret', 'secret', 'source')
+        with pytest.raises(ActivityError):
+            await run_handlers(Activity.PROBE)
+        await object_cache.wait_for_informer('', 'v1', 'Secret', 'secret')
+        assert await run_handlers(Activity.PROBE) == {'cachedObjects': {'readyInformers': 1, 'informers': 1}}
+    finally:
+        object_cache.stop()
@@ -0,0 +1,80 @@
+# pylint: disable=missing-docstring
+import pytest
+
+from objectcloner.operator.clusterobject import ClusterObjectSpec
+from objectcloner.operator.selectors import ClusterObjectIndex, LabelSelector, _get_literal_prefix, \
+    get_label_requirements
+
+
+@pytest.mark.parametrize('pattern, prefix', [
+    ('team-a', 'team-a'),
+    ('team-.*', 'team-'),
+    ('team-a?', 'team-'),
+    ('team-a*', 'team-'),
+    ('team-a+', 'team-a'),
+    ('team-a{0,1}', 'team-'),
+    ('team-[ab]', 'team-'),
+    ('team-a|team-b', ''),
+    ('(?i)team', ''),
+    ('.*', ''),
+])
+def test_literal_prefix(pattern, prefix):
+    assert _get_literal_prefix(pattern) == prefix
+
+
+def test_get_name_matching(make_cluster_object_body):
+    index = ClusterObjectIndex()
+    index.cluster_object_factory = lambda spec: spec
+    specs = {
+        'all': ClusterObjectSpec(make_cluster_object_body('source', 'all')),
+        'team': ClusterObjectSpec(make_cluster_object_body('source', 'team', namespacesToInclude=['team-.*'])),
+        'team-a': ClusterObjectSpec(make_cluster_object_body(
+            'source', 'team-a', namespacesToInclude=['team-a$'], namespacesToExclude=['team-a-.*']
+        )),
+        'other': ClusterObjectSpec(make_cluster_object_body('source', 'other', namespacesToInclude=['other'])),
+    }
+    for name, spec in specs.items():
+        index.add(('source', name), spec)
+
+    def get_names(namespace_name):
+        return sorted(spec.name for spec in index.get_name_matching(namespace_name))
+
+    assert get_names('team-a') == ['all', 'team', 'team-a']
+    assert get_names('team-a-1') == ['all', 'team']
+    assert get_names('team') == ['all']
+    # The namespace of a cluster object is excluded.
+    assert get_names('source') == []
+    index.remove(('source', 'team'))
+    assert get_names('team-a') == ['all', 'team-a']
+    assert index.get_by_uid('source-team-a-uid') is specs['team-a']
+
+
+def test_label_selector_matches():
+    selector = LabelSelector((
+        ('team', 'In', ('a', 'b')),
+        ('stage', 'NotIn', ('prod',)),
+        ('owner', 'Exists', ()),
+        ('legacy', 'DoesNotExist', ()),
+    ))
+    assert selector.matches({'team': 'a', 'owner': 'x'})
+    assert selector.matches({'team': 'b', 'owner': 'x', 'stage': 'dev'})
+    assert not selector.matches({'team': 'c', 'owner': 'x'})
+    assert not selector.matches({'team': 'a', 'owner': 'x', 'stage': 'prod'})
+    assert not selector.matches({'team': 'a'})
+    assert not selector.matches({'team': 'a', 'owner': 'x', 'legacy': 'true'})
+
+
+def test_label_requirements():
+    assert get_label_requirements(None) is None
+    assert get_label_requirements({
+        'matchLabels': {'team': 'a'},
+        'matchExpressions': [{'key': 'stage', 'operator': 'NotIn', 'values': ['prod']}, {'key': 'owner', 'operator': 'Exists'}]
+    }) == (('team', 'In', ('a',)), ('stage', 'NotIn', ('prod',)), ('owner', 'Exists', ()))
+
+
+def test_label_requirements_reject_unknown_operator(make_cluster_object_body):
+    label_selector = {'matchExpressions': [{'key': 'team', 'operator': 'Gt', 'values': ['1']}]}
+    with pytest.raises(ValueError):
+        get_label_requirements(label_selector)
+    with pytest.raises(ValueError):
+        ClusterObjectSpec(make_cluster_object_body('source', 'secret', namespaceSelector=label_selector))
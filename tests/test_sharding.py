@@ -0,0 +1,75 @@
+# pylint: disable=missing-docstring,protected-access
+import collections
+import hashlib
+
+import pytest
+from pykube.exceptions import HTTPError
+
+from objectcloner.operator.resources import get_namespaced_object
+from objectcloner.operator.sharding import ShardCoordinator
+
+KEYS = [('source', f'object-{index}') for index in range(300)]
+
+
+def make_coordinator(members):
+    coordinator = ShardCoordinator()
+    coordinator.shard_count = 4
+    coordinator.members = members
+    return coordinator
+
+
+def test_owner_is_none_without_members():
+    assert make_coordinator([]).get_owner('source', 'object') is None
+
+
+def test_owner_has_highest_hash():
+    coordinator = make_coordinator([0, 1, 2])
+    digests = {shard: hashlib.sha256(f'{shard}/source/object'.encode()).digest() for shard in (0, 1, 2)}
+    assert coordinator.get_owner('source', 'object') == max(digests, key=digests.get)
+
+
+def test_owners_are_spread_across_shards():
+    coordinator = make_coordinator([0, 1, 2])
+    owners = collections.Counter(coordinator.get_owner(*key) for key in KEYS)
+    assert set(owners) == {0, 1, 2}
+    assert min(owners.values()) > len(KEYS) / 6
+
+
+def test_only_objects_of_leaving_shard_move():
+    owners = {key: make_coordinator([0, 1, 2]).get_owner(*key) for key in KEYS}
+    coordinator = make_coordinator([0, 2])
+    for key, owner in owners.items():
+        if owner != 1:
+            assert coordinator.get_owner(*key) == owner
+        else:
+            assert coordinator.get_owner(*key) in (0, 2)
+
+
+def test_only_objects_taken_by_joining_shard_move():
+    owners = {key: make_coordinator([0, 1, 2]).get_owner(*key) for key in KEYS}
+    coordinator = make_coordinator([0, 1, 2, 3])
+    new_owners = {key: coordinator.get_owner(*key) for key in KEYS}
+    assert {new_owners[key] for key, owner in owners.items() if new_owners[key] != owner} == {3}
+
+
+async def change_lease(fake_api, change):
+    lease = await get_namespaced_object('coordination.k8s.io', 'v1', 'Lease', 'default', 'object-cloner-shard-0')
+    change(lease)
+    await fake_api.seed([('coordination.k8s.io', 'v1', 'leases', 'default', lease)])
+
+
+async def test_renew_resolves_conflict_while_holding_lease(fake_api):
+    coordinator = make_coordinator([])
+    coordinator.shard_count = 1
+    coordinator.namespace = 'default'
+    coordinator.identity = 'replica-a'
+    await coordinator.acquire()
+    assert coordinator.shard == 0
+    await change_lease(fake_api, lambda lease: lease['metadata'].setdefault('labels', {}).update(team='a'))
+    await coordinator._renew()
+    # The Lease is renewed with the resourceVersion of the changed Lease.
+    assert coordinator._lease['metadata']['labels']['team'] == 'a'
+    await change_lease(fake_api, lambda lease: lease['spec'].update(holderIdentity='replica-b'))
+    with pytest.raises(HTTPError) as error:
+        await coordinator._renew()
+    assert error.value.code == 409
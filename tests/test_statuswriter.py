@@ -0,0 +1,76 @@
+# pylint: disable=missing-docstring
+from objectcloner.operator.clusterobject import ClusterObjectSpec
+from objectcloner.operator.helpers import get_object_hash
+from objectcloner.operator.statuswriter import SyncStatus
+
+
+def test_list_patch_changes_entries_in_place(make_cluster_object_body):
+    spec = ClusterObjectSpec(make_cluster_object_body('source', 'secret', statusFormat='List'))
+    sync_status = SyncStatus(spec, {'syncedNamespaces': [
+        {'name': 'a', 'timestamp': 't0'},
+        {'name': 'b', 'timestamp': 't0'},
+        {'name': 'c', 'timestamp': 't0'},
+    ]})
+    content_type, patch, status = sync_status.get_patch({'a': None, 'c': 't1', 'd': 't1'}, {})
+    assert content_type == 'application/json-patch+json'
+    assert patch == [
+        {'op': 'test', 'path': '/status/syncedNamespaces/0/name', 'value': 'a'},
+        {'op': 'remove', 'path': '/status/syncedNamespaces/0'},
+        {'op': 'test', 'path': '/status/syncedNamespaces/1/name', 'value': 'c'},
+        {'op': 'add', 'path': '/status/syncedNamespaces/1/timestamp', 'value': 't1'},
+        {'op': 'add', 'path': '/status/syncedNamespaces/-', 'value': {'name': 'd', 'timestamp': 't1'}},
+    ]
+    assert status == {'syncedNamespaces': [
+        {'name': 'b', 'timestamp': 't0'},
+        {'name': 'c', 'timestamp': 't1'},
+        {'name': 'd', 'timestamp': 't1'},
+    ]}
+
+
+def test_list_patch_removes_entries_from_the_end(make_cluster_object_body):
+    spec = ClusterObjectSpec(make_cluster_object_body('source', 'secret', statusFormat='List'))
+    sync_status = SyncStatus(spec, {'syncedNamespaces': [{'name': 'a'}, {'name': 'b'}, {'name': 'c'}]})
+    _, patch, status = sync_status.get_patch({'a': None, 'c': None}, {})
+    assert [operation['path'] for operation in patch if operation['op'] == 'remove'] == [
+        '/status/syncedNamespaces/2',
+        '/status/syncedNamespaces/0',
+    ]
+    assert status == {'syncedNamespaces': [{'name': 'b'}]}
+
+
+def test_list_patch_writes_whole_list_if_it_does_not_exist(make_cluster_object_body):
+    spec = ClusterObjectSpec(make_cluster_object_body('source', 'secret', statusFormat='List'))
+    sync_status = SyncStatus(spec, {})
+    content_type, patch, status = sync_status.get_patch({'a': 't1', 'b': None}, {})
+    assert content_type == 'application/merge-patch+json'
+    assert patch == {'status': {'syncedNamespaces': [{'name': 'a', 'timestamp': 't1'}]}}
+    assert status == {'syncedNamespaces': [{'name': 'a', 'timestamp': 't1'}]}
+
+
+def test_compact_patch_summarizes_namespaces(make_cluster_object_body):
+    spec = ClusterObjectSpec(make_cluster_object_body('source', 'secret', statusFormat='Compact'))
+    sync_status = SyncStatus(spec, {'syncedNamespaces': [{'name': 'a'}, {'name': 'b'}]})
+    content_type, patch, status = sync_status.get_patch({'a': None, 'c': 't1'}, {'d': 'forbidden'})
+    sync_summary = patch['status']['syncSummary']
+    assert content_type == 'application/merge-patch+json'
+    # The list written in the List format is dropped.
+    assert patch['status']['syncedNamespaces'] is None
+    assert sync_summary['count'] == 2
+    assert sync_summary['namespacesHash'] == get_object_hash(['b', 'c'])
+    assert [(change['name'], change['action']) for change in sync_summary['recentChanges']] == [
+        ('a', 'Removed'),
+        ('c', 'Synced'),
+    ]
+    assert [(failure['name'], failure['message']) for failure in sync_summary['failures']] == [('d', 'forbidden')]
+    assert status['syncedNamespaces'] == [{'name': 'b'}, {'name': 'c'}]
+
+
+def test_compact_patch_drops_failures_of_changed_namespaces(make_cluster_object_body):
+    spec = ClusterObjectSpec(make_cluster_object_body('source', 'secret', statusFormat='Compact'))
+    sync_status = SyncStatus(spec, {'syncSummary': {'failures': [
+        {'name': 'a', 'message': 'forbidden', 'timestamp': 't0'},
+        {'name': 'b', 'message': 'forbidden', 'timestamp': 't0'},
+    ]}})
+    _, patch, _ = sync_status.get_patch({'a': 't1'}, {})
+    assert 'syncedNamespaces' not in patch['status']
+    assert [failure['name'] for failure in patch['status']['syncSummary']['failures']] == ['b']
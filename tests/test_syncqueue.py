@@ -0,0 +1,82 @@
+# pylint: disable=missing-docstring
+import asyncio
+
+from objectcloner.operator.kubeapi import RateLimiter, request_budget
+from objectcloner.operator.syncqueue import SyncQueue
+
+
+class FakeClusterObject:  # pylint: disable=too-few-public-methods
+    def __init__(self, version=1):
+        self.namespace = 'source'
+        self.name = 'secret'
+        self.version = version
+        self.syncs = []
+
+    async def sync_to_namespaces(self, namespace_names=None):
+        self.syncs.append((self.version, namespace_names, request_budget.get()))
+        return True
+
+
+def make_queue():
+    queue = SyncQueue()
+    queue.interval = 0.01
+    return queue
+
+
+async def test_merges_namespaces():
+    queue = make_queue()
+    cluster_object = FakeClusterObject()
+    results = await asyncio.gather(
+        queue.sync(cluster_object, ['a']),
+        queue.sync(cluster_object, ['b', 'a']),
+        queue.sync(cluster_object, ['c']),
+    )
+    assert results == [True, True, True]
+    assert cluster_object.syncs == [(1, ['a', 'b', 'c'], None)]
+    assert len(queue) == 0
+
+
+async def test_merges_into_sync_of_all_namespaces():
+    queue = make_queue()
+    cluster_object = FakeClusterObject()
+    await asyncio.gather(queue.sync(cluster_object, ['a']), queue.sync(cluster_object))
+    assert cluster_object.syncs == [(1, None, None)]
+
+
+async def test_latest_cluster_object_wins():
+    queue = make_queue()
+    old_cluster_object = FakeClusterObject(1)
+    new_cluster_object = FakeClusterObject(2)
+    await asyncio.gather(queue.sync(old_cluster_object, ['a']), queue.sync(new_cluster_object, ['b']))
+    assert not old_cluster_object.syncs
+    assert new_cluster_object.syncs == [(2, ['a', 'b'], None)]
+
+
+async def test_keeps_budget_of_merged_requests_only_if_they_share_it():
+    queue = make_queue()
+    budget = RateLimiter(1, 1)
+    cluster_object = FakeClusterObject()
+    await asyncio.gather(queue.sync(cluster_object, budget=budget), queue.sync(cluster_object, budget=budget))
+    await asyncio.gather(queue.sync(cluster_object, budget=budget), queue.sync(cluster_object))
+    assert [budget for _, _, budget in cluster_object.syncs] == [budget, None]
+
+
+async def test_requests_made_while_syncing_are_merged_into_follow_up():
+    queue = make_queue()
+    cluster_object = FakeClusterObject()
+    first_sync = asyncio.ensure_future(queue.sync(cluster_object, ['a']))
+    while not cluster_object.syncs:
+        await asyncio.sleep(0.001)
+    await asyncio.gather(first_sync, queue.sync(cluster_object, ['b']), queue.sync(cluster_object, ['c']))
+    assert cluster_object.syncs == [(1, ['a'], None), (1, ['b', 'c'], None)]
+
+
+async def test_cancel_returns_none():
+    queue = make_queue()
+    cluster_object = FakeClusterObject()
+    sync = asyncio.ensure_future(queue.sync(cluster_object, ['a']))
+    await asyncio.sleep(0)
+    queue.cancel(cluster_object)
+    assert await sync is None
+    await asyncio.sleep(0.02)
+    assert not cluster_object.syncs